@@ -0,0 +1,206 @@
+"""File: benchmark.py
+Times init_recipes and every query function (QUESTIONS 4 to 22) on synthetic collections of growing size.
+Reports time, throughput, peak memory and how each function scales, and saves it all for later comparison.
+Usage: python3 benchmark.py [--sizes 1000 10000 ...] [--depth 2] [--compare bench_results/previous.json]"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+
+import repositories as rps
+from generate import generate_recipes
+
+# (name, callable taking the recipes and a model recipe), as in main.tests
+QUERIES = (
+    ("4. get_recipe_titles", lambda rcp, model: rps.get_recipe_titles(rcp)),
+    ("5. get_total_ingredient_count", lambda rcp, model: rps.get_total_ingredient_count(rcp, 'egg')),
+    ("6. get_recipes_with_ingredient", lambda rcp, model: rps.get_recipes_with_ingredient(rcp, 'egg')),
+    ("7. get_all_ingredient_counts", lambda rcp, model: rps.get_all_ingredient_counts(rcp, 'egg')),
+    ("8. filter_under_calories", lambda rcp, model: rps.filter_under_calories(rcp, 500)),
+    ("9. get_amount_str", lambda rcp, model: rps.get_amount_str(model, model.flat_ingredients[0].name)),
+    ("10. get_prep_steps", lambda rcp, model: rps.get_prep_steps(model, 0, 2)),
+    ("11. filter_above_steps", lambda rcp, model: rps.filter_above_steps(rcp, 5)),
+    ("12. filter_by_no_ingredient", lambda rcp, model: rps.filter_by_no_ingredient(rcp, 'butter')),
+    ("13. get_similar_recipes", lambda rcp, model: rps.get_similar_recipes(rcp, model)),
+    ("14. max_calories", lambda rcp, model: rps.max_calories(rcp)),
+    ("15. get_most_common_unit", lambda rcp, model: rps.get_most_common_unit(rcp)),
+    ("16. get_diff_ingredient_count", lambda rcp, model: rps.get_diff_ingredient_count(rcp)),
+    ("17. max_fat", lambda rcp, model: rps.max_fat(rcp)),
+    ("18. get_most_common_ingredient", lambda rcp, model: rps.get_most_common_ingredient(rcp)),
+    ("19. sort_by_ingredient_count", lambda rcp, model: rps.sort_by_ingredient_count(rcp)),
+    ("20. get_ingredient_usages", lambda rcp, model: rps.get_ingredient_usages(rcp)),
+    ("21. get_recipe_repartition", lambda rcp, model: rps.get_recipe_repartition(rcp)),
+    ("22. get_easiest_recipe", lambda rcp, model: rps.get_easiest_recipe(rcp)),
+)
+
+
+def time_call(func, repeat: int):
+    """
+    Times a call: once cold, then repeat more times.
+    :param func: callable without arguments
+    :param repeat: number of warm calls
+    :return: (cold time, median warm time) in seconds
+    """
+    start = time.perf_counter()
+    func()
+    cold = time.perf_counter() - start
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        warm.append(time.perf_counter() - start)
+    return cold, statistics.median(warm) if warm else cold
+
+
+def get_peak_memory(func):
+    """
+    Get the peak memory allocated by a call, with tracemalloc (which slows it down, so it isn't timed).
+    :param func: callable without arguments
+    :return: peak size in bytes
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_size(count: int, depth: int, repeat: int, data_dir: str, memory: bool):
+    """
+    Benchmarks every function on a collection of a given size, generating it if needed.
+    Each query is timed cold on a collection without any index, so that the index it needs is built in that call.
+    :param count: number of recipes
+    :param depth: maximum nesting depth of ingredients
+    :param repeat: number of warm calls per function
+    :param data_dir: where the generated collections are kept
+    :param memory: True to also measure peak memory
+    :return: dict of function name -> measures
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    filename = os.path.join(data_dir, f"recipes_{count}_{depth}.xml")
+    if not os.path.exists(filename):
+        print(f"Generating {filename}...")
+        generate_recipes(filename, count, depth)
+
+    results = {}
+
+    def record(name, func, cold, warm):
+        """Stores and prints the measures of a function."""
+        results[name] = {'cold': cold, 'warm': warm, 'throughput': count / warm if warm else math.inf}
+        if memory:
+            results[name]['peak'] = get_peak_memory(func)
+        print(f"  {name:<32} cold {cold * 1000:>10.2f} ms   warm {warm * 1000:>10.2f} ms   "
+              f"{results[name]['throughput']:>14,.0f} recipes/s"
+              + (f"   peak {results[name]['peak'] / 1e6:>9.2f} MB" if memory else ''))
+
+    print(f"{count} recipes (depth {depth}):")
+    parse = lambda: rps.init_recipes(filename, use_snapshot=False)
+    cold, warm = time_call(parse, repeat)
+    record("3. init_recipes (XML)", parse, cold, warm)
+
+    rps.init_recipes(filename)  # Writes the snapshot
+    load = lambda: rps.init_recipes(filename)
+    cold, warm = time_call(load, repeat)
+    record("3. init_recipes (snapshot)", load, cold, warm)
+
+    recipes = rps.init_recipes(filename)
+    model = next(iter(recipes.values()))
+    for name, query in QUERIES:
+        func = lambda: query(recipes, model)
+        recipes.derived.clear()  # Cold means without any index
+        cold, warm = time_call(func, repeat)
+        if memory:
+            recipes.derived.clear()
+        record(name, func, cold, warm)
+    return results
+
+
+def get_scaling(results: dict):
+    """
+    Get how each function scales: the exponent k in time ~ size^k, between the smallest and the largest size.
+    About 1 is linear, 2 quadratic, close to 0 means the cost barely depends on the size.
+    :param results: dict of size -> function name -> measures
+    :return: dict of function name -> exponent, for the warm time
+    """
+    sizes = sorted(results, key=int)
+    if len(sizes) < 2:
+        return {}
+    low, high = sizes[0], sizes[-1]
+    return {
+        name: math.log(max(results[high][name]['warm'], 1e-9) / max(results[low][name]['warm'], 1e-9))
+        / math.log(int(high) / int(low))
+        for name in results[low] if name in results[high]
+    }
+
+
+def compare(results: dict, previous: dict, threshold: float):
+    """
+    Prints how the warm times changed since a previous run, flagging regressions.
+    :param results: dict of size -> function name -> measures
+    :param previous: same, from a saved run
+    :param threshold: relative slowdown to flag (0.2 for 20% slower)
+    :return: number of regressions
+    """
+    regressions = 0
+    print(f"Compared to previous run (regression threshold {threshold:.0%}):")
+    for size in sorted(set(results) & set(previous), key=int):
+        for name, measures in results[size].items():
+            if name not in previous[size]:
+                continue
+            ratio = measures['warm'] / max(previous[size][name]['warm'], 1e-9)
+            flag = ratio > 1 + threshold
+            regressions += flag
+            print(f"  {size:>10} {name:<32} x{ratio:>7.2f}{'   REGRESSION' if flag else ''}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks init_recipes and the query functions.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                        help="collection sizes, from 1000 to 10000000 recipes")
+    parser.add_argument('--depth', type=int, default=2, help="maximum nesting depth of ingredients")
+    parser.add_argument('--repeat', type=int, default=3, help="warm calls per function")
+    parser.add_argument('--data-dir', default='bench_data', help="where generated collections are kept")
+    parser.add_argument('--output', default=None, help="results file (default: bench_results/<date>.json)")
+    parser.add_argument('--compare', default=None, help="previous results file to compare to")
+    parser.add_argument('--threshold', type=float, default=0.2, help="relative slowdown counted as a regression")
+    parser.add_argument('--no-memory', action='store_true', help="don't measure peak memory (faster)")
+    parser.add_argument('--memoize', action='store_true', help="keep the query results cache (see memo.py) on,"
+                                                               " so warm calls time cache hits")
+    args = parser.parse_args()
+    rps.query_cache.enabled = args.memoize
+
+    results = {str(count): run_size(count, args.depth, args.repeat, args.data_dir, not args.no_memory)
+               for count in args.sizes}
+
+    scaling = get_scaling(results)
+    if scaling:
+        print(f"Scaling exponents from {min(args.sizes)} to {max(args.sizes)} recipes (1 = linear, 2 = quadratic):")
+        for name, exponent in scaling.items():
+            print(f"  {name:<32} {exponent:>6.2f}")
+
+    output = args.output or os.path.join('bench_results', f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'meta': {'date': datetime.now().isoformat(), 'python': platform.python_version(),
+                     'platform': platform.platform(), 'depth': args.depth, 'repeat': args.repeat,
+                     'memoize': args.memoize},
+            'results': results,
+            'scaling': scaling,
+        }, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f)['results'], args.threshold):
+                raise SystemExit(1)
@@ -26,11 +26,61 @@ class Ui_Form(object):
 
         self.horizontalLayout.addWidget(self.functionList)
 
+        self.outputLayout = QVBoxLayout()
+        self.outputLayout.setObjectName(u"outputLayout")
         self.outputText = QTextEdit(Form)
         self.outputText.setObjectName(u"outputText")
         self.outputText.setReadOnly(True)
 
-        self.horizontalLayout.addWidget(self.outputText)
+        self.outputLayout.addWidget(self.outputText)
+
+        self.statusLayout = QHBoxLayout()
+        self.statusLayout.setObjectName(u"statusLayout")
+        self.progressBar = QProgressBar(Form)
+        self.progressBar.setObjectName(u"progressBar")
+        self.progressBar.setValue(0)
+        self.progressBar.setTextVisible(False)
+
+        self.statusLayout.addWidget(self.progressBar)
+
+        self.cancelButton = QPushButton(Form)
+        self.cancelButton.setObjectName(u"cancelButton")
+        self.cancelButton.setEnabled(False)
+
+        self.statusLayout.addWidget(self.cancelButton)
+
+
+        self.outputLayout.addLayout(self.statusLayout)
+
+        self.profileText = QTextEdit(Form)
+        self.profileText.setObjectName(u"profileText")
+        self.profileText.setReadOnly(True)
+        self.profileText.setLineWrapMode(QTextEdit.NoWrap)
+
+        self.outputLayout.addWidget(self.profileText)
+
+        self.profileLayout = QHBoxLayout()
+        self.profileLayout.setObjectName(u"profileLayout")
+        self.allocCheck = QCheckBox(Form)
+        self.allocCheck.setObjectName(u"allocCheck")
+
+        self.profileLayout.addWidget(self.allocCheck)
+
+        self.cprofileCheck = QCheckBox(Form)
+        self.cprofileCheck.setObjectName(u"cprofileCheck")
+
+        self.profileLayout.addWidget(self.cprofileCheck)
+
+        self.exportButton = QPushButton(Form)
+        self.exportButton.setObjectName(u"exportButton")
+
+        self.profileLayout.addWidget(self.exportButton)
+
+
+        self.outputLayout.addLayout(self.profileLayout)
+
+
+        self.horizontalLayout.addLayout(self.outputLayout)
 
         self.sourceText = QTextEdit(Form)
         self.sourceText.setObjectName(u"sourceText")
@@ -49,4 +99,8 @@ class Ui_Form(object):
 
     def retranslateUi(self, Form):
         Form.setWindowTitle(QCoreApplication.translate("Form", u"Form", None))
+        self.cancelButton.setText(QCoreApplication.translate("Form", u"Annuler", None))
+        self.allocCheck.setText(QCoreApplication.translate("Form", u"tracemalloc", None))
+        self.cprofileCheck.setText(QCoreApplication.translate("Form", u"cProfile", None))
+        self.exportButton.setText(QCoreApplication.translate("Form", u"Exporter...", None))
     # retranslateUi
\ No newline at end of file
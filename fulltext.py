@@ -0,0 +1,215 @@
+"""File: fulltext.py
+Holds the full-text index of the preparation steps and comments, ranked with BM25, with phrase queries."""
+
+import math
+import re
+from collections import defaultdict
+
+import numpy as np
+
+from helper import *
+
+
+class TextIndex:
+    """
+    Inverted index of the preparation steps (nested ones included) and comments of the recipes.
+    Text is cut into casefolded words, so the XML indentation and line breaks don't matter.
+    Each word keeps its positions in the recipe, and each pair of adjacent words is indexed too:
+    a two-word phrase ("whipping cream") is a single lookup, longer ones only check the recipes having all its pairs.
+    A phrase never spans two texts of a recipe.
+    Recipes can be added one at a time (see feed()), or updated and removed (see apply()). The BM25 weights of a word are computed on its first query
+    after a change; a query then only adds up arrays of weights.
+    """
+    K1 = 1.2
+    B = 0.75
+    GAP = 1  # Positions skipped between two texts of a recipe, so phrases don't run across them
+    WORD = re.compile(r"[^\W_]+")
+
+    def __init__(self, recipes=()):
+        """
+        :param recipes: recipes dict, or iterator of (id, Recipe) pairs, to add right away
+        """
+        self.ids = []  # Recipe ids, by document number (None for a removed recipe)
+        self.docs = {}  # Recipe id -> document number, for the recipes in the index
+        self.recipes = []  # Recipe objects, by document number (None for a removed recipe)
+        self.lengths = []  # Number of words, by document number
+        self.total_length = 0
+        self.postings = defaultdict(dict)  # word -> {document number: positions}
+        self.pairs = defaultdict(dict)  # "word word" -> {document number: positions of the first word}
+        self.weights = {}  # word -> (document numbers, BM25 weights) arrays, cleared when a recipe is added
+        self.norms = None  # Length of each document over the average length, array computed with the weights
+        for rid, recipe in recipe_items(recipes):
+            self.add(rid, recipe)
+
+    @classmethod
+    def tokenize(cls, text: str):
+        """
+        Get the words of a text.
+        :param text: any text, indentation and all
+        :return: list of casefolded words
+        """
+        return cls.WORD.findall(text.casefold()) if text else []
+
+    @staticmethod
+    def get_texts(recipe: Recipe):
+        """
+        Get the searchable texts of a recipe.
+        :param recipe: Recipe object
+        :return: generator of str texts: steps, steps of the ingredients, comment
+        """
+        yield from recipe.preparation
+        for ingredient in recipe.flat_ingredients:
+            yield from ingredient.preparation or ()
+        if recipe.comment:
+            yield recipe.comment
+
+    def get_words(self, recipe: Recipe):
+        """
+        Get the words of a recipe, and the pairs of adjacent words, with their positions.
+        :param recipe: Recipe object
+        :return: (list of (word, position), list of (pair, position), number of words)
+        """
+        words, pairs, position = [], [], 0
+        for text in self.get_texts(recipe):
+            tokens = self.tokenize(text)
+            words += zip(tokens, range(position, position + len(tokens)))
+            pairs += zip(map(' '.join, zip(tokens, tokens[1:])), range(position, position + len(tokens)))
+            position += len(tokens) + self.GAP
+        return words, pairs, len(words)
+
+    def add(self, rid: str, recipe: Recipe, doc: int = None):
+        """
+        Adds a recipe to the index.
+        :param rid: recipe id
+        :param recipe: Recipe object
+        :param doc: document number to reuse, that of a removed recipe (default: a new one, after the others)
+        """
+        if doc is None:
+            doc = len(self.ids)
+            self.ids.append(None)
+            self.recipes.append(None)
+            self.lengths.append(0)
+        words, pairs, length = self.get_words(recipe)
+        for word, position in words:
+            self.postings[word].setdefault(doc, []).append(position)
+        for pair, position in pairs:
+            self.pairs[pair].setdefault(doc, []).append(position)
+        self.ids[doc] = rid
+        self.docs[rid] = doc
+        self.recipes[doc] = recipe
+        self.lengths[doc] = length
+        self.total_length += length
+        self.weights.clear()
+        self.norms = None
+
+    def remove(self, rid: str):
+        """
+        Removes a recipe from the index. Its document number is left empty, so the others keep theirs.
+        :param rid: recipe id
+        :return: its former document number
+        """
+        doc = self.docs.pop(rid)
+        words, pairs, _ = self.get_words(self.recipes[doc])
+        for postings, keys in ((self.postings, words), (self.pairs, pairs)):
+            for key in dict.fromkeys(map(lambda x: x[0], keys)):
+                del postings[key][doc]
+                if not postings[key]:
+                    del postings[key]
+        self.ids[doc] = self.recipes[doc] = None
+        self.total_length -= self.lengths[doc]
+        self.lengths[doc] = 0
+        self.weights.clear()
+        self.norms = None
+        return doc
+
+    def apply(self, recipes, changes: RecipeChanges):
+        """
+        Updates the index after RecipeCollection.apply(): only the changed, added and removed recipes are tokenized.
+        A changed recipe keeps its document number, so results stay in collection order on ties.
+        :param recipes: collection the changes were applied to
+        :param changes: RecipeChanges
+        """
+        for rid in changes.removed:
+            self.remove(rid)
+        for rid, (_, recipe) in changes.changed.items():
+            self.add(rid, recipe, self.remove(rid))
+        for rid, recipe in changes.added.items():
+            self.add(rid, recipe)
+
+    def feed(self, recipes):
+        """
+        Adds recipes while they go through, e.g. RecipeCollection(index.feed(iter_recipes())),
+        so the index is built while the file is parsed.
+        :param recipes: iterator of (id, Recipe) pairs
+        :return: generator of the same pairs
+        """
+        for rid, recipe in recipes:
+            self.add(rid, recipe)
+            yield rid, recipe
+
+    def get_weights(self, word: str):
+        """
+        Get the BM25 weight of a word in each recipe containing it, computed once until the index changes.
+        :param word: casefolded word
+        :return: (document numbers, weights) arrays
+        """
+        if word not in self.weights:
+            docs = self.postings.get(word, {})
+            count = len(self.docs)
+            if self.norms is None:
+                self.norms = np.array(self.lengths, dtype=np.float64) / (self.total_length / max(count, 1))
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            positions = np.fromiter(docs.keys(), dtype=np.int64, count=len(docs))
+            frequencies = np.fromiter(map(len, docs.values()), dtype=np.float64, count=len(docs))
+            self.weights[word] = (positions, idf * frequencies * (self.K1 + 1)
+                                  / (frequencies + self.K1 * (1 - self.B + self.B * self.norms[positions])))
+        return self.weights[word]
+
+    def get_phrase_docs(self, words: list):
+        """
+        Get the recipes containing words one after the other.
+        :param words: casefolded words of the phrase, at least two
+        :return: set of document numbers
+        """
+        pairs = [' '.join(x) for x in zip(words, words[1:])]
+        if any(pair not in self.pairs for pair in pairs):
+            return set()
+        pairs.sort(key=lambda x: len(self.pairs[x]))  # Rarest first, so the candidates shrink fast
+        docs = set(self.pairs[pairs[0]])
+        for pair in pairs[1:]:
+            docs = {doc for doc in docs if doc in self.pairs[pair]}
+        if len(words) == 2:
+            return docs
+        # Every pair is there, but maybe not in a row: the i-th pair must start i positions after the first
+        ret = set()
+        for doc in docs:
+            starts = set(self.pairs[' '.join(words[:2])][doc])
+            for i, pair in enumerate(map(' '.join, zip(words[1:], words[2:])), 1):
+                starts &= {position - i for position in self.pairs[pair][doc]}
+            if starts:
+                ret.add(doc)
+        return ret
+
+    def search(self, query: str, limit: int = 10):
+        """
+        Get the recipes best matching a query, by BM25 score.
+        Words match any recipe containing one of them; quoted phrases ("whipping cream") must be in the recipe.
+        :param query: words and quoted phrases
+        :param limit: maximum number of results, or None for all of them
+        :return: list of (recipe id, Recipe, score) tuples, best first (in collection order on ties)
+        """
+        phrases = [x for x in map(self.tokenize, re.findall(r'"([^"]*)"', query)) if len(x) > 1]
+        scores = np.zeros(len(self.ids))
+        for word in dict.fromkeys(self.tokenize(query.replace('"', ' '))):
+            if word not in self.postings:
+                continue
+            docs, weights = self.get_weights(word)
+            scores[docs] += weights  # A word is in each document once, so no index is repeated
+        for phrase in phrases:
+            keep = np.zeros(len(self.ids), dtype=bool)
+            keep[list(self.get_phrase_docs(phrase))] = True
+            scores[~keep] = 0
+
+        matches = np.flatnonzero(scores)
+        order = matches[np.lexsort((matches, -scores[matches]))][:limit]
+        return [(self.ids[doc], self.recipes[doc], float(scores[doc])) for doc in order]
@@ -0,0 +1,132 @@
+"""File: generate.py
+Writes synthetic recipe collections, in the same XML format as recipes.xml, for benchmarks at any size.
+Usage: python3 generate.py OUTPUT COUNT [--depth DEPTH] [--seed SEED]"""
+
+import argparse
+import random
+from xml.sax.saxutils import escape, quoteattr
+
+BASE_INGREDIENTS = (
+    'beef cube steak', 'onion', 'green bell pepper', 'bread crumbs', 'Parmesan cheese', 'olive oil',
+    'spaghetti sauce', 'mozzarella cheese', 'angel hair pasta', 'garlic', 'butter', 'ricotta cheese', 'eggs',
+    'white sugar', 'vanilla extract', 'chocolate chips', 'flour', 'baking powder', 'shortening', 'milk',
+    'linguini pasta', 'dried thyme', 'red pepper flakes', 'tomatoes', 'black olives', 'clams', 'scallops',
+    'shrimp', 'lemon zest', 'salt', 'egg yolks', 'whipping cream', 'biscuits', 'chicken', 'mushrooms',
+    'carrots', 'celery', 'bay leaf', 'peppercorns', 'white wine', 'shallots', 'parsley', 'sherry', 'orange juice',
+)
+QUALIFIERS = ('', '', '', 'fresh ', 'minced ', 'grated ', 'chopped ', 'dried ', 'sliced ', 'ground ')
+UNITS = (None, None, 'cup', 'teaspoon', 'tablespoon', 'pound', 'ounce', 'can', 'jar', 'pinch')
+COMPOSITES = ('filling', 'dough', 'sauce', 'pastry', 'stock', 'topping', 'marinade', 'glaze')
+TITLE_WORDS = ('Baked', 'Roasted', 'Creamy', 'Spicy', 'Grandma\'s', 'Italian', 'Quick', 'Stuffed', 'Pie', 'Pasta',
+               'Soup', 'Stew', 'Salad', 'Casserole', 'Tart', 'Risotto', 'Gratin', 'with', 'and', 'Garlic', 'Lemon')
+STEP_WORDS = ('Preheat', 'oven', 'to', '350', 'degrees', 'F', 'Mix', 'the', 'flour', 'and', 'sugar', 'Bake', 'for',
+              '30', 'minutes', 'Stir', 'in', 'eggs', 'until', 'smooth', 'Serve', 'hot', 'Chill', 'overnight')
+# Fixed English names, so the output doesn't depend on the locale
+DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<rcp:collection xmlns:rcp="http://www.brics.dk/ixwt/recipes">
+  <rcp:description>Synthetic recipes generated by generate.py</rcp:description>
+"""
+FOOTER = "</rcp:collection>\n"
+
+
+def get_text(rng: random.Random, words, low: int, high: int):
+    """
+    Get a random sentence.
+    :param rng: random generator
+    :param words: words to pick from
+    :param low: minimum number of words
+    :param high: maximum number of words
+    :return: str sentence
+    """
+    return ' '.join(rng.choice(words) for _ in range(rng.randint(low, high))) + '.'
+
+
+def get_steps(rng: random.Random, indent: str, count: int):
+    """
+    Get the XML of a preparation element.
+    :param rng: random generator
+    :param indent: indentation of the element
+    :param count: number of steps
+    :return: str XML lines
+    """
+    steps = ''.join(f"{indent}  <rcp:step>{escape(get_text(rng, STEP_WORDS, 5, 30))}</rcp:step>\n"
+                    for _ in range(count))
+    return f"{indent}<rcp:preparation>\n{steps}{indent}</rcp:preparation>\n"
+
+
+def get_ingredient(rng: random.Random, indent: str, depth: int):
+    """
+    Get the XML of an ingredient, which is composite (with nested ingredients and steps) if depth allows.
+    :param rng: random generator
+    :param indent: indentation of the element
+    :param depth: how many more levels of nested ingredients are allowed
+    :return: str XML lines
+    """
+    if depth > 0 and rng.random() < 0.15:
+        nested = ''.join(get_ingredient(rng, indent + '  ', depth - 1) for _ in range(rng.randint(2, 5)))
+        steps = get_steps(rng, indent + '  ', 1) if rng.random() < 0.7 else ''
+        return f"{indent}<rcp:ingredient name={quoteattr(rng.choice(COMPOSITES))}>\n{nested}{steps}{indent}</rcp:ingredient>\n"
+
+    name = rng.choice(QUALIFIERS) + rng.choice(BASE_INGREDIENTS)
+    amount = rng.choice(('*', '0.25', '0.5', '1', '1.5', '2', '3', '4', '12')) if rng.random() < 0.95 else None
+    unit = rng.choice(UNITS)
+    attrs = f"name={quoteattr(name)}"
+    attrs += f" amount={quoteattr(amount)}" if amount is not None else ''
+    attrs += f" unit={quoteattr(unit)}" if unit is not None else ''
+    return f"{indent}<rcp:ingredient {attrs}/>\n"
+
+
+def get_recipe(rng: random.Random, number: int, count: int, depth: int):
+    """
+    Get the XML of a recipe.
+    :param rng: random generator
+    :param number: number of the recipe, which makes its id
+    :param count: number of recipes in the collection, for related references
+    :param depth: maximum nesting depth of ingredients
+    :return: str XML lines
+    """
+    title = ' '.join(rng.choice(TITLE_WORDS) for _ in range(rng.randint(2, 5)))
+    date = f"{rng.choice(DAYS)}, {rng.randint(1, 28):02d} {rng.choice(MONTHS)} {rng.randint(0, 99):02d}"
+    ingredients = ''.join(get_ingredient(rng, '    ', depth) for _ in range(rng.randint(3, 15)))
+    comment = f"    <rcp:comment>\n      {escape(get_text(rng, STEP_WORDS, 5, 40))}\n    </rcp:comment>\n" \
+        if rng.random() < 0.3 else ''
+    nutrition = (f'    <rcp:nutrition calories="{rng.randint(50, 2000)}" fat="{rng.randint(0, 60)}%" '
+                 f'carbohydrates="{rng.randint(0, 80)}%" protein="{rng.randint(0, 60)}%"/>\n')
+    # Some references point past the end of the collection, to have dangling ones too
+    related = f'    <rcp:related ref="r{rng.randint(0, int(count * 1.05))}">goes well with it</rcp:related>\n' \
+        if rng.random() < 0.2 else ''
+    return (f'  <rcp:recipe id="r{number}">\n'
+            f"    <rcp:title>{escape(title)}</rcp:title>\n"
+            f"    <rcp:date>{date}</rcp:date>\n"
+            f"{ingredients}{get_steps(rng, '    ', rng.randint(1, 8))}{comment}{nutrition}{related}"
+            f"  </rcp:recipe>\n")
+
+
+def generate_recipes(filename: str, count: int, depth: int = 2, seed: int = 0):
+    """
+    Writes a synthetic collection, one recipe at a time (so any size fits in memory).
+    The same arguments always give the same file.
+    :param filename: path of the XML file to write
+    :param count: number of recipes
+    :param depth: maximum nesting depth of ingredients (0 for none)
+    :param seed: random seed
+    """
+    rng = random.Random(seed)
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write(HEADER)
+        for number in range(count):
+            f.write(get_recipe(rng, number, count, depth))
+        f.write(FOOTER)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Writes a synthetic recipe collection.")
+    parser.add_argument('output', help="path of the XML file to write")
+    parser.add_argument('count', type=int, help="number of recipes")
+    parser.add_argument('--depth', type=int, default=2, help="maximum nesting depth of ingredients")
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+    args = parser.parse_args()
+    generate_recipes(args.output, args.count, args.depth, args.seed)
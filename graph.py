@@ -0,0 +1,126 @@
+"""File: graph.py
+Holds the graph of the rcp:related references between recipes ("goes well with"), for menu suggestions."""
+
+from collections import deque
+
+from indexes import *
+
+
+def get_related_refs(recipe: Recipe):
+    """
+    HELPER: Get the references of a recipe to others.
+    Recipe.related is typed as a list of (id, text) pairs, but the XML gives a single one, parsed as a tuple:
+    both are accepted.
+    :param recipe: Recipe object
+    :return: list of (recipe id, text) pairs
+    """
+    if not recipe.related:
+        return []
+    if isinstance(recipe.related[0], str):  # A single (id, text) pair
+        return [tuple(recipe.related)]
+    return list(map(tuple, recipe.related))
+
+
+class RelatedGraph:
+    """
+    Adjacency lists of the related references, both ways: a recipe's references, and the recipes referencing it.
+    Connected components (menus: recipes linked together, whatever the direction) are computed once, when it's built,
+    so traversals only ever visit the recipes of one component.
+    References to a recipe id that isn't in the collection are kept aside, as dangling.
+    """
+    DIRECTIONS = ('forward', 'reverse', 'both')
+
+    def __init__(self, recipes):
+        """
+        Builds the graph in a single pass over the recipes, then labels the components.
+        :param recipes: recipes dict, or iterator of (id, Recipe) pairs
+        """
+        self.recipes = {}  # recipe id -> Recipe, in collection order
+        refs = []
+        for rid, recipe in recipe_items(recipes):
+            self.recipes[rid] = recipe
+            refs += ((rid, ref, text) for ref, text in get_related_refs(recipe))
+
+        self.forward = {rid: [] for rid in self.recipes}  # recipe id -> ids of the recipes it references
+        self.reverse = {rid: [] for rid in self.recipes}  # recipe id -> ids of the recipes referencing it
+        self.texts = {}  # (recipe id, referenced id) -> text of the reference
+        self.dangling = []  # (recipe id, missing id) pairs
+        for rid, ref, text in refs:
+            if ref not in self.recipes:
+                self.dangling.append((rid, ref))
+                continue
+            if (rid, ref) not in self.texts:  # A reference given twice is a single edge
+                self.forward[rid].append(ref)
+                self.reverse[ref].append(rid)
+            self.texts[rid, ref] = text
+
+        # Components, by breadth-first search over both directions, numbered in collection order
+        self.components = {}  # recipe id -> component number
+        self.members = []  # component number -> recipe ids, in collection order
+        positions = {rid: pos for pos, rid in enumerate(self.recipes)}
+        for rid in self.recipes:
+            if rid in self.components:
+                continue
+            number = len(self.members)
+            self.components[rid] = number
+            members = [rid]
+            queue = deque(members)
+            while queue:
+                for other in self.get_neighbors(queue.popleft(), 'both'):
+                    if other not in self.components:
+                        self.components[other] = number
+                        members.append(other)
+                        queue.append(other)
+            self.members.append(sorted(members, key=positions.get))
+
+    def get_neighbors(self, rid: str, direction: str = 'both'):
+        """
+        Get the recipes directly linked to a recipe.
+        :param rid: recipe id
+        :param direction: 'forward' (its references), 'reverse' (referencing it) or 'both'
+        :return: list of recipe ids
+        """
+        if direction == 'forward':
+            return self.forward[rid]
+        if direction == 'reverse':
+            return self.reverse[rid]
+        return self.forward[rid] + [x for x in self.reverse[rid] if x not in self.forward[rid]]
+
+    def traverse(self, rid: str, depth: int = 1, direction: str = 'both'):
+        """
+        Get the recipes linked to a recipe, directly or through others, closest first.
+        :param rid: recipe id
+        :param depth: maximum number of references to follow, None for no limit
+        :param direction: 'forward', 'reverse' or 'both' (see get_neighbors())
+        :return: dict of recipe id -> distance, in breadth-first order, without the recipe itself
+        """
+        if direction not in self.DIRECTIONS:
+            raise ValueError(f"direction must be one of {', '.join(self.DIRECTIONS)}, not {direction!r}")
+        distances = {rid: 0}
+        queue = deque((rid,))
+        while queue:
+            current = queue.popleft()
+            if depth is not None and distances[current] >= depth:
+                continue
+            for other in self.get_neighbors(current, direction):
+                if other not in distances:
+                    distances[other] = distances[current] + 1
+                    queue.append(other)
+        del distances[rid]
+        return distances
+
+    def get_component(self, rid: str):
+        """
+        Get the recipes linked to a recipe in any way: its menu.
+        :param rid: recipe id
+        :return: list of recipe ids, in collection order, the recipe itself included
+        """
+        return self.members[self.components[rid]]
+
+    def get_menus(self, min_size: int = 2):
+        """
+        Get the groups of linked recipes.
+        :param min_size: minimum number of recipes in a group (1 includes the recipes linked to no other)
+        :return: list of lists of recipe ids, largest first (in collection order on ties)
+        """
+        return sorted((x for x in self.members if len(x) >= min_size), key=len, reverse=True)
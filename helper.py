@@ -1,9 +1,38 @@
 """ File: helper.py
 This file contains helper functions that are used in the main program."""
 
-from functools import reduce
+import re
+from collections.abc import Iterator
+from datetime import datetime
+from functools import lru_cache
 
-from models import *
+from indexes import *
+
+# Names of the "%a, %d %b %y" date format, in English whatever the locale (strptime would use the current one)
+WEEKDAYS = frozenset(('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'))
+MONTHS = {name: number for number, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), 1)}
+DATE_PATTERN = re.compile(r"\s*([A-Za-z]{3}),\s*(\d{1,2})\s+([A-Za-z]{3})\s+(\d{2})\s*")
+
+
+def iter_ingredients(container):
+    """
+    HELPER: Lazily walks every ingredient in a structure, nested ones included.
+    Each ingredient is visited once, so this is linear in the number of ingredients.
+    Recipes are read from their cached flat_ingredients, so they're only ever walked once.
+    :param container: any type that contains ingredients anywhere in its structure
+    :return: generator of all ingredients in the structure
+    """
+    if isinstance(container, (dict, Iterator)):  # Is this the recipes dict (or a recipe stream)?
+        for recipe in recipe_values(container):
+            yield from recipe.flat_ingredients
+    elif isinstance(container, (Recipe, CompactRecipe)):
+        yield from container.flat_ingredients
+    elif isinstance(container, (list, tuple)):
+        for ingredient in container:
+            yield from iter_ingredients(ingredient)
+    elif isinstance(container, (Ingredient, CompactIngredient)):
+        yield from container.walk()
 
 
 def flatten_ingredients(container):
@@ -12,29 +41,11 @@ def flatten_ingredients(container):
     This saves us having to implement recursion into everything else.
     Note that this does not remove references to composing ingredients from ingredient objects.
     :param container: any type that contains ingredients anywhere in its structure
-    :return: list of all ingredients in the structure
-    """
-    ingredients = []
-    if isinstance(container, dict):  # Is this the recipes dict?
-        ingredients.extend(
-            reduce(lambda acc, recipe: acc + flatten_ingredients(recipe.ingredients),
-                   container.values(), [])
-        )
-    elif isinstance(container, list):
-        ingredients.extend(
-            reduce(lambda acc, ingredient: acc + flatten_ingredients(ingredient),
-                   container, [])
-        )
-    elif isinstance(container, Recipe):
-        ingredients.extend(container.ingredients)
-        if container.ingredients:
-            ingredients.extend(flatten_ingredients(container.ingredients))
-    elif isinstance(container, Ingredient):
-        ingredients.append(container)
-        # Add any nested ingredients
-        if container.ingredients:
-            ingredients.extend(flatten_ingredients(container.ingredients))
-    return ingredients
+    :return: tuple of all ingredients in the structure
+    """
+    if isinstance(container, (Recipe, CompactRecipe)):
+        return container.flat_ingredients  # Already flattened
+    return tuple(iter_ingredients(container))
 
 
 def get_ingredient_count(recipe: Recipe, ing_name: str):
@@ -47,18 +58,18 @@ def get_ingredient_count(recipe: Recipe, ing_name: str):
     """
     return sum(map(
         lambda x: x.amount if ing_name in x.name else 0,
-        flatten_ingredients(recipe.ingredients)
+        recipe.flat_ingredients
     ))
 
 
 def filter_recipes(recipes: dict, filter_func):
     """
     HELPER: Filter recipes based on a given function.
-    :param recipes: recipes dict
+    :param recipes: recipes dict, or iterator of (id, Recipe) pairs
     :param filter_func: callable by which to filter recipes
     :return: list of recipes that pass the filter
     """
-    return list(filter(filter_func, recipes.values()))
+    return list(filter(filter_func, recipe_values(recipes)))
 
 
 def get_step_count(recipe: Recipe):
@@ -68,9 +79,8 @@ def get_step_count(recipe: Recipe):
     :return: int steps count
     """
     overall_steps = len(recipe.preparation)
-    ingredients = flatten_ingredients(recipe.ingredients)
     ingredient_steps = sum(len(i.preparation) if i.preparation is not None else 0
-                           for i in ingredients)
+                           for i in recipe.flat_ingredients)
     return overall_steps + ingredient_steps
 
 
@@ -78,17 +88,59 @@ def get_recipe(recipes: dict, title: str):
     """
     HELPER: Get a recipe by its title.
     Note: unlike with ingredients, title has to be exact.
+    A RecipeCollection looks it up in its TitleIndex; anything else is scanned, an index would be built for one lookup.
     :param recipes: recipes dict
     :param title: EXACT title of recipe
-    :return: Recipe object or None
+    :return: Recipe object or None (the first one with this title)
+    """
+    if isinstance(recipes, RecipeCollection):
+        return get_index(recipes, TitleIndex).get(title)
+    return next((r for r in recipe_values(recipes) if r.title == title), None)
+
+
+def search_titles(recipes: dict, text: str, limit: int = 10):
     """
-    return next(filter(lambda x: x.title == title, recipes.values()), None)
+    HELPER: Get recipes whose title starts with or resembles a text, ignoring case (for autocompletion).
+    :param recipes: recipes dict
+    :param text: partial or approximate title
+    :param limit: maximum number of recipes
+    :return: list of Recipe objects, prefix matches first
+    """
+    return get_index(recipes, TitleIndex).suggest(text, limit)
+
+
+def search_text(recipes: dict, query: str, limit: int = 10):
+    """
+    HELPER: Full-text search in the preparation steps and comments, best matches first (see fulltext.TextIndex).
+    :param recipes: recipes dict
+    :param query: words, and quoted phrases that must appear as is: 'bake "350 degrees"'
+    :param limit: maximum number of recipes
+    :return: list of Recipe objects
+    """
+    from fulltext import TextIndex  # Deferred, like NumPy which it needs (see repositories.py)
+    return list(map(lambda x: x[1], get_index(recipes, TextIndex).search(query, limit)))
 
 
 def get_unique_ingredients(recipes):
     """
-    HELPER: Get a set of all unique ingredients in all recipes.
+    HELPER: Get a set of all unique ingredients in all recipes, by name (Ingredient objects can't be hashed).
     :param recipes: recipes dict
-    :return: set of Ingredient objects
+    :return: set of ingredient names
+    """
+    return set(map(lambda x: x.name, iter_ingredients(recipes)))
+
+
+@lru_cache(maxsize=None)
+def parse_date(text: str):
+    """
+    HELPER: Parses a recipe date, like "Fri, 28 Jan 00". Same result as dt.strptime(text, "%a, %d %b %y"),
+    but without depending on the locale, and much faster: recipes share few distinct dates, each parsed once.
+    Two-digit years follow strptime: 69 to 99 are 19xx, 00 to 68 are 20xx.
+    :param text: date string
+    :return: datetime object (at midnight), shared by every recipe with the same date
     """
-    return set(flatten_ingredients(recipes))
+    match = DATE_PATTERN.fullmatch(text)
+    if match is None or match[1].lower() not in WEEKDAYS or match[3].lower() not in MONTHS:
+        raise ValueError(f"time data {text!r} does not match format '%a, %d %b %y'")
+    year = int(match[4])
+    return datetime(year + (1900 if year >= 69 else 2000), MONTHS[match[3].lower()], int(match[2]))
@@ -0,0 +1,261 @@
+"""File: indexes.py
+Holds the lookup structures built from a recipes collection, so queries don't have to scan every recipe."""
+
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+
+from models import *
+
+
+def recipe_items(recipes):
+    """
+    HELPER: Get (id, Recipe) pairs from either a recipes dict or a recipe stream.
+    This is what lets repositories.iter_recipes() be fed straight into the query functions.
+    :param recipes: recipes dict, or iterator of (id, Recipe) pairs
+    :return: iterable of (id, Recipe) pairs
+    """
+    return recipes.items() if isinstance(recipes, dict) else recipes
+
+
+def recipe_values(recipes):
+    """
+    HELPER: Get the Recipe objects from either a recipes dict or a recipe stream.
+    :param recipes: recipes dict, or iterator of (id, Recipe) pairs
+    :return: iterable of Recipe objects
+    """
+    return recipes.values() if isinstance(recipes, dict) else map(lambda x: x[1], recipes)
+
+
+def get_index(recipes, index_type):
+    """
+    HELPER: Get an index over recipes.
+    A RecipeCollection builds each index once and keeps it until it's modified;
+    anything else (plain dict, recipe stream) gets a fresh one.
+    :param recipes: recipes dict, or iterator of (id, Recipe) pairs
+    :param index_type: index class, built from the recipes
+    :return: index_type instance
+    """
+    if isinstance(recipes, RecipeCollection):
+        return recipes.get_derived(index_type)
+    return index_type(recipes)
+
+
+class IngredientIndex:
+    """
+    Inverted index of ingredient names, for partial name lookups without scanning every ingredient.
+    Each distinct name has postings, one (recipe id, Ingredient) pair per occurrence.
+    Names are also indexed by their trigrams: a name can only contain the query if it has all of its trigrams,
+    so only those few candidates are actually checked with 'in'.
+    """
+    GRAM = 3
+
+    def __init__(self, recipes):
+        """
+        Builds the index in a single pass over the recipes.
+        :param recipes: recipes dict, or iterator of (id, Recipe) pairs
+        """
+        self.recipes = []  # Recipe objects, in collection order
+        self.positions = {}  # recipe id -> position in self.recipes
+        self.postings = defaultdict(list)  # ingredient name -> [(recipe id, Ingredient)]
+        self.ranks = {}  # ingredient name -> number, by first appearance
+        self.grams = defaultdict(set)  # trigram -> names containing it
+
+        for rid, recipe in recipe_items(recipes):
+            self.positions[rid] = len(self.recipes)
+            self.recipes.append(recipe)
+            for ingredient in recipe.flat_ingredients:
+                if ingredient.name not in self.postings:
+                    self.ranks[ingredient.name] = len(self.ranks)
+                    for gram in self.get_grams(ingredient.name):
+                        self.grams[gram].add(ingredient.name)
+                self.postings[ingredient.name].append((rid, ingredient))
+
+    @classmethod
+    def get_grams(cls, text: str):
+        """
+        Get the set of n-grams of a string.
+        :param text: ingredient name or query
+        :return: set of substrings of length GRAM
+        """
+        return {text[i:i + cls.GRAM] for i in range(len(text) - cls.GRAM + 1)}
+
+    def get_names(self, ing_name: str):
+        """
+        Get the distinct ingredient names containing a substring.
+        :param ing_name: ingredient name substring
+        :return: list of matching names, by first appearance in the collection
+        """
+        if len(ing_name) < self.GRAM:  # Too short to have trigrams, check every distinct name
+            candidates = self.postings.keys()
+        else:
+            # Intersect from the rarest trigram, stopping as soon as nothing is left
+            candidates = None
+            for names in sorted(map(lambda x: self.grams.get(x, set()), self.get_grams(ing_name)), key=len):
+                candidates = names if candidates is None else candidates & names
+                if not candidates:
+                    return []
+        # Candidates are a set, whose order depends on the hash seed: sorted, matches (and sums of amounts) don't
+        return sorted((name for name in candidates if ing_name in name), key=self.ranks.get)
+
+    def get_matches(self, ing_name: str):
+        """
+        Get every occurrence of the ingredients whose name contains a substring.
+        :param ing_name: ingredient name substring
+        :return: generator of (recipe id, Ingredient) pairs
+        """
+        for name in self.get_names(ing_name):
+            yield from self.postings[name]
+
+    def get_positions(self, ing_name: str):
+        """
+        Get the positions of the recipes using an ingredient, in collection order.
+        :param ing_name: ingredient name substring
+        :return: sorted list of positions in self.recipes
+        """
+        return sorted({self.positions[rid] for rid, _ in self.get_matches(ing_name)})
+
+    def get_recipes(self, ing_name: str):
+        """
+        Get the recipes using an ingredient, in collection order.
+        :param ing_name: ingredient name substring
+        :return: list of Recipe objects
+        """
+        return [self.recipes[pos] for pos in self.get_positions(ing_name)]
+
+    def get_amounts(self, ing_name: str):
+        """
+        Get the total amount of an ingredient in each recipe using it.
+        :param ing_name: ingredient name substring
+        :return: dict of recipe id -> amount
+        """
+        amounts = defaultdict(int)
+        for rid, ingredient in self.get_matches(ing_name):
+            amounts[rid] += ingredient.amount
+        return amounts
+
+
+class UsageMap:
+    """
+    Ingredient name -> ids of the recipes using it, built in a single pass over the collection.
+    Also counts how many times each name is used overall, nested ingredients and repeats included.
+    """
+
+    def __init__(self, recipes):
+        """
+        Builds the map in a single pass over the recipes.
+        :param recipes: recipes dict, or iterator of (id, Recipe) pairs
+        """
+        self.recipes = {}  # recipe id -> Recipe
+        self.usages = defaultdict(list)  # ingredient name -> recipe ids, in collection order
+        self.counts = Counter()  # ingredient name -> number of uses
+
+        for rid, recipe in recipe_items(recipes):
+            self.recipes[rid] = recipe
+            names = list(map(lambda x: x.name, recipe.flat_ingredients))
+            self.counts.update(names)
+            for name in dict.fromkeys(names):  # Each recipe once per name, even if it uses it twice
+                self.usages[name].append(rid)
+
+    def get_recipes(self, name: str):
+        """
+        Get the recipes using an ingredient.
+        :param name: EXACT ingredient name
+        :return: list of Recipe objects
+        """
+        return [self.recipes[rid] for rid in self.usages.get(name, ())]
+
+    def most_common(self, n: int = None):
+        """
+        Get the most used ingredient names (first seen first, on ties).
+        :param n: number of names, or None for all of them
+        :return: list of (name, count) pairs
+        """
+        return self.counts.most_common(n)
+
+
+class TitleIndex:
+    """
+    Index of recipe titles: constant time exact lookup, and case-insensitive prefix or typo-tolerant search.
+    Prefix search bisects the sorted lowercase titles.
+    Fuzzy search only compares the titles sharing the most trigrams with the query, rather than all of them.
+    """
+    GRAM = 3
+    FUZZY_CANDIDATES = 50  # Titles actually compared with the query, at most
+
+    def __init__(self, recipes):
+        """
+        Builds the index in a single pass over the recipes, then sorts the titles once.
+        :param recipes: recipes dict, or iterator of (id, Recipe) pairs
+        """
+        self.recipes = []  # Recipe objects, in collection order
+        self.titles = {}  # EXACT title -> Recipe (first one, if several have the same title)
+        self.grams = defaultdict(list)  # trigram of a lowercase title -> positions
+        for rid, recipe in recipe_items(recipes):
+            self.titles.setdefault(recipe.title, recipe)
+            for gram in self.get_grams(recipe.title):
+                self.grams[gram].append(len(self.recipes))
+            self.recipes.append(recipe)
+        self.sorted_titles = sorted((recipe.title.casefold(), pos) for pos, recipe in enumerate(self.recipes))
+
+    @classmethod
+    def get_grams(cls, text: str):
+        """
+        Get the trigrams of a string, ignoring case. It is padded so that short strings still have some.
+        :param text: title or query
+        :return: set of substrings of length GRAM
+        """
+        text = f" {text.casefold()} "
+        return {text[i:i + cls.GRAM] for i in range(len(text) - cls.GRAM + 1)}
+
+    def get(self, title: str):
+        """
+        Get a recipe by its title.
+        :param title: EXACT title of recipe
+        :return: Recipe object or None
+        """
+        return self.titles.get(title)
+
+    def search_prefix(self, prefix: str, limit: int = None):
+        """
+        Get the recipes whose title starts with a prefix, ignoring case.
+        :param prefix: start of the title
+        :param limit: maximum number of recipes, or None for all of them
+        :return: list of Recipe objects, in title order
+        """
+        prefix = prefix.casefold()
+        ret = []
+        for title, pos in self.sorted_titles[bisect_left(self.sorted_titles, (prefix,)):]:
+            if not title.startswith(prefix) or len(ret) == limit:
+                break
+            ret.append(self.recipes[pos])
+        return ret
+
+    def search_fuzzy(self, text: str, limit: int = 10, cutoff: float = 0.6):
+        """
+        Get the recipes whose title is close to a text, ignoring case: typos, missing or extra letters...
+        :param text: approximate title
+        :param limit: maximum number of recipes
+        :param cutoff: minimum similarity ratio (0 to 1) for a title to match
+        :return: list of Recipe objects, closest first
+        """
+        shared = Counter(pos for gram in self.get_grams(text) for pos in self.grams.get(gram, ()))
+        text = text.casefold()
+        scored = []
+        for pos, _ in shared.most_common(self.FUZZY_CANDIDATES):
+            ratio = SequenceMatcher(None, text, self.recipes[pos].title.casefold()).ratio()
+            if ratio >= cutoff:
+                scored.append((-ratio, pos))
+        return [self.recipes[pos] for _, pos in sorted(scored)[:limit]]
+
+    def suggest(self, text: str, limit: int = 10):
+        """
+        Get recipes for autocompletion: titles starting with the text first, then those close to it.
+        :param text: what has been typed so far
+        :param limit: maximum number of recipes
+        :return: list of Recipe objects, without duplicates
+        """
+        ret = self.search_prefix(text, limit)
+        if len(ret) < limit:
+            ret += [x for x in self.search_fuzzy(text, limit) if x not in ret][:limit - len(ret)]
+        return ret
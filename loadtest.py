@@ -0,0 +1,124 @@
+"""File: loadtest.py
+Load test for server.py: many concurrent clients, each sending requests over its own keep-alive connection.
+Reports throughput, latency percentiles and errors.
+Usage: python3 loadtest.py [--port 8080] [--clients 100] [--requests 50]
+       python3 loadtest.py --spawn [--file recipes.xml]  (starts a server in this process first)"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from urllib.parse import urlencode
+
+# Request targets picked at random, covering every endpoint; the titles are from recipes.xml
+TARGETS = (
+    ('get_recipe_titles', {}),
+    ('get_total_ingredient_count', {'ingredient': 'egg'}),
+    ('get_recipes_with_ingredient', {'ingredient': 'olive oil'}),
+    ('get_all_ingredient_counts', {'ingredient': 'sugar'}),
+    ('filter_under_calories', {'calories': 500}),
+    ('filter_under_calories', {'calories': 1000}),
+    ('get_amount_str', {'title': 'Zuppa Inglese', 'ingredient': 'sugar'}),
+    ('get_prep_steps', {'title': 'Zuppa Inglese', 'from': 0, 'to': 2}),
+    ('filter_above_steps', {'steps': 5}),
+    ('filter_by_no_ingredient', {'ingredient': 'butter'}),
+    ('get_similar_recipes', {'title': 'Ricotta Pie', 'k': 3}),
+    ('max_calories', {}),
+    ('get_most_common_unit', {}),
+    ('get_diff_ingredient_count', {}),
+    ('max_fat', {}),
+    ('get_most_common_ingredient', {}),
+    ('sort_by_ingredient_count', {}),
+    ('get_ingredient_usages', {}),
+    ('get_recipe_repartition', {}),
+    ('get_easiest_recipe', {}),
+    ('recipe', {'id': 'r101'}),
+)
+
+
+async def client(host: str, port: int, requests: int, rng: random.Random, latencies: list, errors: list):
+    """
+    Sends requests one after the other over a single connection, recording each latency.
+    :param host: server address
+    :param port: server port
+    :param requests: number of requests to send
+    :param rng: random generator picking the targets
+    :param latencies: list the latencies (in seconds) are added to
+    :param errors: list the failed targets and statuses are added to
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(requests):
+            name, params = rng.choice(TARGETS)
+            target = f"/{name}?{urlencode(params)}" if params else f"/{name}"
+            start = time.perf_counter()
+            writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode('latin-1'))
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while (line := await reader.readline()) not in (b'\r\n', b''):
+                header, _, value = line.decode('latin-1').partition(':')
+                if header.lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append((target, status))
+    finally:
+        writer.close()
+
+
+async def run(host: str, port: int, clients: int, requests: int, seed: int):
+    """
+    Runs every client at once and prints the results.
+    :param host: server address
+    :param port: server port
+    :param clients: number of concurrent clients (connections)
+    :param requests: requests sent by each client
+    :param seed: random seed
+    :return: number of failed requests
+    """
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, requests, random.Random(seed + i), latencies, errors)
+                           for i in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    percentile = lambda p: latencies[min(int(p / 100 * len(latencies)), len(latencies) - 1)] * 1000
+    print(f"{len(latencies)} requests from {clients} clients in {elapsed:.2f} s: {len(latencies) / elapsed:,.0f} req/s")
+    print(f"Latency: mean {statistics.mean(latencies) * 1000:.2f} ms, p50 {percentile(50):.2f} ms, "
+          f"p95 {percentile(95):.2f} ms, p99 {percentile(99):.2f} ms, max {latencies[-1] * 1000:.2f} ms")
+    print(f"Errors: {len(errors)}" + (f" (first: {errors[0]})" if errors else ''))
+    return len(errors)
+
+
+async def spawn_and_run(filename: str, args):
+    """Starts a server on a free port of this event loop, then runs the load test against it."""
+    import repositories as rps
+    from server import QueryServer
+
+    server = QueryServer(rps.init_recipes(filename))
+    listener = await asyncio.start_server(server.handle, '127.0.0.1', 0, backlog=1024)
+    async with listener:
+        return await run('127.0.0.1', listener.sockets[0].getsockname()[1], args.clients, args.requests, args.seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test for server.py.")
+    parser.add_argument('--host', default='127.0.0.1', help="server address")
+    parser.add_argument('--port', type=int, default=8080, help="server port")
+    parser.add_argument('--clients', type=int, default=100, help="concurrent clients")
+    parser.add_argument('--requests', type=int, default=50, help="requests per client")
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+    parser.add_argument('--spawn', action='store_true', help="start a server in this process instead")
+    parser.add_argument('--file', default='recipes.xml', help="recipes XML file, with --spawn")
+    args = parser.parse_args()
+
+    if args.spawn:
+        failed = asyncio.run(spawn_and_run(args.file, args))
+    else:
+        failed = asyncio.run(run(args.host, args.port, args.clients, args.requests, args.seed))
+    if failed:
+        raise SystemExit(1)
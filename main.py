@@ -5,11 +5,16 @@ and another to show the function source code."""
 import re
 import sys
 import inspect
-import locale
-from PyQt5.QtWidgets import *
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from PyQt5.QtCore import QFileSystemWatcher, QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+from PyQt5.QtGui import QTextCursor
+from PyQt5.QtWidgets import QApplication, QFileDialog, QWidget
 
+import helper
 import repositories as rps
 from design import Ui_Form # Généré avec Qt Designer
+from profiling import Profiler
 from ut import *
 
 
@@ -35,6 +40,10 @@ Vous pouvez aussi voir le code source de la fonction dans la boîte à droite. E
 
 Toutes les fonctions sont numérotées avec le numéro de la question à laquelle elles répondent."""
 
+# Every repository and helper function is timed, for the profiling panel
+profiler = Profiler()
+profiler.instrument(rps, helper)
+
 tests = (
     ("---INSTRUCTIONS---", None, None),
     ("3. init_recipes", rps.init_recipes, lambda fn, rcp: fn()),
@@ -54,11 +63,105 @@ tests = (
     ("17. max_fat", rps.max_fat, lambda fn, rcp: fn(rcp)),
     ("18. get_most_common_ingredient", rps.get_most_common_ingredient, lambda fn, rcp: fn(rcp)),
     ("19. sort_by_ingredient_count", rps.sort_by_ingredient_count, lambda fn, rcp: fn(rcp)),
-    ("20. get_recipes_with_ingredient", rps.get_recipes_with_ingredient, lambda fn, rcp: fn(rcp, 'beef')),
+    ("20. get_ingredient_usages", rps.get_ingredient_usages, lambda fn, rcp: fn(rcp)),
     ('21. get_recipe_repartition', rps.get_recipe_repartition, lambda fn, rcp: fn(rcp)),
     ('22. get_easiest_recipe', rps.get_easiest_recipe, lambda fn, rcp: fn(rcp)),
 )
 
+RENDER_CHUNK = 200 # Lines added to the output box per event loop turn, so big results don't freeze the window
+RELOAD_DELAY = 300 # Milliseconds to wait after recipes.xml changes before reading it, while it's being saved
+
+
+@lru_cache(maxsize=None)
+def get_source(func):
+    """
+    Get the source code of a function, read from its file once.
+    :param func: function, instrumented or not
+    :return: str source code of the original function
+    """
+    return inspect.getsource(inspect.unwrap(func))
+
+
+class WorkerSignals(QObject):
+    """Signals of a QueryWorker or LoadWorker (a QRunnable isn't a QObject, so it can't have its own)."""
+    finished = pyqtSignal(int, int, str, float) # Test index, generation, formatted result, seconds it took
+    done = pyqtSignal() # The worker no longer reads the recipes, cancelled or not
+    failed = pyqtSignal(int, int, str) # Test index, generation, error message
+    loaded = pyqtSignal(object) # Recipes collection
+    reloaded = pyqtSignal(object) # Recipes dict read again from the file, None if it couldn't be
+
+
+class LoadWorker(QRunnable):
+    """Loads the recipes on a thread pool, so the window shows up (and stays responsive) meanwhile."""
+
+    def __init__(self):
+        super().__init__()
+        self.signals = WorkerSignals()
+
+    def run(self):
+        self.signals.loaded.emit(rps.init_recipes())
+
+
+class ReloadWorker(QRunnable):
+    """
+    Reads recipes.xml again on a thread pool after it changed. Only the parsing happens here:
+    the differences are applied to the collection on the GUI thread, once no test uses it (see apply_reload).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            self.signals.reloaded.emit(dict(rps.iter_recipes()))
+        except (ET.ParseError, FileNotFoundError) as e: # Saved halfway, or being replaced: the next change retries
+            print(f"Error reloading recipes: {e}")
+            self.signals.reloaded.emit(None)
+
+
+class QueryWorker(QRunnable):
+    """
+    Runs a test on a thread pool, formatting its result there too (pformat takes a while on big results).
+    Python code can't be interrupted from another thread: cancelling only drops a worker that hasn't started yet,
+    or the result of a running one when it ends. Each run is tagged with a generation so stale results are ignored.
+    """
+
+    def __init__(self, index: int, generation: int, test: tuple, recipes):
+        """
+        :param index: index of the test in tests
+        :param generation: run number, sent back with the result
+        :param test: (name, function, caller) entry of tests
+        :param recipes: recipes dict the test runs on
+        """
+        super().__init__()
+        self.index = index
+        self.generation = generation
+        self.test = test
+        self.recipes = recipes
+        self.cancelled = False
+        self.signals = WorkerSignals() # Created on the GUI thread, so the signals are delivered there
+        self.setAutoDelete(False) # Kept in state['active'] until done, so the pool can be asked to take it back
+
+    def cancel(self):
+        """Asks the worker to drop its result."""
+        self.cancelled = True
+
+    def run(self):
+        try:
+            if self.cancelled: # Cancelled before a thread picked it up
+                return
+            try:
+                text, elapsed = ut_repr(self.test[2], self.test[1], self.recipes) # Run the test
+            except Exception as e:
+                if not self.cancelled:
+                    self.signals.failed.emit(self.index, self.generation, f"{type(e).__name__}: {e}")
+                return
+            if not self.cancelled:
+                self.signals.finished.emit(self.index, self.generation, text, elapsed)
+        finally:
+            self.signals.done.emit()
+
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -75,24 +178,210 @@ if __name__ == "__main__":
         ))
     )
 
-    recipes = rps.init_recipes()
-    print(recipes)
+    recipes = None # Loaded in the background, see on_loaded
 
 
+    pool = QThreadPool.globalInstance()
+    results = {} # Test index -> (recipes version, formatted result) of its last run
+    state = {
+        'generation': 0, # Incremented by each run and cancel, to recognize stale results
+        'worker': None, # Running QueryWorker
+        'active': set(), # QueryWorkers started and not done yet, cancelled ones included
+        'reload': None, # Recipes dict read again from the file, waiting for the active workers to be done
+        'lines': [], # Lines of the result being rendered
+        'rendered': 0, # How many of them are shown
+    }
+    render_timer = QTimer(Form)
+    render_timer.setInterval(0) # Every time the event loop is idle
+    watcher = QFileSystemWatcher(Form) # Live reload of recipes.xml, once loaded
+    reload_timer = QTimer(Form)
+    reload_timer.setSingleShot(True)
+    reload_timer.setInterval(RELOAD_DELAY)
+    ui.outputText.setUndoRedoEnabled(False)
+
+    def get_version():
+        """Get the version of recipes, so results computed on older contents aren't shown (0 for a plain dict)."""
+        return getattr(recipes, 'version', 0)
+
+    def set_busy(busy: bool):
+        """Shows (or stops showing) that a test runs, with an indeterminate progress bar."""
+        ui.progressBar.setRange(0, 0 if busy else 1)
+        ui.progressBar.setValue(0)
+        ui.cancelButton.setEnabled(busy)
+
+    def cancel():
+        """Stops the running test (see QueryWorker) and rendering, if any."""
+        state['generation'] += 1
+        if state['worker'] is not None:
+            state['worker'].cancel()
+            state['worker'] = None
+        for worker in list(state['active']): # Workers that haven't started yet; load and reload workers are kept
+            if pool.tryTake(worker):
+                state['active'].discard(worker)
+        render_timer.stop()
+        set_busy(False)
+
+    def render(text: str):
+        """
+        Shows a result in the output box, a few lines at a time (see on_render_tick).
+        :param text: formatted result
+        """
+        ui.outputText.clear()
+        state['lines'] = text.splitlines()
+        state['rendered'] = 0
+        ui.progressBar.setRange(0, max(len(state['lines']), 1))
+        ui.cancelButton.setEnabled(True)
+        render_timer.start()
+
+    def on_render_tick():
+        """Slot; signaled by the render timer. Appends the next lines of the result to the output box."""
+        start = state['rendered']
+        chunk = state['lines'][start:start + RENDER_CHUNK]
+        cursor = ui.outputText.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(("\n" if start else "") + "\n".join(chunk))
+        state['rendered'] += len(chunk)
+        ui.progressBar.setValue(state['rendered'])
+        if state['rendered'] >= len(state['lines']):
+            render_timer.stop()
+            set_busy(False)
+            ui.progressBar.setValue(1)
+
+    def on_finished(index: int, generation: int, text: str, elapsed: float):
+        """
+        Slot; signaled by a worker. Keeps and shows its result, unless another test was selected since,
+        and how long it took above the profiling statistics.
+        """
+        if generation != state['generation']:
+            return
+        state['worker'] = None
+        results[index] = (get_version(), text)
+        render(text)
+        ui.profileText.setPlainText(f"{tests[index][0]} : {elapsed * 1000:.3f} ms\n\n{profiler.report()}")
+
+    def on_failed(index: int, generation: int, message: str):
+        """Slot; signaled by a worker. Shows the error raised by the test."""
+        if generation != state['generation']:
+            return
+        state['worker'] = None
+        set_busy(False)
+        ui.outputText.setText(message)
+        ui.profileText.setPlainText(profiler.report())
+
+    def on_cancel():
+        """Slot; signaled by the cancel button."""
+        cancel()
+        ui.outputText.append("\nAnnulé.")
+
+    def on_loaded(loaded):
+        """Slot; signaled by the load worker. Enables the function list once the recipes are there."""
+        global recipes
+        recipes = loaded
+        if recipes is not None:
+            watcher.addPath("recipes.xml")
+        ui.functionList.setEnabled(True)
+        set_busy(False)
+        on_selection(ui.functionList.currentRow())
+
+    def on_file_changed(path: str):
+        """Slot; signaled by the file watcher. Reloads the file once it hasn't changed for RELOAD_DELAY."""
+        if path not in watcher.files(): # Editors often save to a new file replacing this one, which ends the watch
+            watcher.addPath(path)
+        reload_timer.start()
+
+    def on_reload():
+        """Slot; signaled by the reload timer. Reads the file again in the background."""
+        reloader = ReloadWorker()
+        reloader.signals.reloaded.connect(on_reloaded)
+        pool.start(reloader)
+
+    def on_reloaded(loaded):
+        """
+        Slot; signaled by the reload worker. Applies what changed in the file to the recipes (see RecipeCollection.sync),
+        then shows the selected test again: run again if its result went stale, its last result otherwise.
+        """
+        if loaded is None:
+            return
+        state['reload'] = loaded
+        cancel()
+        apply_reload()
+
+    def on_worker_done(worker: QueryWorker):
+        """Slot; signaled by a query worker once it no longer reads the recipes. Applies a pending reload."""
+        state['active'].discard(worker)
+        apply_reload()
+
+    def apply_reload():
+        """
+        Applies the pending reload, once no test (even a cancelled one, still running) reads the recipes:
+        they mustn't change meanwhile. Until then, on_worker_done calls it again.
+        The selected test was cancelled meanwhile, so it's shown again even if nothing changed.
+        """
+        if state['reload'] is None or state['active']:
+            return
+        recipes.sync(state['reload'])
+        state['reload'] = None
+        on_selection(ui.functionList.currentRow())
+
     def on_selection(self: int):
         """
-        Slot; signaled by function list. Runs test corresponding to the selected entry.
+        Slot; signaled by function list. Runs test corresponding to the selected entry on the thread pool,
+        cancelling the previous one; a test already run on the same recipes shows its last result right away.
         :param self: function list index
         """
-        if self == 0: # Instructions
+        if recipes is None: # Still loading, on_loaded will run it
+            return
+        cancel()
+        if state['reload'] is not None: # Waiting for a cancelled test to end, apply_reload will run it
+            ui.outputText.setText("Rechargement des recettes...")
+            return
+        if self <= 0: # Instructions (or nothing selected yet)
             ui.outputText.setText(instructions)
             ui.sourceText.setText("")
             return
         test = tests[self]
-        ui.outputText.setText(ut_repr(test[2], test[1], recipes)) # Run the test
-        ui.sourceText.setText(inspect.getsource(test[1]))
+        ui.sourceText.setText(get_source(test[1]))
+        if self in results and results[self][0] == get_version():
+            render(results[self][1])
+            return
+        worker = QueryWorker(self, state['generation'], test, recipes)
+        worker.signals.finished.connect(on_finished)
+        worker.signals.failed.connect(on_failed)
+        worker.signals.done.connect(lambda: on_worker_done(worker))
+        state['worker'] = worker
+        state['active'].add(worker)
+        ui.outputText.setText("Exécution...")
+        set_busy(True)
+        pool.start(worker)
+
+    def on_export():
+        """
+        Slot; signaled by the export button. Saves the profiling statistics as JSON,
+        and the recent calls next to them as a trace (for chrome://tracing, Perfetto...).
+        """
+        filename, _ = QFileDialog.getSaveFileName(Form, "Exporter les mesures", "profile.json", "JSON (*.json)")
+        if filename:
+            profiler.export(filename)
+            profiler.export_trace(re.sub(r"(\.json)?$", ".trace.json", filename, count=1))
 
     ui.functionList.currentRowChanged.connect(on_selection)
+    ui.cancelButton.clicked.connect(on_cancel)
+    render_timer.timeout.connect(on_render_tick)
+    watcher.fileChanged.connect(on_file_changed)
+    reload_timer.timeout.connect(on_reload)
+    app.aboutToQuit.connect(cancel)
+    ui.allocCheck.toggled.connect(profiler.set_track_allocations)
+    ui.cprofileCheck.toggled.connect(profiler.set_profiling)
+    ui.exportButton.clicked.connect(on_export)
+
+    # The window shows up first, then the recipes are loaded
+    loader = LoadWorker()
+    loader.signals.loaded.connect(on_loaded)
+    ui.functionList.setEnabled(False)
+    ui.outputText.setText("Chargement des recettes...")
+    set_busy(True)
+    ui.cancelButton.setEnabled(False)
+    pool.start(loader)
 
     Form.show()
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,60 @@
+"""File: matching.py
+Multi-pattern substring matching, to look for many ingredient names at once."""
+
+from collections import deque
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton: finds which of many patterns a text contains, in a single pass over the text,
+    however many patterns there are (instead of one 'in' test per pattern).
+    Nodes are numbered, each with its transitions, failure link and the patterns ending there.
+    """
+
+    def __init__(self, patterns):
+        """
+        Builds the trie of the patterns, then its failure links (breadth first).
+        :param patterns: iterable of str patterns
+        """
+        self.patterns = list(patterns)
+        self.goto = [{}]  # node -> {character: next node}
+        self.fail = [0]  # node -> longest proper suffix of it that is also in the trie
+        self.output = [set()]  # node -> indexes of the patterns matched when reaching it
+
+        for i, pattern in enumerate(self.patterns):
+            node = 0
+            for ch in pattern:
+                if ch not in self.goto[node]:
+                    self.goto[node][ch] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(set())
+                node = self.goto[node][ch]
+            self.output[node].add(i)
+
+        queue = deque(self.goto[0].values())  # Depth 1 nodes fail to the root
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                fail = self.fail[node]
+                while fail and ch not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(ch, 0)
+                # Patterns ending at the suffix end here too; that node is shallower, so it's already complete
+                self.output[child] |= self.output[self.fail[child]]
+
+    def find(self, text: str):
+        """
+        Get the patterns contained in a text.
+        :param text: text to search
+        :return: set of pattern indexes
+        """
+        found = set(self.output[0])  # Only the empty pattern ends at the root
+        node = 0
+        for ch in text:
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            found |= self.output[node]
+        return found
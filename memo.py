@@ -0,0 +1,192 @@
+"""File: memo.py
+Memoization of the query functions: a result is kept for the collection it was computed on, as long as
+the collection doesn't change. Recipes hold lists, so they can't be hashed, which rules out functools.lru_cache."""
+
+import sys
+import threading
+import weakref
+from collections import Counter, OrderedDict
+from functools import wraps
+from inspect import signature
+
+from helper import *
+
+MAX_SIZE_DEPTH = 3  # Containers nested deeper than this aren't counted in the size of a result
+MISSING = object()  # No cached result (None is a result)
+
+
+def get_size(value, depth: int = 0):
+    """
+    Get roughly how much memory a result takes, its containers and their contents.
+    Recipes and ingredients aren't counted, since the collection holds them anyway.
+    :param value: query result
+    :param depth: nesting level of value
+    :return: size in bytes
+    """
+    size = sys.getsizeof(value)
+    if depth >= MAX_SIZE_DEPTH or isinstance(value, (str, bytes)):
+        return size
+    if isinstance(value, dict):
+        items = (x for item in value.items() for x in item)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        items = iter(value)
+    else:
+        return size
+    return size + sum(get_size(x, depth + 1) for x in items
+                      if not isinstance(x, (Recipe, CompactRecipe, Ingredient, CompactIngredient)))
+
+
+class QueryCache:
+    """
+    LRU cache of query results, keyed by the collection (its identity and version), the function and its arguments.
+    Only calls on a RecipeCollection are cached: a plain dict has no version, a stream can only be read once.
+    Arguments that can't be hashed (Recipe objects...) are keyed by identity, and kept alive with the entry
+    so their id can't be reused meanwhile.
+    When a collection changes, its older entries are dropped on its next call; when it's freed, right away.
+    Both the number of entries and their estimated size (see get_size()) are bounded.
+    Mutable results (lists, dicts, sets) are copied on the way out, so a caller modifying one doesn't modify the cache;
+    the copy is shallow, nested lists are still shared.
+    """
+
+    def __init__(self, maxsize: int = 256, max_bytes: int = 32 << 20):
+        """
+        :param maxsize: maximum number of entries
+        :param max_bytes: maximum total size of the entries, in bytes
+        """
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.enabled = True
+        self.entries = OrderedDict()  # key -> (result, size, arguments), least recently used first
+        self.versions = {}  # id of a collection -> version its entries were computed on
+        self.bytes = 0
+        self.lock = threading.RLock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+        self.calls = {}  # function name -> Counter of hits and misses
+
+    @staticmethod
+    def get_key(func, recipes: RecipeCollection, args: tuple, kwargs: dict):
+        """
+        Get the cache key of a call.
+        Arguments are bound to the parameters first, so fn(rcp, 'egg') and fn(rcp, ing_name='egg') share an entry.
+        :param func: memoized function, with its signature in __signature__
+        :param recipes: collection, first argument of the call
+        :param args: the other positional arguments
+        :param kwargs: keyword arguments
+        :return: hashable key
+        """
+        bound = func.__signature__.bind(recipes, *args, **kwargs)
+        bound.apply_defaults()
+        params = []
+        for name, value in list(bound.arguments.items())[1:]:
+            try:
+                hash(value)
+            except TypeError:
+                value = ('<id>', id(value))
+            params.append((name, value))
+        return id(recipes), recipes.version, func.__qualname__, tuple(params)
+
+    def validate(self, recipes: RecipeCollection):
+        """Drops the entries of a collection computed on an older version of it."""
+        cid = id(recipes)
+        if cid not in self.versions:
+            weakref.finalize(recipes, self.invalidate, cid)
+        elif self.versions[cid] != recipes.version:
+            self.invalidate(cid)
+        self.versions[cid] = recipes.version
+
+    def invalidate(self, cid: int = None):
+        """
+        Drops the entries of a collection, or all of them.
+        :param cid: id() of the collection, None for every collection
+        """
+        with self.lock:
+            for key in [key for key in self.entries if cid is None or key[0] == cid]:
+                self.bytes -= self.entries.pop(key)[1]
+                self.stats['invalidations'] += 1
+            if cid is not None:
+                self.versions.pop(cid, None)
+
+    def get(self, key):
+        """
+        Get a cached result, marking it as recently used.
+        :param key: key from get_key()
+        :return: result, or MISSING
+        """
+        with self.lock:
+            if key not in self.entries:
+                return MISSING
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, result, args: tuple):
+        """
+        Caches a result, evicting the least recently used ones beyond the bounds.
+        :param key: key from get_key()
+        :param result: result of the call
+        :param args: arguments of the call, kept alive with it
+        """
+        size = get_size(result)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (result, size, args)
+            self.bytes += size
+            while len(self.entries) > self.maxsize or self.bytes > self.max_bytes:
+                self.bytes -= self.entries.popitem(last=False)[1][1]
+                self.stats['evictions'] += 1
+
+    def count(self, name: str, outcome: str):
+        """Counts a hit or a miss, overall and for a function."""
+        with self.lock:
+            self.stats[outcome] += 1
+            self.calls.setdefault(name, Counter())[outcome] += 1
+
+    def memoize(self, func):
+        """
+        Decorator caching the results of a query function, whose first argument is the recipes.
+        :param func: query function
+        :return: memoized function
+        """
+        func.__signature__ = signature(func)  # Computed once, rather than on every call
+
+        @wraps(func)
+        def wrapper(recipes, *args, **kwargs):
+            if not self.enabled or not isinstance(recipes, RecipeCollection):
+                return func(recipes, *args, **kwargs)
+            key = self.get_key(func, recipes, args, kwargs)
+            with self.lock:
+                self.validate(recipes)
+                result = self.get(key)
+            if result is MISSING:
+                self.count(func.__qualname__, 'misses')
+                result = func(recipes, *args, **kwargs)
+                if recipes.version == key[1]:  # Unless the collection changed during the call
+                    self.put(key, result, args + tuple(kwargs.values()))
+            else:
+                self.count(func.__qualname__, 'hits')
+            return result.copy() if isinstance(result, (list, dict, set)) else result
+
+        return wrapper
+
+    def get_stats(self):
+        """
+        Get the cache statistics.
+        :return: dict of overall counts, entries and bytes, and 'functions': name -> {'hits', 'misses'}
+        """
+        with self.lock:
+            return self.stats | {'entries': len(self.entries), 'bytes': self.bytes,
+                                 'functions': {name: dict(counts) for name, counts in self.calls.items()}}
+
+    def clear(self):
+        """Drops every entry and resets the statistics."""
+        with self.lock:
+            self.invalidate()
+            self.stats = dict.fromkeys(self.stats, 0)
+            self.calls.clear()
+
+
+# Cache of the repositories.py functions
+query_cache = QueryCache()
+memoize = query_cache.memoize
@@ -1,8 +1,11 @@
 """File: models.py
 Holds data object classes for recipes and their components"""
-from dataclasses import dataclass
+import sys
+import threading
+from dataclasses import dataclass, field
 from datetime import date
-from typing import List, Tuple, Optional
+from functools import cached_property
+from typing import Iterator, List, Tuple, Optional
 
 
 @dataclass(frozen=True)
@@ -14,11 +17,23 @@ class Ingredient:
     ingredients: List['Ingredient'] # Nested list of Ingredient objects
     preparation: List[str]
 
+    def walk(self) -> Iterator['Ingredient']:
+        """
+        Yields this ingredient, then every ingredient nested in it (depth-first, in document order).
+        Uses an explicit stack, so the cost is linear in the number of ingredients whatever the nesting.
+        """
+        stack = [self]
+        while stack:
+            ingredient = stack.pop()
+            yield ingredient
+            if ingredient.ingredients:
+                stack.extend(reversed(ingredient.ingredients))
+
     def __repr__(self) -> str:
         """For shorter testing output with helper.ut()."""
         return self.name
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class NutritionInfo:
     """Data object component for nutrition information."""
     calories: float
@@ -39,6 +54,232 @@ class Recipe:
     # It's not really clear from the XML what 'related' should be, type-wise, so I went with my gut!
     # This is a list of recipe id/comment pairs, which is nullable by way of Optional.
 
+    @cached_property
+    def flat_ingredients(self) -> Tuple[Ingredient, ...]:
+        """All ingredients of the recipe, nested ones included, flattened once then cached."""
+        return tuple(i for ingredient in self.ingredients for i in ingredient.walk())
+
     def __repr__(self) -> str:
         """For shorter testing output with helper.ut()."""
-        return self.title
\ No newline at end of file
+        return self.title
+
+
+def compact_text(text: Optional[str]) -> Optional[str]:
+    """
+    Collapses the whitespace of a text from the XML, which is mostly indentation.
+    :param text: step or comment text, or None
+    :return: text on a single line, without the surrounding whitespace
+    """
+    return " ".join(text.split()) if text is not None else None
+
+
+@dataclass(frozen=True, slots=True)
+class CompactIngredient:
+    """
+    Memory-compact, hashable variant of Ingredient: no per-instance __dict__,
+    tuples instead of lists, interned name and unit (so every 'cup' is the same string),
+    and steps without their XML indentation.
+    """
+    name: str
+    amount: float
+    unit: str
+    ingredients: Tuple['CompactIngredient', ...]  # Nested tuple of CompactIngredient objects
+    preparation: Optional[Tuple[str, ...]]
+
+    walk = Ingredient.walk
+
+    @classmethod
+    def from_ingredient(cls, ingredient: Ingredient) -> 'CompactIngredient':
+        """Converts an Ingredient, along with its nested ingredients."""
+        return cls(
+            sys.intern(ingredient.name),
+            ingredient.amount,
+            sys.intern(ingredient.unit),
+            tuple(map(cls.from_ingredient, ingredient.ingredients)),
+            tuple(map(compact_text, ingredient.preparation)) if ingredient.preparation is not None else None
+        )
+
+    def __repr__(self) -> str:
+        """For shorter testing output with helper.ut()."""
+        return self.name
+
+
+@dataclass(frozen=True, slots=True)
+class CompactRecipe:
+    """
+    Memory-compact, hashable variant of Recipe, made of CompactIngredient objects.
+    Like theirs, its steps and comment lose their XML indentation.
+    It can be used anywhere a Recipe is expected.
+    """
+    title: str
+    date: date
+    ingredients: Tuple[CompactIngredient, ...]  # Nested tuple of CompactIngredient objects
+    preparation: Tuple[str, ...]
+    comment: str
+    nutrition: NutritionInfo
+    related: Optional[Tuple[str, str]]
+    # Slots can't hold a cached_property, so flat_ingredients is cached here instead
+    flat_cache: Optional[Tuple[CompactIngredient, ...]] = field(default=None, init=False, repr=False, compare=False)
+
+    @classmethod
+    def from_recipe(cls, recipe: Recipe) -> 'CompactRecipe':
+        """Converts a Recipe, along with all its ingredients."""
+        return cls(
+            recipe.title,
+            recipe.date,
+            tuple(map(CompactIngredient.from_ingredient, recipe.ingredients)),
+            tuple(map(compact_text, recipe.preparation)),
+            compact_text(recipe.comment),
+            recipe.nutrition,
+            tuple(recipe.related) if recipe.related is not None else None
+        )
+
+    @property
+    def flat_ingredients(self) -> Tuple[CompactIngredient, ...]:
+        """All ingredients of the recipe, nested ones included, flattened once then cached."""
+        if self.flat_cache is None:
+            object.__setattr__(self, 'flat_cache', tuple(i for ingredient in self.ingredients for i in ingredient.walk()))
+        return self.flat_cache
+
+    def __repr__(self) -> str:
+        """For shorter testing output with helper.ut()."""
+        return self.title
+
+
+@dataclass
+class RecipeChanges:
+    """Differences between two versions of a recipes collection, by recipe id."""
+    added: dict = field(default_factory=dict)  # id -> new Recipe
+    changed: dict = field(default_factory=dict)  # id -> (old Recipe, new Recipe)
+    removed: dict = field(default_factory=dict)  # id -> old Recipe
+
+    @classmethod
+    def between(cls, old: dict, new: dict) -> 'RecipeChanges':
+        """
+        Compares two recipes dicts.
+        :param old: recipes dict before
+        :param new: recipes dict after
+        :return: RecipeChanges, in the order of the dict each recipe is taken from
+        """
+        return cls(
+            {rid: recipe for rid, recipe in new.items() if rid not in old},
+            {rid: (old[rid], recipe) for rid, recipe in new.items() if rid in old and old[rid] != recipe},
+            {rid: recipe for rid, recipe in old.items() if rid not in new}
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+    def __repr__(self) -> str:
+        return f"+{len(self.added)} ~{len(self.changed)} -{len(self.removed)}"
+
+
+class RecipeCollection(dict):
+    """
+    Recipes dict, indexed by their ID, as returned by repositories.init_recipes().
+    It behaves exactly like a dict, but also holds the structures derived from its recipes (indexes...),
+    so that they are built once for the collection instead of once per query.
+    Any modification drops them and bumps version, so they can never go stale;
+    apply() and sync() update the ones that know how to, instead (see RecipeChanges).
+    Queries running on several threads (server, GUI) share them: each one is built once, under a lock.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+        self.derived = {}  # builder -> structure it built from this collection
+        self.lock = threading.RLock()  # Held while derived structures are built or dropped (builders may nest)
+
+    def get_derived(self, builder):
+        """
+        Get a structure derived from this collection, building it on first use.
+        :param builder: callable taking the collection (usually an index class), also used as cache key
+        :return: whatever builder returned for the current version of the collection
+        """
+        with self.lock:
+            if builder not in self.derived:
+                self.derived[builder] = builder(self)
+            return self.derived[builder]
+
+    def changed(self):
+        """Called after every modification: derived structures are outdated."""
+        with self.lock:
+            self.version += 1
+            self.derived.clear()
+
+    def apply(self, changes: 'RecipeChanges'):
+        """
+        Applies changes in a single modification: changed recipes keep their place, added ones go at the end.
+        Derived structures having an apply(recipes, changes) method are updated rather than dropped,
+        unless it returns False.
+        :param changes: RecipeChanges, e.g. from RecipeChanges.between()
+        """
+        with self.lock:
+            for rid in changes.removed:
+                super().__delitem__(rid)
+            for rid, (_, recipe) in changes.changed.items():
+                super().__setitem__(rid, recipe)
+            for rid, recipe in changes.added.items():
+                super().__setitem__(rid, recipe)
+            self.version += 1
+            self.derived = {builder: structure for builder, structure in self.derived.items()
+                            if hasattr(structure, 'apply') and structure.apply(self, changes) is not False}
+
+    def sync(self, recipes: dict):
+        """
+        Makes this collection the same as another one, e.g. the file it was loaded from, read again.
+        Only the differences are applied (see apply()), when the recipes are still in the same order;
+        otherwise everything is replaced at once.
+        :param recipes: recipes dict with the new contents
+        :return: RecipeChanges that were applied (empty if nothing changed)
+        """
+        changes = RecipeChanges.between(self, recipes)
+        if not changes:
+            return changes
+        kept = [rid for rid in recipes if rid not in changes.added]
+        if list(recipes) == kept + list(changes.added) and kept == [rid for rid in self if rid in recipes]:
+            self.apply(changes)
+        else:  # Added in the middle, or moved: positions change, nothing can be updated in place
+            super().clear()
+            super().update(recipes)
+            self.changed()
+        return changes
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.changed()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, *args):
+        ret = super().pop(*args)
+        self.changed()
+        return ret
+
+    def popitem(self):
+        ret = super().popitem()
+        self.changed()
+        return ret
+
+    def clear(self):
+        super().clear()
+        self.changed()
+
+    def __reduce__(self):
+        """Pickled (or copied) as its recipes only: derived structures are rebuilt on demand."""
+        return type(self), (dict(self),)
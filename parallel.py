@@ -0,0 +1,270 @@
+"""File: parallel.py
+Runs per-recipe queries and the all-pairs similarity on a pool of processes, one shard of the collection each.
+Workers load the collection once, from the snapshot of the XML file (see snapshot.py), when they start:
+tasks only carry recipe positions, and results only recipe ids, never the recipes themselves.
+Usage:
+    with RecipePool('recipes.xml') as pool:
+        similar = pool.map(rps.get_similar_recipes, k=3)
+        ids, rows, cols, scores = pool.similarity_matrix(k=10)"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from inspect import signature
+
+import numpy as np
+
+import repositories as rps
+from helper import *
+
+SHARDS_PER_WORKER = 4  # Tasks per worker, so the ones finishing early pick up more work
+BLOCK_CELLS = 1 << 21  # Pairs of recipes scored at once by similarity_shard(), bounding its memory
+
+# State of a worker process, set by init_worker()
+worker_recipes = None  # Collection
+worker_items = None  # (recipe id, Recipe) pairs, by position
+worker_ids = None  # id() of a Recipe -> its recipe id
+worker_postings = None  # See get_postings()
+
+
+def init_worker(filename: str, compact: bool):
+    """Initializer of the worker processes: loads the collection, from its snapshot."""
+    global worker_recipes, worker_items, worker_ids
+    worker_recipes = rps.init_recipes(filename, compact=compact)
+    worker_items = list(worker_recipes.items())
+    worker_ids = {id(recipe): rid for rid, recipe in worker_items}
+    rps.query_cache.enabled = False  # Each recipe is queried once, caching would only take memory
+
+
+class RecipeRef:
+    """Reference to a recipe of the collection, sent instead of the recipe itself."""
+    __slots__ = ('rid',)
+
+    def __init__(self, rid: str):
+        self.rid = rid
+
+    def __reduce__(self):
+        return RecipeRef, (self.rid,)
+
+
+def encode(value, ids: dict):
+    """
+    Replaces the recipes in a result by references to their id, to send it back from a worker.
+    :param value: query result
+    :param ids: id() of a Recipe -> its recipe id
+    :return: result, with RecipeRef objects instead of recipes (in lists, tuples, dicts and sets)
+    """
+    if id(value) in ids and isinstance(value, (Recipe, CompactRecipe)):
+        return RecipeRef(ids[id(value)])
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return type(value)(encode(x, ids) for x in value)
+    if isinstance(value, dict):
+        return type(value)({encode(k, ids): encode(v, ids) for k, v in value.items()})
+    return value
+
+
+def decode(value, recipes: dict):
+    """
+    Replaces the references to recipes in a result sent by a worker by the recipes of this process.
+    :param value: encoded result
+    :param recipes: recipes dict of this process
+    :return: result, with Recipe objects
+    """
+    if isinstance(value, RecipeRef):
+        return recipes[value.rid]
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return type(value)(decode(x, recipes) for x in value)
+    if isinstance(value, dict):
+        return type(value)({decode(k, recipes): decode(v, recipes) for k, v in value.items()})
+    return value
+
+
+def map_shard(func, positions: range, args: tuple, kwargs: dict):
+    """
+    Runs a query for some recipes of the collection, in a worker.
+    :param func: query function, taking a Recipe first, or the recipes then a Recipe (see RecipePool.map())
+    :param positions: positions of the recipes in the collection
+    :param args: other positional arguments of func
+    :param kwargs: keyword arguments of func
+    :return: list of encoded results, in positions order
+    """
+    with_collection = next(iter(signature(func).parameters)) == 'recipes'
+    ret = []
+    for pos in positions:
+        recipe = worker_items[pos][1]
+        result = func(worker_recipes, recipe, *args, **kwargs) if with_collection else func(recipe, *args, **kwargs)
+        ret.append(encode(result, worker_ids))
+    return ret
+
+
+def get_postings():
+    """
+    Get the inverted index of the worker's collection as arrays, built on first use.
+    :return: (list of the token numbers of each recipe; list of int32 arrays, positions of the recipes using a token,
+    by token number; int64 array of the number of tokens of each recipe)
+    """
+    global worker_postings
+    if worker_postings is None:
+        from similarity import SimilarityIndex
+        index = get_index(worker_recipes, SimilarityIndex)
+        numbers = {token: number for number, token in enumerate(index.postings)}
+        postings = [np.array(positions, dtype=np.int32) for positions in index.postings.values()]
+        tokens = [[numbers[token] for token in x] for x in index.tokens]
+        worker_postings = tokens, postings, np.array(list(map(len, index.tokens)), dtype=np.int64)
+    return worker_postings
+
+
+def similarity_block(rows: range, metric: str, k: int):
+    """
+    Computes the scores of some recipes against every other, from the postings of their tokens:
+    a recipe shares as many tokens with another as there are postings of its tokens holding the other.
+    Shared tokens are counted in a len(rows) x n array, which only lives for the block.
+    :param rows: positions of the recipes
+    :param metric: 'jaccard' (shared / union) or 'overlap' (shared / smallest set)
+    :param k: maximum number of scores kept per recipe, the highest ones; None for all
+    :return: (row positions, column positions, scores) arrays of the non-zero scores, a recipe with itself left out;
+    by row, then by decreasing score with k (ties in any order), by column without
+    """
+    tokens, postings, sizes = get_postings()
+    count = len(sizes)
+    lengths = [sum(len(postings[token]) for token in tokens[row]) for row in rows]
+    columns = [postings[token] for row in rows for token in tokens[row]]
+    owners = np.repeat(np.arange(len(rows), dtype=np.int64), lengths)
+    codes = owners * count + (np.concatenate(columns) if columns else owners)
+    inter = np.bincount(codes, minlength=len(rows) * count).reshape(len(rows), count).astype(np.float64)
+    size1, size2 = sizes[rows.start:rows.stop, None], sizes[None, :]
+    if metric == 'jaccard':
+        total = size1 + size2 - inter
+    elif metric == 'overlap':
+        total = np.minimum(size1, size2).astype(np.float64)
+    else:
+        raise ValueError(f"Unknown similarity metric: {metric}")
+    scores = np.divide(inter, total, out=np.zeros_like(inter), where=inter > 0)
+    scores[np.arange(len(rows)), np.arange(rows.start, rows.stop)] = 0  # A recipe always scores 1 with itself
+
+    if k is None:
+        row_pos, col_pos = np.nonzero(scores)
+        return (row_pos + rows.start).astype(np.int32), col_pos.astype(np.int32), scores[row_pos, col_pos]
+    k = min(k, count)
+    col_pos = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < count else np.tile(np.arange(count), (len(rows), 1))
+    best = np.take_along_axis(scores, col_pos, axis=1)
+    order = np.argsort(-best, axis=1, kind='stable')
+    col_pos, best = np.take_along_axis(col_pos, order, axis=1), np.take_along_axis(best, order, axis=1)
+    row_pos = np.repeat(np.arange(rows.start, rows.stop), k).reshape(len(rows), k)
+    keep = best > 0
+    return row_pos[keep].astype(np.int32), col_pos[keep].astype(np.int32), best[keep]
+
+
+def similarity_shard(rows: range, metric: str, k: int):
+    """
+    Computes the scores of some recipes, in a worker (see similarity_block()).
+    Rows go by blocks of BLOCK_CELLS // n, so memory doesn't depend on the size of the shard.
+    :param rows: positions of the recipes
+    :param metric: 'jaccard' or 'overlap'
+    :param k: maximum number of scores kept per recipe, None for all
+    :return: (row positions, column positions, scores) arrays
+    """
+    step = max(BLOCK_CELLS // max(len(get_postings()[2]), 1), 1)
+    blocks = [similarity_block(range(start, min(start + step, rows.stop)), metric, k)
+              for start in range(rows.start, rows.stop, step)]
+    if not blocks:
+        return similarity_block(rows, metric, k)
+    return tuple(np.concatenate(column) for column in zip(*blocks))
+
+
+class RecipePool:
+    """
+    Pool of processes sharing one collection, for CPU-bound queries over all of its recipes.
+    Pure Python queries don't run in parallel on threads (GIL), but each process has its own interpreter.
+    The snapshot of the file is written first if needed, so every worker loads it instead of parsing the XML
+    (or, if it can't be written, parses it once too). Shards of map() are strided (recipes 0, n, 2n... then 1, n + 1...)
+    so they cost about the same even when recipes of a part of the collection are slower to query.
+    """
+
+    def __init__(self, filename: str = 'recipes.xml', workers: int = None, compact: bool = False):
+        """
+        :param filename: path to the XML file
+        :param workers: number of processes (default: number of CPUs)
+        :param compact: True to use CompactRecipe objects (see init_recipes)
+        """
+        self.recipes = rps.init_recipes(filename, compact=compact)  # Also writes the snapshot the workers load
+        if self.recipes is None:
+            raise FileNotFoundError(filename)
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(filename, compact))
+
+    def get_shards(self):
+        """
+        Splits the collection into strided shards.
+        :return: list of ranges of positions
+        """
+        count = min(self.workers * SHARDS_PER_WORKER, len(self.recipes)) or 1
+        return [range(i, len(self.recipes), count) for i in range(count)]
+
+    def map(self, func, *args, **kwargs):
+        """
+        Runs a query for every recipe of the collection, on the workers.
+        :param func: module-level function (so it can be pickled), e.g. a repositories.py query. If its first parameter
+        is named recipes, it's called as func(recipes, recipe, *args, **kwargs) (e.g. get_similar_recipes),
+        otherwise as func(recipe, *args, **kwargs) (e.g. get_prep_steps)
+        :param args: other positional arguments
+        :param kwargs: keyword arguments
+        :return: dict of recipe id -> result, in collection order; recipes in results are those of self.recipes
+        """
+        shards = self.get_shards()
+        futures = [self.executor.submit(map_shard, func, shard, args, kwargs) for shard in shards]
+        results = [None] * len(self.recipes)
+        for shard, future in zip(shards, futures):
+            for pos, result in zip(shard, future.result()):
+                results[pos] = decode(result, self.recipes)
+        return dict(zip(self.recipes, results))
+
+    def similarity_matrix(self, metric: str = 'jaccard', k: int = 10):
+        """
+        Computes the similarity of the pairs of recipes, from their ingredients (see similarity.py), on the workers.
+        The result is sparse: pairs sharing no token (score 0) and a recipe with itself (score 1) are left out.
+        With k, it takes O(n * k) memory; without, as much as there are pairs sharing a token, up to n^2
+        (a token common to every recipe, "salt"..., makes every pair score).
+        :param metric: 'jaccard' or 'overlap'
+        :param k: maximum number of scores kept per recipe, the highest ones; None for every non-zero score
+        :return: (recipe ids; row positions, column positions and scores arrays, by row then decreasing score):
+        recipe ids[rows[i]] scores scores[i] with ids[cols[i]]
+        """
+        count = len(self.recipes)
+        # Consecutive rows here, since every row costs about the same
+        bounds = np.linspace(0, count, min(self.workers * SHARDS_PER_WORKER, count) + 1).astype(int)
+        shards = [range(start, stop) for start, stop in zip(bounds, bounds[1:])]
+        blocks = list(self.executor.map(similarity_shard, shards, [metric] * len(shards), [k] * len(shards)))
+        if not blocks:
+            return [], np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0)
+        return (list(self.recipes), *(np.concatenate(column) for column in zip(*blocks)))
+
+    def close(self):
+        """Stops the workers."""
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="All-pairs similarity and per-recipe queries on a process pool.")
+    parser.add_argument('--file', default='recipes.xml', help="recipes XML file")
+    parser.add_argument('--workers', type=int, default=None, help="processes (default: number of CPUs)")
+    args = parser.parse_args()
+
+    with RecipePool(args.file, args.workers) as pool:
+        start = time.perf_counter()
+        ids, rows, cols, scores = pool.similarity_matrix(k=10)
+        print(f"10 most similar recipes to each of {len(ids)} recipes on {pool.workers} processes: "
+              f"{time.perf_counter() - start:.2f} s, {len(scores)} scores")
+        start = time.perf_counter()
+        similar = pool.map(rps.get_similar_recipes, k=3)
+        print(f"get_similar_recipes for every recipe: {time.perf_counter() - start:.2f} s")
+        for rid, recipes in list(similar.items())[:5]:
+            print(f"  {pool.recipes[rid]}: {recipes}")
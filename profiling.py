@@ -0,0 +1,226 @@
+"""File: profiling.py
+Per-function latency instrumentation: call counts, wall and CPU time, allocations, latency histograms,
+with optional tracemalloc and cProfile capture, and exports for tracing tools."""
+
+import cProfile
+import functools
+import inspect
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from types import FunctionType
+
+# Upper bounds (in seconds) of the latency histogram buckets; the last one catches everything slower
+BUCKETS = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1, 10, float('inf'))
+BUCKET_LABELS = ('<10us', '<100us', '<1ms', '<10ms', '<100ms', '<1s', '<10s', '>=10s')
+
+
+class CallStats:
+    """Statistics of all the calls to one function."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.wall = 0.0  # Total wall time, in seconds
+        self.wall_min = float('inf')
+        self.wall_max = 0.0
+        self.cpu = 0.0  # Total CPU time of the calling thread, in seconds
+        self.blocks = 0  # Total net memory blocks allocated (still alive when the call returned)
+        self.peak = 0  # Highest peak memory of a single call, in bytes (only measured with tracemalloc, outermost calls)
+        self.histogram = [0] * len(BUCKETS)
+
+    def add(self, wall: float, cpu: float, blocks: int, peak: int, error: bool):
+        """Records one call."""
+        self.count += 1
+        self.errors += error
+        self.wall += wall
+        self.wall_min = min(self.wall_min, wall)
+        self.wall_max = max(self.wall_max, wall)
+        self.cpu += cpu
+        self.blocks += blocks
+        self.peak = max(self.peak, peak)
+        self.histogram[next(i for i, bound in enumerate(BUCKETS) if wall < bound)] += 1
+
+    def to_dict(self):
+        """Get the statistics as plain data, for exports."""
+        return {
+            'count': self.count, 'errors': self.errors,
+            'wall_total': self.wall, 'wall_mean': self.wall / self.count if self.count else 0,
+            'wall_min': self.wall_min if self.count else 0, 'wall_max': self.wall_max,
+            'cpu_total': self.cpu, 'blocks': self.blocks, 'peak': self.peak,
+            'histogram': dict(zip(BUCKET_LABELS, self.histogram)),
+        }
+
+
+class Profiler:
+    """
+    Collects statistics about the functions it wraps.
+    Nested instrumented calls are counted in both functions: times are inclusive.
+    The most recent calls are also kept (in a bounded buffer) to be exported as a trace.
+    """
+
+    def __init__(self, trace_size: int = 10000):
+        """
+        :param trace_size: number of recent calls kept for export_trace()
+        """
+        self.stats = {}  # qualified function name -> CallStats
+        self.trace = deque(maxlen=trace_size)  # (name, start, duration, thread id), most recent last
+        self.wrappers = {}  # original function -> its wrapper, so it is wrapped once whatever the module
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.track_allocations = False
+        self.profile = None  # cProfile.Profile, while enabled
+        self.depth = threading.local()  # Nesting level of instrumented calls, per thread
+
+    def wrap(self, func):
+        """
+        Get an instrumented version of a function.
+        :param func: function to instrument
+        :return: wrapper function, which behaves exactly like func
+        """
+        if func in self.wrappers:
+            return self.wrappers[func]
+        name = f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            depth = getattr(self.depth, 'value', 0)
+            self.depth.value = depth + 1
+            # Only the outermost call is traced by tracemalloc/cProfile, so nested ones don't reset it
+            outermost = depth == 0
+            base = 0
+            if outermost and self.track_allocations:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+            profile = self.profile if outermost else None  # Kept, in case profiling is turned off meanwhile
+            if profile is not None:
+                profile.enable()
+            error = True
+            blocks = sys.getallocatedblocks()
+            cpu = time.thread_time()
+            start = time.perf_counter()
+            try:
+                ret = func(*args, **kwargs)
+                error = False
+                return ret
+            finally:
+                wall = time.perf_counter() - start
+                cpu = time.thread_time() - cpu
+                blocks = sys.getallocatedblocks() - blocks
+                if profile is not None:
+                    profile.disable()
+                peak = tracemalloc.get_traced_memory()[1] - base if outermost and self.track_allocations else 0
+                self.depth.value = depth
+                self.record(name, start, wall, cpu, blocks, peak, error)
+
+        self.wrappers[func] = wrapper
+        return wrapper
+
+    def instrument(self, *modules):
+        """
+        Replaces the functions of some modules with instrumented versions, in every one of these modules.
+        Since 'from module import *' copies functions into other modules, each module has to be patched:
+        e.g. instrument(repositories, helper) also catches helper functions called from repositories.
+        Only functions defined in one of the modules are wrapped, not classes, generators or library functions.
+        :param modules: module objects
+        :return: list of instrumented function names
+        """
+        names = {module.__name__ for module in modules}
+        instrumented = set()
+        for module in modules:
+            for attr, value in list(vars(module).items()):
+                if (isinstance(value, FunctionType) and value.__module__ in names
+                        and not inspect.isgeneratorfunction(value)  # Its calls would only time creating the generator
+                        and value not in self.wrappers.values()):
+                    setattr(module, attr, self.wrap(value))
+                    instrumented.add(f"{value.__module__}.{value.__qualname__}")
+        return sorted(instrumented)
+
+    def record(self, name: str, start: float, wall: float, cpu: float, blocks: int, peak: int, error: bool):
+        """Records one call of a function."""
+        with self.lock:
+            if name not in self.stats:
+                self.stats[name] = CallStats()
+            self.stats[name].add(wall, cpu, blocks, peak, error)
+            self.trace.append((name, start, wall, threading.get_ident()))
+
+    def set_track_allocations(self, enabled: bool):
+        """Starts or stops measuring the peak memory of each call with tracemalloc (which slows calls down)."""
+        self.track_allocations = enabled
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not enabled and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def set_profiling(self, enabled: bool):
+        """Starts (from scratch) or stops capturing instrumented calls with cProfile."""
+        self.profile = cProfile.Profile() if enabled else None
+
+    def reset(self):
+        """Forgets every statistic collected so far."""
+        with self.lock:
+            self.stats.clear()
+            self.trace.clear()
+        if self.profile is not None:
+            self.profile = cProfile.Profile()
+
+    def report(self):
+        """
+        Get a text table of the statistics, slowest functions (in total) first.
+        :return: str table
+        """
+        lines = [f"{'function':<40}{'calls':>7}{'mean ms':>10}{'max ms':>10}{'cpu ms':>10}{'blocks':>9}"
+                 + (f"{'peak KB':>10}" if self.track_allocations else '')]
+        with self.lock:
+            stats = sorted(self.stats.items(), key=lambda x: -x[1].wall)
+        for name, s in stats:
+            lines.append(f"{name.split('.', 1)[-1]:<40}{s.count:>7}{s.wall / s.count * 1000:>10.3f}"
+                         f"{s.wall_max * 1000:>10.3f}{s.cpu / s.count * 1000:>10.3f}{s.blocks // s.count:>9}"
+                         + (f"{s.peak / 1024:>10.1f}" if self.track_allocations else ''))
+            lines.append(' ' * 4 + '  '.join(f"{label}:{n}" for label, n in zip(BUCKET_LABELS, s.histogram) if n))
+        if self.profile is not None:
+            lines += ['', self.get_profile_text()]
+        return '\n'.join(lines)
+
+    def get_profile_text(self, limit: int = 20):
+        """
+        Get what cProfile captured, by cumulative time.
+        :param limit: number of functions to show
+        :return: str pstats report, or '' when profiling is off or nothing was captured
+        """
+        if self.profile is None:
+            return ''
+        out = io.StringIO()
+        try:
+            pstats.Stats(self.profile, stream=out).sort_stats('cumulative').print_stats(limit)
+        except TypeError:  # Nothing captured yet
+            return ''
+        return out.getvalue()
+
+    def export(self, filename: str):
+        """
+        Writes the statistics as JSON.
+        :param filename: path of the file to write
+        """
+        with self.lock:
+            data = {name: s.to_dict() for name, s in self.stats.items()}
+        with open(filename, 'w') as f:
+            json.dump({'pid': os.getpid(), 'time': time.time(), 'functions': data}, f, indent=2)
+
+    def export_trace(self, filename: str):
+        """
+        Writes the recent calls in the Trace Event format, which chrome://tracing, Perfetto and others can open.
+        :param filename: path of the file to write
+        """
+        with self.lock:
+            events = [{'name': name.split('.', 1)[-1], 'cat': name.split('.', 1)[0], 'ph': 'X',
+                       'ts': (start - self.origin) * 1e6, 'dur': wall * 1e6, 'pid': os.getpid(), 'tid': tid}
+                      for name, start, wall, tid in self.trace]
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,138 @@
+"""File: query.py
+Lazy, composable queries over a recipes collection, fusing every filter into a single pass."""
+
+import heapq
+from itertools import islice
+
+from helper import *
+
+# Relative cost of the predicates: the cheapest are checked first, so the expensive ones run on fewer recipes
+COST_NUTRITION = 0  # Reads one attribute
+COST_STEPS = 1  # Walks the (cached) flat ingredients, summing step counts
+COST_INGREDIENTS = 2  # Walks the flat ingredients, comparing names
+
+# Sort keys available by name in RecipeQuery.order_by()
+ORDER_KEYS = {
+    'title': lambda x: x.title,
+    'date': lambda x: x.date,
+    'calories': lambda x: x.nutrition.calories,
+    'fat': lambda x: x.nutrition.fat,
+    'carbohydrates': lambda x: x.nutrition.carbohydrates,
+    'protein': lambda x: x.nutrition.protein,
+    'steps': get_step_count,
+    'ingredient_count': lambda x: len(x.flat_ingredients),
+}
+
+
+class RecipeQuery:
+    """
+    Builds a query over recipes without running it.
+    Every method returns a new query (the original is left untouched), so queries can be shared and extended.
+    Nothing is read until the query is iterated: then all predicates are checked together, cheapest first,
+    stopping at the first that fails, in a single pass that stops as soon as the limit is reached.
+    Example: RecipeQuery(recipes).under_calories(500).above_steps(5).without_ingredient('butter').limit(3)
+    """
+
+    def __init__(self, recipes):
+        """
+        :param recipes: recipes dict, or iterator of (id, Recipe) pairs (which can then only be run once)
+        """
+        self.recipes = recipes
+        self.predicates = ()  # (cost, predicate) pairs, in the order they were added
+        self.order_key = None
+        self.reverse = False
+        self.max_count = None
+
+    def copy(self, **changes):
+        """
+        Get a copy of this query with some attributes changed.
+        :param changes: attribute names and their new values
+        :return: new RecipeQuery
+        """
+        ret = RecipeQuery(self.recipes)
+        ret.__dict__.update(self.__dict__)
+        ret.__dict__.update(changes)
+        return ret
+
+    def where(self, predicate, cost: int = COST_INGREDIENTS):
+        """
+        Add any predicate to the query.
+        :param predicate: callable taking a Recipe, True to keep it
+        :param cost: relative cost of the predicate, see COST_* (unknown ones are assumed expensive)
+        :return: new RecipeQuery
+        """
+        return self.copy(predicates=self.predicates + ((cost, predicate),))
+
+    def under_calories(self, calories: float):
+        """Keep recipes with less than a certain amount of calories (see QUESTION 8)."""
+        return self.where(lambda x: x.nutrition.calories < calories, COST_NUTRITION)
+
+    def above_steps(self, steps: int):
+        """Keep recipes with more than a certain number of steps (see QUESTION 11)."""
+        return self.where(lambda x: get_step_count(x) > steps, COST_STEPS)
+
+    def with_ingredient(self, ing_name: str):
+        """Keep recipes containing an ingredient, name can be partial (see QUESTION 6)."""
+        return self.where(lambda x: any(map(lambda y: ing_name in y.name, x.flat_ingredients)))
+
+    def without_ingredient(self, ing_name: str):
+        """Keep recipes not containing an ingredient, name can be partial (see QUESTION 12)."""
+        return self.where(lambda x: not any(map(lambda y: ing_name in y.name, x.flat_ingredients)))
+
+    def order_by(self, key, reverse: bool = False):
+        """
+        Sort the results. Ties keep collection order.
+        :param key: callable taking a Recipe, or name of one of ORDER_KEYS
+        :param reverse: True for decreasing order
+        :return: new RecipeQuery
+        """
+        return self.copy(order_key=ORDER_KEYS[key] if isinstance(key, str) else key, reverse=reverse)
+
+    def limit(self, count: int):
+        """
+        Stop after a number of results. When sorted, only that many recipes are kept while sorting.
+        :param count: maximum number of results
+        :return: new RecipeQuery
+        """
+        return self.copy(max_count=count)
+
+    def get_predicate(self):
+        """
+        Fuse every predicate into one, checking the cheapest first.
+        sorted() is stable, so predicates of the same cost keep the order they were added in.
+        :return: callable taking a Recipe, True if it passes every predicate
+        """
+        predicates = tuple(map(lambda x: x[1], sorted(self.predicates, key=lambda x: x[0])))
+        return lambda recipe: all(map(lambda x: x(recipe), predicates))
+
+    def __iter__(self):
+        """Runs the query, yielding results as they are found (or once sorted, if ordered)."""
+        matches = filter(self.get_predicate(), recipe_values(self.recipes))
+        if self.order_key is None:
+            return islice(matches, self.max_count)
+        if self.max_count is None:
+            return iter(sorted(matches, key=self.order_key, reverse=self.reverse))
+        # Equivalent to sorted(...)[:max_count], without keeping everything
+        top = heapq.nlargest if self.reverse else heapq.nsmallest
+        return iter(top(self.max_count, matches, key=self.order_key))
+
+    def to_list(self):
+        """
+        Runs the query.
+        :return: list of Recipe objects
+        """
+        return list(self)
+
+    def first(self):
+        """
+        Runs the query until its first result.
+        :return: Recipe object or None
+        """
+        return next(iter(self.limit(1)), None)
+
+    def count(self):
+        """
+        Runs the query, without keeping the results.
+        :return: number of results (at most the limit, if any)
+        """
+        return sum(1 for _ in self)
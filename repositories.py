@@ -2,111 +2,206 @@
 Contains all functions demanded by the project description."""
 
 import xml.etree.ElementTree as ET
-from collections import Counter, defaultdict
-from datetime import datetime as dt
+from collections import Counter
 from xml.etree.ElementTree import Element
 
+from graph import RelatedGraph
 from helper import *
+from matching import AhoCorasick
+from memo import memoize, query_cache
+from query import RecipeQuery
+from snapshot import load_snapshot, save_snapshot
+from streaming import iter_ingredient_names, iter_units, stream_top_k
 from ut import ut_print
 
-import locale
+# tables and similarity are imported by the functions using them: they need numpy,
+# which takes more time to import than everything else, and isn't needed to start the GUI.
 
+# Local names of the elements read by parse_recipe
+RECIPE_TAGS = ('title', 'date', 'ingredient', 'preparation', 'step', 'comment', 'nutrition', 'related')
 
-def init_recipes(filename='recipes.xml', ns_prefix='rcp', ns_uri='http://www.brics.dk/ixwt/recipes'):
+
+def parse_recipe(recipe: Element, ns: dict):
+    """
+    Builds a Recipe object from its rcp:recipe element.
+    :param recipe: rcp:recipe element from the XML
+    :param ns: XML namespace mapping
+    :return: Recipe object
+    """
+
+    # Qualified names ('{uri}title'), which the C accelerated find/findall match directly,
+    # while 'rcp:title' with a namespace mapping goes through the much slower ElementPath
+    uri, = ns.values()
+    tag = {name: f"{{{uri}}}{name}" for name in RECIPE_TAGS}
+
+    # Extract each field from the recipe
+    title = recipe.find(tag['title']).text
+
+    # Format date
+    rcpdate = parse_date(recipe.find(tag['date']).text)
+
+    ## Ingredient
+    def parse_ingredients(ingredient: Element):
+        """
+        Parses ingredients recursively.
+        Needed since some ingredients have their own nested ingredients and preparation steps
+        :param ingredient: starting ingredient element from the XML
+        :return: Ingredient object, with populated ingredients list
+        """
+
+        # Special handling for the ingredient amount, since it can be *
+        amount = ingredient.attrib.get('amount', '*')
+        if amount == '*':
+            amount = 0
+        else:
+            amount = float(amount)
+
+        preparation_elem = ingredient.find(tag['preparation'])
+        return Ingredient(
+            str(ingredient.attrib.get('name', None)),
+            amount,
+            str(ingredient.attrib.get('unit', None)),
+            list(map(  # Ingredient
+                parse_ingredients,
+                ingredient.findall(tag['ingredient'])
+            )),
+            list(map(  # Preparation steps
+                lambda x: x.text,
+                preparation_elem.findall(tag['step'])
+            )) if preparation_elem is not None else None
+        )
+
+    ingredients = list(map(
+        parse_ingredients,
+        recipe.findall(tag['ingredient'])
+    ))
+
+    preparation = list(map(
+        lambda x: x.text,
+        recipe.find(tag['preparation']).findall(tag['step'])
+    ))
+
+    comment_elem = recipe.find(tag['comment'])
+    comment = comment_elem.text if comment_elem is not None else None
+
+    nutrition_elem = recipe.find(tag['nutrition'])
+    nutrition = NutritionInfo(
+        float(nutrition_elem.attrib.get('calories')),
+        float(nutrition_elem.attrib.get('fat').replace('%', '')),
+        float(nutrition_elem.attrib.get('carbohydrates').replace('%', '')),
+        float(nutrition_elem.attrib.get('protein').replace('%', ''))
+    )
+
+    related_elem = recipe.find(tag['related'])
+    related = (related_elem.attrib['ref'], related_elem.text) if related_elem is not None else None
+
+    return Recipe(
+        title,
+        rcpdate,
+        ingredients,
+        preparation,
+        comment,
+        nutrition,
+        related
+    )
+
+
+def iter_recipes(filename='recipes.xml', ns_prefix='rcp', ns_uri='http://www.brics.dk/ixwt/recipes',
+                 compact=False):
+    """
+    Streams recipes from an XML file, one at a time.
+    Unlike ET.parse, this never holds more than the recipe being read in memory:
+    each rcp:recipe element is cleared (and detached from the root) once its Recipe is built.
+    The (id, Recipe) pairs can be consumed as-is by the query functions below, or turned into a dict.
+    :param filename: path to the XML file
+    :param ns_prefix: XML namespace prefix
+    :param ns_uri: XML namespace URI
+    :param compact: True to yield CompactRecipe objects, for large collections
+    :return: generator of (recipe id, Recipe object) pairs
+    """
+
+    # XML namespace
+    ns = {ns_prefix: ns_uri}
+    recipe_tag = f"{{{ns_uri}}}recipe"
+
+    root = None
+    for event, elem in ET.iterparse(filename, events=('start', 'end')):
+        if root is None:  # First event is the start of the collection
+            root = elem
+        # Nested elements are complete once their recipe ends, so we only act on that
+        if event == 'end' and elem.tag == recipe_tag:
+            recipe = parse_recipe(elem, ns)
+            yield elem.attrib['id'], CompactRecipe.from_recipe(recipe) if compact else recipe
+            elem.clear()
+            root.remove(elem)  # Otherwise the root keeps an (empty) reference for every recipe
+
+
+def init_recipes(filename='recipes.xml', ns_prefix='rcp', ns_uri='http://www.brics.dk/ixwt/recipes',
+                 use_snapshot=True, compact=False, index_text=False):
     """QUESTION 3: Import recipes from an XML file.
-    Returns a dictionary of Recipe objects, indexed by their ID."""
+    Returns a dictionary of Recipe objects, indexed by their ID.
+    Unless use_snapshot is False, the parsed recipes are saved next to the file (see snapshot.py),
+    and loaded from there instead as long as the file doesn't change.
+    With compact, recipes are CompactRecipe objects, which take a lot less memory.
+    With index_text, the full-text index (see search_text) is built too, while the file is parsed."""
 
     try:
-        # XML namespace
-        ns = {ns_prefix: ns_uri}
-        # We have to set the locale here to avoid issues with the date format
-        locale.setlocale(locale.LC_TIME, 'en_US.UTF-8')
-
-        tree = ET.parse(filename)
-        ret = {}  # Our return value
-
-        for recipe in tree.getroot().findall('rcp:recipe', ns):
-            # Extract each field from the recipe
-            title = recipe.find('rcp:title', ns).text
-
-            # Format date
-            rcpdate = dt.strptime(
-                recipe.find('rcp:date', ns).text,
-                "%a, %d %b %y"
-            )
-
-            ## Ingredient
-            def parse_ingredients(ingredient: Element):
-                """
-                Parses ingredients recursively.
-                Needed since some ingredients have their own nested ingredients and preparation steps
-                :param ingredient: starting ingredient element from the XML
-                :return: Ingredient object, with populated ingredients list
-                """
-
-                # Special handling for the ingredient amount, since it can be *
-                amount = ingredient.attrib.get('amount', '*')
-                if amount == '*':
-                    amount = 0
-                else:
-                    amount = float(amount)
-
-                preparation_elem = ingredient.find('rcp:preparation', ns)
-                return Ingredient(
-                    str(ingredient.attrib.get('name', None)),
-                    amount,
-                    str(ingredient.attrib.get('unit', None)),
-                    list(map(  # Ingredient
-                        parse_ingredients,
-                        ingredient.findall('rcp:ingredient', ns)
-                    )),
-                    list(map(  # Preparation steps
-                        lambda x: x.text,
-                        preparation_elem.findall('rcp:step', ns)
-                    )) if preparation_elem is not None else None
-                )
-
-            ingredients = list(map(
-                parse_ingredients,
-                recipe.findall('rcp:ingredient', ns)
-            ))
+        if index_text:
+            from fulltext import TextIndex
+        text_index = TextIndex() if index_text else None
+        recipes = load_snapshot(filename, (ns_uri, compact)) if use_snapshot else None
+        if recipes is None:
+            stream = iter_recipes(filename, ns_prefix, ns_uri, compact)
+            recipes = RecipeCollection(text_index.feed(stream) if index_text else stream)
+            if use_snapshot:
+                save_snapshot(recipes, filename, (ns_uri, compact))
+        if index_text:  # Already built, unless the recipes came from the snapshot
+            recipes.derived[TextIndex] = text_index if text_index.ids else TextIndex(recipes)
+        return recipes
+    except FileNotFoundError:
+        print(f"Error importing recipes: {filename} file not found")
+        return None
 
-            preparation = list(map(
-                lambda x: x.text,
-                recipe.find('rcp:preparation', ns).findall('rcp:step', ns)
-            ))
-
-            comment_elem = recipe.find('rcp:comment', ns)
-            comment = comment_elem.text if comment_elem is not None else None
-
-            nutrition_elem = recipe.find('rcp:nutrition', ns)
-            nutrition = NutritionInfo(
-                float(nutrition_elem.attrib.get('calories')),
-                float(nutrition_elem.attrib.get('fat').replace('%', '')),
-                float(nutrition_elem.attrib.get('carbohydrates').replace('%', '')),
-                float(nutrition_elem.attrib.get('protein').replace('%', ''))
-            )
-
-            related_elem = recipe.find('rcp:related', ns)
-            related = (related_elem.attrib['ref'], related_elem.text) if related_elem is not None else None
-
-            # Build dictionary
-            ret[recipe.attrib['id']] = Recipe(
-                title,
-                rcpdate,
-                ingredients,
-                preparation,
-                comment,
-                nutrition,
-                related
-            )
-
-        return ret
+
+def init_ingredient_tree(filename='recipes.xml', ns_prefix='rcp', ns_uri='http://www.brics.dk/ixwt/recipes'):
+    """
+    Imports only the ingredients of the recipes from an XML file, as flat arrays (see tree.IngredientTree),
+    without building the Recipe and Ingredient objects: for amount, ingredient and step totals over large files.
+    :param filename: path to the XML file
+    :param ns_prefix: XML namespace prefix
+    :param ns_uri: XML namespace URI
+    :return: IngredientTree, or None if the file doesn't exist
+    """
+
+    from tree import IngredientTree
+    try:
+        return IngredientTree.from_xml(filename, ns_prefix, ns_uri)
     except FileNotFoundError:
         print(f"Error importing recipes: {filename} file not found")
         return None
 
 
+def reload_recipes(recipes: RecipeCollection, filename='recipes.xml', ns_prefix='rcp',
+                   ns_uri='http://www.brics.dk/ixwt/recipes', use_snapshot=True, compact=False):
+    """
+    Reads an XML file again into the collection loaded from it, after it was edited.
+    Recipes are compared by id, and only the added, changed and removed ones are applied to the collection
+    and to its derived structures (see RecipeCollection.sync()). Its version is bumped if anything changed.
+    :param recipes: collection returned by init_recipes() for the same file
+    :param filename: path to the XML file
+    :param ns_prefix: XML namespace prefix
+    :param ns_uri: XML namespace URI
+    :param use_snapshot: True to save the new contents as the file's snapshot
+    :param compact: as given to init_recipes()
+    :return: RecipeChanges (empty if nothing changed); raises ParseError if the file is invalid (still being written...)
+    """
+    changes = recipes.sync(dict(iter_recipes(filename, ns_prefix, ns_uri, compact)))
+    if use_snapshot:
+        save_snapshot(recipes, filename, (ns_uri, compact))
+    return changes
+
+
+@memoize
 def get_recipe_titles(recipes: dict):
     """
     QUESTION 4: Get a list of recipe titles from a dictionary of Recipe objects.
@@ -114,9 +209,10 @@ def get_recipe_titles(recipes: dict):
     :return: list of str titles
     """
 
-    return list(map(lambda x: x.title, recipes.values()))
+    return list(map(lambda x: x.title, recipe_values(recipes)))
 
 
+@memoize
 def get_total_ingredient_count(recipes: dict, ing_name: str):
     """
     QUESTION 5: Get the total amount of a specific ingredient in all recipes.
@@ -127,12 +223,10 @@ def get_total_ingredient_count(recipes: dict, ing_name: str):
     :return: total amount of ingredient
     """
 
-    return sum(map(
-        lambda x: x.amount if ing_name in x.name else 0,
-        flatten_ingredients(recipes)
-    ))
+    return sum(map(lambda x: x[1].amount, get_index(recipes, IngredientIndex).get_matches(ing_name)))
 
 
+@memoize
 def get_recipes_with_ingredient(recipes: dict, ing_name: str):
     """
     QUESTION 6: Get a list of recipes that contain a specific ingredient.
@@ -142,15 +236,10 @@ def get_recipes_with_ingredient(recipes: dict, ing_name: str):
     :return: list of Recipe objects
     """
 
-    return list(filter(
-        lambda x: any(map(  # If any ings in recipe contain ing_name
-            lambda y: ing_name in y.name,
-            flatten_ingredients(x.ingredients)
-        )),
-        recipes.values()
-    ))
+    return get_index(recipes, IngredientIndex).get_recipes(ing_name)
 
 
+@memoize
 def get_all_ingredient_counts(recipes: dict, ing_name: str):
     """
     QUESTION 7: Get a dictionary with the count of a specific ingredient in all recipes.
@@ -159,12 +248,43 @@ def get_all_ingredient_counts(recipes: dict, ing_name: str):
     :return: dictionary of ingredient names and their count
     """
 
-    return dict(zip(  # We use zip to make pairs for dict insertion
-        recipes.keys(),
-        map(lambda x: get_ingredient_count(x, ing_name), recipes.values())
-    ))
+    index = get_index(recipes, IngredientIndex)
+    counts = dict.fromkeys(index.positions, 0)  # Recipes without the ingredient count too
+    counts.update(index.get_amounts(ing_name))
+    return counts
+
+
+def get_ingredient_counts_batch(recipes: dict, ing_names):
+    """
+    Get the amounts of many ingredients at once, as QUESTIONS 5 and 7 would for each of them.
+    All names are looked for together (see matching.AhoCorasick), in each distinct ingredient name of the collection.
+    :param recipes: recipes dict
+    :param ing_names: iterable of ingredient name substrings
+    :return: pair of dicts: recipe id -> {ingredient name substring -> amount} (only for the recipes and substrings
+    that match), and ingredient name substring -> total amount
+    """
+
+    patterns = list(dict.fromkeys(ing_names))  # Without duplicates
+    matcher = AhoCorasick(patterns)
+    index = get_index(recipes, IngredientIndex)
+
+    per_recipe = {}
+    totals = dict.fromkeys(patterns, 0)
+    for name, postings in index.postings.items():
+        found = [patterns[i] for i in sorted(matcher.find(name))]
+        if not found:
+            continue
+        for rid, ingredient in postings:
+            counts = per_recipe.setdefault(rid, {})
+            for pattern in found:
+                counts[pattern] = counts.get(pattern, 0) + ingredient.amount
+                totals[pattern] += ingredient.amount
 
+    # Back in collection order
+    return dict(sorted(per_recipe.items(), key=lambda x: index.positions[x[0]])), totals
 
+
+@memoize
 def filter_under_calories(recipes: dict, calories: float):
     """
     QUESTION 8: Get a list of recipes with less than a certain amount of calories.
@@ -173,7 +293,8 @@ def filter_under_calories(recipes: dict, calories: float):
     :return: list of recipes under the calorie threshold
     """
 
-    return filter_recipes(recipes, lambda x: x.nutrition.calories < calories)
+    from tables import NutritionTable
+    return get_index(recipes, NutritionTable).below('calories', calories)
 
 
 def get_amount_str(recipe: Recipe, ing_name):
@@ -182,15 +303,17 @@ def get_amount_str(recipe: Recipe, ing_name):
     Note: We return a string here because the amount doesn't make sense without its unit anyway.
     :param recipe: recipe object
     :param ing_name: ingredient name substring
-    :return: string like "[amount] [unit]" (ex: "5 teaspoon")
+    :return: string like "[amount] [unit]" (ex: "5 teaspoon"), or None if the recipe doesn't use the ingredient
     """
 
     # Get the unit.
     # We're assuming the XML always uses the same one for the same ingredient,
     # so we're just grabbing the first one.
-    unit = next((i.unit for i in flatten_ingredients(recipe.ingredients) if ing_name in i.name))
+    unit = next((i.unit for i in recipe.flat_ingredients if ing_name in i.name), None)
+    if unit is None:
+        return None
 
-    return f"{ing_name} - {get_ingredient_count(recipe, ing_name)}{(" " + unit) if unit else ''}"
+    return f"{ing_name} - {get_ingredient_count(recipe, ing_name)}{(' ' + unit) if unit else ''}"
 
 
 def get_prep_steps(recipe: Recipe, from_step: int = 0, to_step: int = None):
@@ -205,6 +328,7 @@ def get_prep_steps(recipe: Recipe, from_step: int = 0, to_step: int = None):
     return recipe.preparation[from_step:to_step]
 
 
+@memoize
 def filter_above_steps(recipes: dict, steps: int):
     """
     QUESTION 11: Get a list of recipes with more than a certain number of steps.
@@ -213,25 +337,11 @@ def filter_above_steps(recipes: dict, steps: int):
     :return: recipes above threshold
     """
 
-    def exceeds_step_count(recipe, steps):
-        """
-        Checks if a recipe is above the threshold
-        :param recipe: recipe object
-        :param steps: step number threshold
-        :return: True if above threshold, else False
-        """
-        step_count = len(recipe.preparation)
-        if step_count > steps:
-            return True  # don't need to count the rest
-
-        ingredients = flatten_ingredients(recipe.ingredients)
-        ingredient_steps = sum(len(i.preparation) if i.preparation is not None else 0
-                               for i in ingredients)
-        return step_count + ingredient_steps > steps
-
-    return filter_recipes(recipes, lambda recipe: exceeds_step_count(recipe, steps))
+    from tables import MetricsTable
+    return get_index(recipes, MetricsTable).above('steps', steps)
 
 
+@memoize
 def filter_by_no_ingredient(recipes: dict, ingredient: str):
     """
     QUESTION 12: Get a list of recipes that do not contain a specific ingredient.
@@ -240,30 +350,31 @@ def filter_by_no_ingredient(recipes: dict, ingredient: str):
     :return: list recipes without the ingredient
     """
 
-    return filter_recipes(recipes, lambda x: not any(map(
-        lambda y: ingredient in y.name,
-        flatten_ingredients(x.ingredients)
-    )))
+    index = get_index(recipes, IngredientIndex)
+    with_ingredient = set(index.get_positions(ingredient))
+    return [recipe for pos, recipe in enumerate(index.recipes) if pos not in with_ingredient]
 
 
-def get_similar_recipes(recipes: dict, recipe1: Recipe):
+@memoize
+def get_similar_recipes(recipes: dict, recipe1: Recipe, k: int = None):
     """
     QUESTION 13: Get a list of recipes that share ingredients with a given recipe.
+    Ingredients are compared by their normalized words (see similarity.get_ingredient_tokens),
+    and recipes are ranked by Jaccard similarity to recipe1, most similar first.
     :param recipes: recipes dict
     :param recipe1: model recipe
+    :param k: maximum number of recipes, or None for all of them
     :return: list of recipes sharing an ingredient with recipe1
     """
 
-    return filter_recipes(recipes, lambda x: any(map(
-        lambda y: any(map(
-            lambda z: z.name in y.name,
-            # lambda z: dbg(x,y,z),
-            flatten_ingredients(recipe1.ingredients)
-        )),
-        flatten_ingredients(x.ingredients)
-    )))
+    from similarity import SimilarityIndex
+    return list(map(
+        lambda x: x[0],
+        get_index(recipes, SimilarityIndex).top_k(recipe1, k, exclude_self=False)
+    ))
 
 
+@memoize
 def max_calories(recipes: dict):
     """
     QUESTION 14: Get the recipe with the highest calorie count.
@@ -271,23 +382,25 @@ def max_calories(recipes: dict):
     :return: recipe with the highest calorie count
     """
 
-    return max(recipes.values(), key=lambda x: x.nutrition.calories)
+    from tables import NutritionTable
+    return get_index(recipes, NutritionTable).argmax('calories')
 
 
-def get_most_common_unit(recipes: dict):
+@memoize
+def get_most_common_unit(recipes: dict, approximate: bool = False):
     """
     QUESTION 15: Get the most common unit used in all recipes (or rather ingredients).
+    Counted while streaming the ingredients, so recipes can be a stream too (e.g. iter_recipes()).
     :param recipes: recipes dict
+    :param approximate: True to count with Space-Saving, in constant memory (see streaming.py)
     :return: name of most common unit
     """
 
-    # We use Counter to count distinct units.
-    c = Counter(map(lambda x: x.unit, flatten_ingredients(recipes)))
-    c.pop('None')  # Remove the null value from the count, since we want actual units
-    # The flaw of this approach is that you can't *not* count a value if you don't want to.
-    return c.most_common(1)[0][0]
+    # Ingredients without a unit ('None') are left out of the stream, rather than popped from the counts after
+    return stream_top_k(iter_units(recipes), 1, 'space_saving' if approximate else 'exact')[0][0]
 
 
+@memoize
 def get_diff_ingredient_count(recipes):
     """
     QUESTION 16: Get a list with the number of distinct ingredients in each recipe.
@@ -296,12 +409,11 @@ def get_diff_ingredient_count(recipes):
     :return: list with number of distinct ingredients in each recipe
     """
 
-    return list(map(
-        lambda x: len(flatten_ingredients(x)),
-        recipes.values()
-    ))
+    from tables import MetricsTable
+    return get_index(recipes, MetricsTable).columns['ingredient_count'].astype(int).tolist()
 
 
+@memoize
 def max_fat(recipes: dict):
     """
     QUESTION 17: Get the recipe with the highest fat content.
@@ -309,20 +421,27 @@ def max_fat(recipes: dict):
     :return: recipe with the highest fat content
     """
 
-    return max(recipes.values(), key=lambda x: x.nutrition.fat)
+    from tables import NutritionTable
+    return get_index(recipes, NutritionTable).argmax('fat')
 
 
-def get_most_common_ingredient(recipes: dict):
+@memoize
+def get_most_common_ingredient(recipes: dict, approximate: bool = False):
     """
     QUESTION 18: Get the most common ingredient used in all recipes.
+    A collection uses its UsageMap, built once and shared with QUESTION 20;
+    anything else (plain dict, recipe stream) is counted while streaming it, without keeping the recipes.
     :param recipes: recipes dict
+    :param approximate: True to count with Space-Saving, in constant memory (see streaming.py)
     :return: name of most common ingredient in all recipes
     """
 
-    c = Counter(map(lambda x: x.name, flatten_ingredients(recipes)))
-    return c.most_common(1)[0][0]
+    if isinstance(recipes, RecipeCollection) and not approximate:
+        return get_index(recipes, UsageMap).most_common(1)[0][0]
+    return stream_top_k(iter_ingredient_names(recipes), 1, 'space_saving' if approximate else 'exact')[0][0]
 
 
+@memoize
 def sort_by_ingredient_count(recipes: dict):
     """
     QUESTION 19: Sort recipes by the total amount of ingredients they contain.
@@ -330,27 +449,23 @@ def sort_by_ingredient_count(recipes: dict):
     :return: sorted recipes
     """
 
-    return sorted(recipes.values(),
-                  key=lambda x: sum(map(lambda y: y.amount, flatten_ingredients(x.ingredients))),
-                  reverse=True)  # desc
+    from tables import MetricsTable
+    return get_index(recipes, MetricsTable).sort('total_amount', reverse=True)  # desc
 
 
+@memoize
 def get_ingredient_usages(recipes: dict):
     """
     QUESTION 20: Get a dictionary of ingredients and the recipes they are used in.
     :param recipes: recipes dict
-    :return: dict of Ingredient and their usages
+    :return: dict of ingredient names and the recipes using them
     """
 
-    usages = defaultdict(lambda x: get_recipes_with_ingredient(recipes, x))
-
-    ings = get_unique_ingredients(recipes)
-
-    for ing in ings:
-        usages[ing] = get_recipes_with_ingredient(recipes, ing)
-    return usages
+    usage_map = get_index(recipes, UsageMap)
+    return {name: usage_map.get_recipes(name) for name in usage_map.usages}
 
 
+@memoize
 def get_recipe_repartition(recipes: dict):
     """
     QUESTION 21: Get a dictionary of the number of recipes with a specific number of steps.
@@ -359,9 +474,11 @@ def get_recipe_repartition(recipes: dict):
     :return: dict of int values
     """
 
-    return Counter(map(lambda x: get_step_count(x), recipes.values()))
+    from tables import MetricsTable
+    return Counter({int(k): v for k, v in get_index(recipes, MetricsTable).histogram('steps').items()})
 
 
+@memoize
 def get_easiest_recipe(recipes: dict):
     """
     QUESTION 22: Get the easiest recipe with the fewest steps.
@@ -369,12 +486,54 @@ def get_easiest_recipe(recipes: dict):
     :return: recipe with the fewest steps
     """
 
-    return min(recipes.values(), key=lambda x: get_step_count(x))
+    from tables import MetricsTable
+    return get_index(recipes, MetricsTable).argmin('steps')
+
+
+def get_related_recipes(recipes: dict, rid: str, depth: int = 1, direction: str = 'both'):
+    """
+    Get the recipes related to a recipe (rcp:related, either way), then theirs up to a depth, closest first.
+    :param recipes: recipes dict
+    :param rid: recipe id
+    :param depth: maximum number of references to follow, None for all the recipes linked to it
+    :param direction: 'forward' (the recipes it references), 'reverse' (those referencing it) or 'both'
+    :return: list of Recipe objects
+    """
+
+    graph = get_index(recipes, RelatedGraph)
+    return list(map(lambda x: graph.recipes[x], graph.traverse(rid, depth, direction)))
+
+
+def get_menus(recipes: dict, min_size: int = 2):
+    """
+    Get the groups of recipes linked together by their related references, to suggest as menus.
+    :param recipes: recipes dict
+    :param min_size: minimum number of recipes in a menu
+    :return: list of lists of Recipe objects, largest menus first
+    """
+
+    graph = get_index(recipes, RelatedGraph)
+    return [list(map(lambda x: graph.recipes[x], menu)) for menu in graph.get_menus(min_size)]
+
+
+def get_dangling_references(recipes: dict):
+    """
+    Get the related references to recipes that aren't in the collection.
+    :param recipes: recipes dict
+    :return: list of (recipe id, missing recipe id) pairs
+    """
+
+    return list(get_index(recipes, RelatedGraph).dangling)
 
 
 # Unit testing
 if __name__ == '__main__':
     recipes = ut_print(init_recipes)
+    from similarity import SimilarityIndex
+    from tables import NutritionTable
+
+    # Streamed recipes can be queried without building the dict first
+    ut_print(get_recipe_titles, iter_recipes())
 
     ut_print(get_recipe_titles, recipes)
     # ut(get_ingredient_count, recipes, 'egg')
@@ -382,19 +541,38 @@ if __name__ == '__main__':
     ut_print(get_recipes_with_ingredient, recipes, 'olive oil')
     # ut(get_ingredient_count, get_recipes_with_ingredient(recipes, 'egg')[0], 'egg')
     ut_print(get_all_ingredient_counts, recipes, 'egg')
+    ut_print(get_ingredient_counts_batch, recipes, ['egg', 'sugar', 'butter'])
     ut_print(filter_under_calories, recipes, 500)
     ut_print(get_recipe, recipes, "Zuppa Inglese")
+    ut_print(search_titles, recipes, "linguine pescadorro")
+    ut_print(search_text, recipes, "bake 350 degrees")
+    ut_print(search_text, recipes, '"preheat the oven"')
     ut_print(get_amount_str, get_recipe(recipes, "Zuppa Inglese"), "sugar")
     ut_print(get_prep_steps, get_recipe(recipes, "Zuppa Inglese"), 0, 2)
     ut_print(filter_above_steps, recipes, 5)
     ut_print(filter_by_no_ingredient, recipes, "butter")
+    ut_print(RecipeQuery(recipes).under_calories(1000).above_steps(5).without_ingredient('butter').to_list)
     ut_print(get_similar_recipes, recipes, get_recipe(recipes, "Zuppa Inglese"))
+    ut_print(get_index(recipes, SimilarityIndex).top_k, get_recipe(recipes, "Zuppa Inglese"), 3, 'overlap')
     ut_print(max_calories, recipes)
     ut_print(get_most_common_unit, recipes)
     ut_print(max_fat, recipes)
+    ut_print(get_index(recipes, NutritionTable).top_k, 'protein', 3)
     ut_print(get_most_common_ingredient, recipes)
     ut_print(sort_by_ingredient_count, recipes)
     ut_print(get_recipes_with_ingredient, recipes, 'beef')
+    ut_print(get_ingredient_usages, recipes)
+    ut_print(stream_top_k, iter_units(iter_recipes()), 3)
+    ut_print(stream_top_k, iter_ingredient_names(iter_recipes()), 3, 'space_saving', 100)
     ut_print(get_recipe_repartition, recipes)
     ut_print(get_easiest_recipe, recipes)
     ut_print(get_diff_ingredient_count, recipes)
+    ut_print(init_ingredient_tree().get_step_counts)
+    ut_print(get_related_recipes, recipes, 'r103')
+    ut_print(get_menus, recipes)
+    ut_print(get_dangling_references, recipes)
+
+    # Same calls again, answered by the cache (see memo.py)
+    ut_print(get_recipes_with_ingredient, recipes, 'olive oil')
+    ut_print(filter_under_calories, recipes, 500)
+    ut_print(lambda: {k: v for k, v in query_cache.get_stats().items() if k != 'functions'})
@@ -0,0 +1,318 @@
+"""File: server.py
+Local HTTP/JSON server for the query functions (QUESTIONS 4 to 22), built on asyncio.
+The collection is loaded once; each function is an endpoint named after it, e.g.
+    GET /filter_under_calories?calories=500
+    GET /get_amount_str?title=Zuppa%20Inglese&ingredient=sugar
+Recipes in results are written as {"id", "title"} references; GET /recipe?id=r101 gives a whole recipe.
+Usage: python3 server.py [--file recipes.xml] [--port 8080]"""
+
+import argparse
+import asyncio
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import fields, is_dataclass
+from datetime import date
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import repositories as rps
+from helper import *
+
+# Query parameters, and how their values are converted
+PARAMS = {
+    'ingredient': str,
+    'title': str,
+    'id': str,
+    'calories': float,
+    'steps': int,
+    'from': int,
+    'to': int,
+    'k': int,
+}
+
+MAX_HEADER_LINES = 100
+
+
+class HTTPError(Exception):
+    """Error answered to the client, with its HTTP status."""
+
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def get_model(recipes: dict, params: dict):
+    """
+    Get the recipe an endpoint is about, from its id or title parameter.
+    :param recipes: recipes dict
+    :param params: converted query parameters
+    :return: Recipe object
+    """
+    recipe = recipes.get(params['id']) if 'id' in params else get_recipe(recipes, params['title'])
+    if recipe is None:
+        raise HTTPError(HTTPStatus.NOT_FOUND, "no such recipe")
+    return recipe
+
+
+def get_amount(recipes: dict, params: dict):
+    """
+    Get the amount of an ingredient in a recipe (QUESTION 9).
+    :param recipes: recipes dict
+    :param params: converted query parameters
+    :return: str amount and unit
+    """
+    amount = rps.get_amount_str(get_model(recipes, params), params['ingredient'])
+    if amount is None:
+        raise HTTPError(HTTPStatus.NOT_FOUND, f"no ingredient {params['ingredient']!r} in the recipe")
+    return amount
+
+
+# Endpoint name -> (required parameters, callable taking the recipes and the converted parameters)
+ENDPOINTS = {
+    'get_recipe_titles': ((), lambda rcp, p: rps.get_recipe_titles(rcp)),
+    'get_total_ingredient_count': (('ingredient',), lambda rcp, p: rps.get_total_ingredient_count(rcp, p['ingredient'])),
+    'get_recipes_with_ingredient': (('ingredient',), lambda rcp, p: rps.get_recipes_with_ingredient(rcp, p['ingredient'])),
+    'get_all_ingredient_counts': (('ingredient',), lambda rcp, p: rps.get_all_ingredient_counts(rcp, p['ingredient'])),
+    'filter_under_calories': (('calories',), lambda rcp, p: rps.filter_under_calories(rcp, p['calories'])),
+    'get_amount_str': (('title', 'ingredient'), get_amount),
+    'get_prep_steps': (('title',), lambda rcp, p: rps.get_prep_steps(get_model(rcp, p), p.get('from', 0), p.get('to'))),
+    'filter_above_steps': (('steps',), lambda rcp, p: rps.filter_above_steps(rcp, p['steps'])),
+    'filter_by_no_ingredient': (('ingredient',), lambda rcp, p: rps.filter_by_no_ingredient(rcp, p['ingredient'])),
+    'get_similar_recipes': (('title',), lambda rcp, p: rps.get_similar_recipes(rcp, get_model(rcp, p), p.get('k'))),
+    'max_calories': ((), lambda rcp, p: rps.max_calories(rcp)),
+    'get_most_common_unit': ((), lambda rcp, p: rps.get_most_common_unit(rcp)),
+    'get_diff_ingredient_count': ((), lambda rcp, p: rps.get_diff_ingredient_count(rcp)),
+    'max_fat': ((), lambda rcp, p: rps.max_fat(rcp)),
+    'get_most_common_ingredient': ((), lambda rcp, p: rps.get_most_common_ingredient(rcp)),
+    'sort_by_ingredient_count': ((), lambda rcp, p: rps.sort_by_ingredient_count(rcp)),
+    'get_ingredient_usages': ((), lambda rcp, p: rps.get_ingredient_usages(rcp)),
+    'get_recipe_repartition': ((), lambda rcp, p: rps.get_recipe_repartition(rcp)),
+    'get_easiest_recipe': ((), lambda rcp, p: rps.get_easiest_recipe(rcp)),
+}
+
+
+def get_recipe_ids(recipes: dict):
+    """
+    Get the id of every recipe object, to write recipes in results as references.
+    :param recipes: recipes dict
+    :return: dict of id(recipe) -> recipe id
+    """
+    return {id(recipe): rid for rid, recipe in recipe_items(recipes)}
+
+
+def encode(value, ids: dict = None):
+    """
+    Serializes a result as a JSON response body: {"result": value}.
+    Data objects become objects of their fields, dates ISO strings, sets lists.
+    :param value: result of a query function
+    :param ids: dict from get_recipe_ids, to write the recipes it contains as {"id", "title"} references,
+    or None to write them whole
+    :return: bytes UTF-8 JSON
+    """
+    def default(obj):
+        if ids is not None and isinstance(obj, (Recipe, CompactRecipe)) and id(obj) in ids:
+            return {'id': ids[id(obj)], 'title': obj.title}
+        if is_dataclass(obj):
+            return {f.name: getattr(obj, f.name) for f in fields(obj) if f.compare}  # Not caches
+        if isinstance(obj, date):
+            return obj.isoformat()
+        if isinstance(obj, (set, frozenset)):
+            return list(obj)
+        if hasattr(obj, 'tolist'):  # NumPy values
+            return obj.tolist()
+        raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+    return json.dumps({'result': value}, default=default, ensure_ascii=False).encode()
+
+
+class QueryServer:
+    """
+    Serves the query functions over HTTP/1.1 (with keep-alive), on one asyncio event loop.
+    Queries run on a thread pool, so the loop keeps accepting clients and answering cached requests meanwhile;
+    pure Python queries don't run in parallel with the GIL, but a slow one no longer holds up every client.
+    Concurrent first requests share the indexes they need: RecipeCollection.get_derived() builds each one once.
+    Responses are cached for the current version of the collection (see RecipeCollection),
+    and concurrent identical requests share a single computation.
+    """
+
+    def __init__(self, recipes: dict, workers: int = None, cache_size: int = 1024):
+        """
+        :param recipes: recipes dict, loaded once
+        :param workers: threads running the queries (default: ThreadPoolExecutor's)
+        :param cache_size: maximum number of cached responses
+        """
+        self.recipes = recipes
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='query')
+        self.cache = OrderedDict()  # (version, endpoint, params) -> response body, least recently used first
+        self.cache_size = cache_size
+        self.pending = {}  # Same keys -> future of the response body, while it's computed
+        self.stats = {'requests': 0, 'hits': 0, 'misses': 0, 'errors': 0}
+
+    def get_version(self):
+        """Get the version of the recipes (0 for a plain dict), so responses to older contents aren't reused."""
+        return getattr(self.recipes, 'version', 0)
+
+    def compute(self, name: str, params: dict):
+        """
+        Runs an endpoint (on the executor).
+        :param name: endpoint name
+        :param params: converted query parameters
+        :return: bytes response body
+        """
+        try:
+            if name == 'recipe':
+                return encode(get_model(self.recipes, params))
+            value = ENDPOINTS[name][1](self.recipes, params)
+        except StopIteration as e:  # A future can't be given a StopIteration: it would never be done
+            raise RuntimeError(f"StopIteration in {name}") from e
+        return encode(value, get_index(self.recipes, get_recipe_ids))
+
+    async def query(self, name: str, params: dict):
+        """
+        Get the response body of an endpoint, from the cache or computed on the executor.
+        :param name: endpoint name
+        :param params: converted query parameters
+        :return: bytes response body
+        """
+        key = (self.get_version(), name, tuple(sorted(params.items())))
+        if key in self.cache:
+            self.stats['hits'] += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        if key in self.pending:  # Already being computed for another client
+            self.stats['hits'] += 1
+            return await asyncio.shield(self.pending[key])
+
+        self.stats['misses'] += 1
+        future = asyncio.get_running_loop().run_in_executor(self.executor, self.compute, name, params)
+        self.pending[key] = future
+        try:
+            body = await asyncio.shield(future)  # A client leaving doesn't cancel it for the others
+        finally:
+            del self.pending[key]
+        self.cache[key] = body
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return body
+
+    async def respond(self, target: str):
+        """
+        Answers a GET request.
+        :param target: request target, path and query string
+        :return: bytes response body
+        """
+        url = urlsplit(target)
+        name = url.path.strip('/')
+        if name == '':  # Lists the endpoints
+            return encode({name: list(required) for name, (required, _) in ENDPOINTS.items()}
+                          | {'recipe': ['id|title']})
+        if name == 'stats':
+            return encode(self.stats | {'cached': len(self.cache), 'version': self.get_version()})
+        if name not in ENDPOINTS and name != 'recipe':
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"no endpoint {name!r}")
+
+        params = {}
+        for param, values in parse_qs(url.query).items():
+            if param not in PARAMS:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"unknown parameter {param!r}")
+            try:
+                params[param] = PARAMS[param](values[-1])
+            except ValueError:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"invalid value for {param!r}: {values[-1]!r}")
+        required = ENDPOINTS[name][0] if name in ENDPOINTS else ()
+        missing = [param for param in required if param not in params and not (param == 'title' and 'id' in params)]
+        if name == 'recipe' and 'id' not in params and 'title' not in params:
+            missing = ['id']
+        if missing:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"missing parameter(s): {', '.join(missing)}")
+        return await self.query(name, params)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serves one connection, request after request until the client closes it.
+        :param reader: connection input
+        :param writer: connection output
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self.send(writer, HTTPStatus.BAD_REQUEST, b'{"error": "malformed request"}', False)
+                    break
+                headers = {}
+                for _ in range(MAX_HEADER_LINES):
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    header, _, value = line.decode('latin-1').partition(':')
+                    headers[header.strip().lower()] = value.strip()
+                if int(headers.get('content-length', 0)):  # Not used, but must be read to get to the next request
+                    await reader.readexactly(int(headers['content-length']))
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+
+                self.stats['requests'] += 1
+                status = HTTPStatus.OK
+                try:
+                    if method != 'GET':
+                        raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, "only GET is supported")
+                    body = await self.respond(target)
+                except HTTPError as e:
+                    status, body = e.status, json.dumps({'error': str(e)}).encode()
+                except Exception as e:
+                    status, body = HTTPStatus.INTERNAL_SERVER_ERROR, json.dumps({'error': repr(e)}).encode()
+                if status != HTTPStatus.OK:
+                    self.stats['errors'] += 1
+                await self.send(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # Client went away, or sent lines over the StreamReader limit
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def send(writer: asyncio.StreamWriter, status: HTTPStatus, body: bytes, keep_alive: bool):
+        """Writes a JSON response."""
+        writer.write((f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                      f"Content-Type: application/json; charset=utf-8\r\n"
+                      f"Content-Length: {len(body)}\r\n"
+                      f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8080):
+        """
+        Accepts clients until cancelled.
+        :param host: address to listen on
+        :param port: port to listen on (0 for any free one)
+        """
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        print(f"Serving on http://{host}:{server.sockets[0].getsockname()[1]}/")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serves the query functions as HTTP/JSON endpoints.")
+    parser.add_argument('--file', default='recipes.xml', help="recipes XML file")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on")
+    parser.add_argument('--port', type=int, default=8080, help="port to listen on")
+    parser.add_argument('--workers', type=int, default=None, help="threads running the queries")
+    parser.add_argument('--cache-size', type=int, default=1024, help="maximum number of cached responses")
+    args = parser.parse_args()
+
+    recipes = rps.init_recipes(args.file)
+    if recipes is None:
+        raise SystemExit(1)
+    try:
+        asyncio.run(QueryServer(recipes, args.workers, args.cache_size).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
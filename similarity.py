@@ -0,0 +1,169 @@
+"""File: similarity.py
+Holds the similarity engine used to rank recipes by the ingredients they share."""
+
+import heapq
+import re
+import zlib
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from indexes import *
+
+# Words describing how an ingredient is prepared or packaged rather than what it is (in normalized form)
+STOPWORDS = frozenset((
+    'and', 'with', 'of', 'in', 'into', 'for', 'the', 'or', 'to',
+    'cut', 'sliced', 'thin', 'ring', 'lightly', 'beaten', 'peeled', 'drained', 'lengthwise',
+    'minced', 'chopped', 'crushed', 'dried', 'grated', 'shredded', 'fresh', 'chilled', 'sauteed',
+    'small', 'large', 'whole', 'baby', 'bunch', 'package', 'can', 'jar', 'clove',
+))
+
+
+def normalize_token(word: str):
+    """
+    Get the normalized form of a word from an ingredient name: lowercase, naive singular.
+    :param word: single word
+    :return: normalized word
+    """
+    word = word.lower()
+    if word.endswith('ies') and len(word) > 4:
+        return word[:-3] + 'y'
+    if word.endswith('oes') and len(word) > 4:
+        return word[:-2]
+    if word.endswith('s') and not word.endswith(('ss', 'us')) and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def get_ingredient_tokens(recipe: Recipe):
+    """
+    Get the normalized set of tokens describing the ingredients of a recipe.
+    Only the part of the name before a comma is kept ("eggs, lightly beaten" is just eggs),
+    and composite ingredients ("filling", "sauce"...) are skipped, since their components are already there.
+    :param recipe: Recipe object
+    :return: frozenset of str tokens
+    """
+    return frozenset(
+        token
+        for ingredient in recipe.flat_ingredients if not ingredient.ingredients
+        for token in map(normalize_token, re.findall(r"[a-zA-Z]+", ingredient.name.split(',')[0]))
+        if len(token) > 2 and token not in STOPWORDS
+    )
+
+
+class SimilarityIndex:
+    """
+    Ranks recipes by how many ingredient tokens they share with a model recipe.
+    Exact mode walks the inverted index (token -> recipes), so it only ever touches recipes sharing a token.
+    Approximate mode uses MinHash signatures split in LSH bands: only recipes landing in the same bucket
+    as the model in at least one band are scored, which stays fast however big the collection is.
+    """
+    NUM_PERM = 64  # MinHash signature length
+    BANDS = 16  # LSH bands, of NUM_PERM // BANDS rows each
+    PRIME = (1 << 31) - 1
+
+    def __init__(self, recipes):
+        """
+        Computes each recipe's token set and the inverted index in a single pass.
+        The MinHash/LSH structures are only built on the first approximate query.
+        :param recipes: recipes dict, or iterator of (id, Recipe) pairs
+        """
+        self.ids = []
+        self.recipes = []
+        self.tokens = []  # Token set of each recipe, aligned with self.recipes
+        self.postings = defaultdict(list)  # token -> positions of the recipes using it
+        for rid, recipe in recipe_items(recipes):
+            tokens = get_ingredient_tokens(recipe)
+            for token in tokens:
+                self.postings[token].append(len(self.recipes))
+            self.ids.append(rid)
+            self.recipes.append(recipe)
+            self.tokens.append(tokens)
+
+        self.buckets = None  # (band, band signature) -> positions, once built
+        rng = np.random.default_rng(0)  # Fixed seed: signatures must be the same from one run to the other
+        self.perm_a = rng.integers(1, self.PRIME, self.NUM_PERM, dtype=np.int64)
+        self.perm_b = rng.integers(0, self.PRIME, self.NUM_PERM, dtype=np.int64)
+
+    @staticmethod
+    def get_score(inter: int, size1: int, size2: int, metric: str):
+        """
+        Get the similarity score of two token sets from their sizes and the size of their intersection.
+        :param inter: number of shared tokens
+        :param size1: number of tokens of the first set
+        :param size2: number of tokens of the second set
+        :param metric: 'jaccard' (shared / union) or 'overlap' (shared / smallest set)
+        :return: float score between 0 and 1
+        """
+        if metric == 'jaccard':
+            return inter / (size1 + size2 - inter)
+        if metric == 'overlap':
+            return inter / min(size1, size2)
+        raise ValueError(f"Unknown similarity metric: {metric}")
+
+    def get_signature(self, tokens):
+        """
+        Get the MinHash signature of a token set.
+        Tokens are hashed with crc32 rather than hash(), which changes from one process to the other.
+        :param tokens: set of str tokens
+        :return: int64 array of NUM_PERM minimums (all PRIME for an empty set)
+        """
+        if not tokens:
+            return np.full(self.NUM_PERM, self.PRIME, dtype=np.int64)
+        hashes = np.fromiter((zlib.crc32(t.encode()) % self.PRIME for t in tokens), dtype=np.int64, count=len(tokens))
+        # Both factors are under 2^31, so this can't overflow int64
+        return ((self.perm_a[:, None] * hashes[None, :] + self.perm_b[:, None]) % self.PRIME).min(axis=1)
+
+    def get_band_keys(self, signature):
+        """
+        Get the LSH bucket keys of a signature, one per band.
+        :param signature: MinHash signature
+        :return: generator of (band, bytes) keys
+        """
+        rows = self.NUM_PERM // self.BANDS
+        return ((band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.BANDS))
+
+    def build_buckets(self):
+        """Builds the LSH buckets of every recipe with tokens."""
+        self.buckets = defaultdict(list)
+        for pos, tokens in enumerate(self.tokens):
+            if tokens:
+                for key in self.get_band_keys(self.get_signature(tokens)):
+                    self.buckets[key].append(pos)
+
+    def get_candidates(self, tokens, approximate: bool):
+        """
+        Get the recipes sharing tokens with a token set, along with how many they share.
+        :param tokens: model token set
+        :param approximate: True to only consider the recipes sharing an LSH bucket with the model
+        :return: Counter of position -> number of shared tokens
+        """
+        if not approximate:
+            return Counter(pos for token in tokens for pos in self.postings.get(token, ()))
+
+        if self.buckets is None:
+            self.build_buckets()
+        candidates = {pos for key in self.get_band_keys(self.get_signature(tokens))
+                      for pos in self.buckets.get(key, ())}
+        return Counter({pos: len(tokens & self.tokens[pos]) for pos in candidates})
+
+    def top_k(self, recipe: Recipe, k: int = None, metric: str = 'jaccard',
+              approximate: bool = False, exclude_self: bool = True):
+        """
+        Get the recipes most similar to a model recipe, best first.
+        The model doesn't have to be part of the collection.
+        :param recipe: model Recipe object
+        :param k: maximum number of results, or None for every recipe sharing an ingredient
+        :param metric: 'jaccard' or 'overlap', see get_score()
+        :param approximate: True to use MinHash/LSH instead of the exact inverted index
+        :param exclude_self: True to leave the model itself out of the results
+        :return: list of (Recipe, score) pairs, sorted by decreasing score then collection order
+        """
+        tokens = get_ingredient_tokens(recipe)
+        scores = ((pos, self.get_score(inter, len(tokens), len(self.tokens[pos]), metric))
+                  for pos, inter in self.get_candidates(tokens, approximate).items()
+                  if inter and not (exclude_self and self.recipes[pos] is recipe))
+        order = lambda x: (-x[1], x[0])
+        # Only the k best have to be sorted
+        scored = sorted(scores, key=order) if k is None else heapq.nsmallest(k, scores, key=order)
+        return [(self.recipes[pos], score) for pos, score in scored]
@@ -0,0 +1,85 @@
+"""File: snapshot.py
+Binary snapshots of a parsed recipes collection, so it doesn't have to be parsed again from XML on every launch."""
+
+import hashlib
+import os
+import pickle
+
+from models import *
+
+SNAPSHOT_FORMAT = 2  # To bump whenever the models change, so older snapshots are rebuilt
+SNAPSHOT_MAGIC = b'RCPSNAP'
+
+
+def get_snapshot_path(filename: str):
+    """
+    Get where the snapshot of an XML file is stored: right next to it.
+    :param filename: path to the XML file
+    :return: path to the snapshot file
+    """
+    return filename + '.snapshot'
+
+
+def get_source_key(filename: str, stat: os.stat_result = None):
+    """
+    Get the key identifying the current contents of a file: size, modification time and SHA-256 hash.
+    :param filename: path to the XML file
+    :param stat: result of os.stat(filename), if already known
+    :return: (size, mtime in ns, hex digest) tuple
+    """
+    stat = stat or os.stat(filename)
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return stat.st_size, stat.st_mtime_ns, digest.hexdigest()
+
+
+def save_snapshot(recipes: dict, filename: str, params=()):
+    """
+    Saves a parsed collection as a snapshot of its XML file.
+    The header (key of the source file) is pickled on its own before the recipes,
+    so a stale snapshot can be told apart without loading all of it.
+    Writes to a temporary file first, so a crash can't leave a half-written snapshot behind.
+    :param recipes: recipes dict parsed from filename
+    :param filename: path to the XML file
+    :param params: anything else the parsing depended on (namespace...), must match on load
+    :return: True if the snapshot was written, False if it couldn't be (read-only directory...)
+    """
+    path = get_snapshot_path(filename)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            pickle.dump((SNAPSHOT_FORMAT, get_source_key(filename), tuple(params)), f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(dict(recipes), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        return True
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+
+def load_snapshot(filename: str, params=()):
+    """
+    Loads the snapshot of an XML file, if it is still valid.
+    Size and mtime are checked first, so the source only gets hashed when they match.
+    Note: snapshots are pickles, only load the ones this program wrote.
+    :param filename: path to the XML file
+    :param params: what the parsing depended on, as given to save_snapshot()
+    :return: RecipeCollection, or None if there's no snapshot or it's stale
+    """
+    stat = os.stat(filename)  # Raises FileNotFoundError for a missing source, like parsing would
+    try:
+        with open(get_snapshot_path(filename), 'rb') as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                return None
+            snapshot_format, key, snapshot_params = pickle.load(f)
+            if (snapshot_format != SNAPSHOT_FORMAT or snapshot_params != tuple(params)
+                    or key[:2] != (stat.st_size, stat.st_mtime_ns)
+                    or key != get_source_key(filename, stat)):
+                return None
+            return RecipeCollection(pickle.load(f))
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, TypeError, ValueError):
+        return None  # Missing, truncated or written by incompatible code: as good as stale
@@ -0,0 +1,410 @@
+"""File: sqlstore.py
+SQLite storage backend: the collection is kept in normalized tables on disk, and QUESTIONS 4 to 22 are answered
+with indexed SQL instead of Python scans. Collections larger than memory can be queried this way,
+and several processes can share one database.
+Each query function takes the store where the ones in repositories.py take the recipes dict,
+and returns the same thing (Recipe objects are rebuilt from the tables).
+Usage: store = init_store('recipes.xml'); filter_under_calories(store, 500)"""
+
+import json
+import os
+import sqlite3
+import threading
+import weakref
+from collections import Counter
+from datetime import datetime
+
+import repositories as rps
+from helper import *
+from snapshot import get_source_key
+
+STORE_FORMAT = 2  # To bump whenever the schema changes, so older databases are rebuilt
+BATCH_SIZE = 1000  # Recipes inserted per executemany() while loading
+CHUNK_SIZE = 500  # Recipes rebuilt per query, to stay under SQLite's limit of parameters
+# Ids of the distinct ingredient names containing a substring (case-sensitive, as 'in'), as a subquery:
+# a short substring can match more names than a query can take parameters.
+# Only the distinct names are scanned; the ingredients are then found through their index.
+NAME_IDS = "SELECT id FROM names WHERE instr(name, ?) > 0"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+-- pos is the position in the collection (document order), which every result is sorted by.
+-- steps, total_amount, ingredient_count and token_count are aggregates computed at load time (see MetricsTable).
+CREATE TABLE IF NOT EXISTS recipes (
+    pos INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, title TEXT NOT NULL, date TEXT NOT NULL, comment TEXT,
+    steps INTEGER NOT NULL, total_amount NOT NULL, ingredient_count INTEGER NOT NULL, token_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS nutrition (
+    recipe INTEGER PRIMARY KEY REFERENCES recipes, calories REAL, fat REAL, carbohydrates REAL, protein REAL
+);
+-- Distinct ingredient names, numbered by first appearance
+CREATE TABLE IF NOT EXISTS names (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+-- The ingredient tree, numbered in preorder (so flat_ingredients order) through the whole collection.
+-- amount has no type, so 0 (for '*') stays an integer and the sums are the same as in Python.
+CREATE TABLE IF NOT EXISTS ingredients (
+    id INTEGER PRIMARY KEY, recipe INTEGER NOT NULL REFERENCES recipes, parent INTEGER REFERENCES ingredients,
+    name INTEGER NOT NULL REFERENCES names, amount, unit TEXT NOT NULL, has_steps INTEGER NOT NULL
+);
+-- Preparation steps of a recipe (ingredient is NULL) or of a composite ingredient
+CREATE TABLE IF NOT EXISTS steps (
+    recipe INTEGER NOT NULL REFERENCES recipes, ingredient INTEGER REFERENCES ingredients,
+    position INTEGER NOT NULL, text TEXT
+);
+CREATE TABLE IF NOT EXISTS related (recipe INTEGER NOT NULL REFERENCES recipes, ref TEXT NOT NULL, text TEXT);
+-- Normalized ingredient words of each recipe, for QUESTION 13 (see similarity.get_ingredient_tokens)
+CREATE TABLE IF NOT EXISTS tokens (token TEXT NOT NULL, recipe INTEGER NOT NULL REFERENCES recipes);
+"""
+
+# Created after the bulk load, which is faster than maintaining them row by row
+INDEXES = """
+CREATE INDEX IF NOT EXISTS recipes_title ON recipes (title);
+CREATE INDEX IF NOT EXISTS recipes_steps ON recipes (steps);
+CREATE INDEX IF NOT EXISTS recipes_total_amount ON recipes (total_amount);
+CREATE INDEX IF NOT EXISTS nutrition_calories ON nutrition (calories);
+CREATE INDEX IF NOT EXISTS nutrition_fat ON nutrition (fat);
+CREATE INDEX IF NOT EXISTS ingredients_recipe ON ingredients (recipe);
+CREATE INDEX IF NOT EXISTS ingredients_name ON ingredients (name, recipe);
+CREATE INDEX IF NOT EXISTS ingredients_unit ON ingredients (unit);
+CREATE INDEX IF NOT EXISTS steps_recipe ON steps (recipe, ingredient, position);
+CREATE INDEX IF NOT EXISTS related_recipe ON related (recipe);
+CREATE INDEX IF NOT EXISTS tokens_token ON tokens (token, recipe);
+"""
+
+
+class RecipeStore:
+    """
+    A recipes collection in an SQLite database.
+    Recipes rebuilt from the tables are kept (weakly) while in use, so asking twice gives the same object.
+    The connection can be used from several threads, one query at a time.
+    """
+
+    def __init__(self, path: str):
+        """
+        Opens (or creates) a database.
+        :param path: database file, or ':memory:'
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.cache = weakref.WeakValueDictionary()  # pos -> Recipe, while something uses it
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode = WAL")  # Readers in other processes don't block
+            self.connection.executescript(SCHEMA)
+
+    def query(self, sql: str, params=()):
+        """
+        Runs a query.
+        :param sql: SQL statement
+        :param params: its parameters
+        :return: list of rows
+        """
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def get_meta(self, key: str):
+        """Get a value from the meta table, or None."""
+        rows = self.query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def load(self, recipes, source_key=None):
+        """
+        Replaces the contents of the database with a collection, in a single transaction.
+        Recipes are inserted in batches while they're read, so a stream (iter_recipes()) never has to fit in memory.
+        :param recipes: recipes dict, or iterator of (id, Recipe) pairs
+        :param source_key: key of the XML file they come from (see snapshot.get_source_key)
+        """
+        from similarity import get_ingredient_tokens
+
+        names = {}  # Ingredient name -> id, only the distinct names are kept in memory
+        next_ingredient = 1
+        rows = {table: [] for table in ('recipes', 'nutrition', 'names', 'ingredients', 'steps', 'related', 'tokens')}
+        inserts = {
+            'recipes': "INSERT INTO recipes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            'nutrition': "INSERT INTO nutrition VALUES (?, ?, ?, ?, ?)",
+            'names': "INSERT INTO names VALUES (?, ?)",
+            'ingredients': "INSERT INTO ingredients VALUES (?, ?, ?, ?, ?, ?, ?)",
+            'steps': "INSERT INTO steps VALUES (?, ?, ?, ?)",
+            'related': "INSERT INTO related VALUES (?, ?, ?)",
+            'tokens': "INSERT INTO tokens VALUES (?, ?)",
+        }
+
+        def flush():
+            for table, table_rows in rows.items():
+                self.connection.executemany(inserts[table], table_rows)
+                table_rows.clear()
+
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA synchronous = OFF")
+            for table in ('tokens', 'related', 'steps', 'ingredients', 'names', 'nutrition', 'recipes', 'meta'):
+                self.connection.execute(f"DELETE FROM {table}")
+            self.cache.clear()
+
+            for pos, (rid, recipe) in enumerate(recipe_items(recipes)):
+                tokens = get_ingredient_tokens(recipe)
+                rows['recipes'].append((
+                    pos, rid, recipe.title, recipe.date.isoformat(), recipe.comment, get_step_count(recipe),
+                    sum(map(lambda x: x.amount, recipe.flat_ingredients)),
+                    len({i.name for i in recipe.flat_ingredients}), len(tokens)
+                ))
+                n = recipe.nutrition
+                rows['nutrition'].append((pos, n.calories, n.fat, n.carbohydrates, n.protein))
+                rows['steps'] += [(pos, None, i, step) for i, step in enumerate(recipe.preparation)]
+                if recipe.related is not None:
+                    rows['related'].append((pos, *recipe.related))
+                rows['tokens'] += [(token, pos) for token in tokens]
+
+                # Preorder walk, so ids follow flat_ingredients; parents are numbered before their children
+                stack = [(ingredient, None) for ingredient in reversed(recipe.ingredients)]
+                while stack:
+                    ingredient, parent = stack.pop()
+                    if ingredient.name not in names:
+                        names[ingredient.name] = len(names) + 1
+                        rows['names'].append((names[ingredient.name], ingredient.name))
+                    rows['ingredients'].append((next_ingredient, pos, parent, names[ingredient.name],
+                                                ingredient.amount, ingredient.unit, ingredient.preparation is not None))
+                    rows['steps'] += [(pos, next_ingredient, i, step) for i, step in enumerate(ingredient.preparation or ())]
+                    stack += [(child, next_ingredient) for child in reversed(ingredient.ingredients)]
+                    next_ingredient += 1
+
+                if pos % BATCH_SIZE == BATCH_SIZE - 1:
+                    flush()
+            flush()
+            for statement in filter(str.strip, INDEXES.split(';')):
+                self.connection.execute(statement)
+            size, mtime, digest = source_key or (None, None, None)
+            self.connection.executemany("INSERT INTO meta VALUES (?, ?)", [
+                ('format', STORE_FORMAT), ('size', size), ('mtime_ns', mtime), ('sha256', digest)])
+        with self.lock:
+            self.connection.execute("PRAGMA synchronous = NORMAL")
+            self.connection.execute("ANALYZE")
+
+    def get_recipes(self, positions):
+        """
+        Rebuilds recipes from the tables (or gets them from the cache).
+        :param positions: iterable of recipe positions
+        :return: list of Recipe objects, in the same order
+        """
+        positions = list(positions)
+        with self.lock:
+            recipes = {}  # Holds the cached ones while the others are built
+            for pos in dict.fromkeys(positions):
+                recipe = self.cache.get(pos)
+                if recipe is not None:
+                    recipes[pos] = recipe
+            missing = [pos for pos in dict.fromkeys(positions) if pos not in recipes]
+            for start in range(0, len(missing), CHUNK_SIZE):
+                built = self.build_recipes(missing[start:start + CHUNK_SIZE])
+                self.cache.update(built)
+                recipes.update(built)
+        return [recipes[pos] for pos in positions]
+
+    def build_recipes(self, positions: list):
+        """
+        Rebuilds a few recipes, with one query per table.
+        :param positions: recipe positions, at most CHUNK_SIZE
+        :return: dict of position -> Recipe
+        """
+        marks = ', '.join('?' * len(positions))
+        steps = defaultdict(list)  # (recipe position, ingredient id or None) -> step texts
+        for recipe, ingredient, text in self.query(
+                f"SELECT recipe, ingredient, text FROM steps WHERE recipe IN ({marks}) "
+                f"ORDER BY recipe, ingredient, position", positions):
+            steps[recipe, ingredient].append(text)
+
+        children = defaultdict(list)  # (recipe position, parent id or None) -> ingredient rows, in preorder
+        for row in self.query(
+                f"SELECT i.id, i.recipe, i.parent, n.name, i.amount, i.unit, i.has_steps FROM ingredients i "
+                f"JOIN names n ON n.id = i.name WHERE i.recipe IN ({marks}) ORDER BY i.id", positions):
+            children[row[1], row[2]].append(row)
+
+        def build_ingredient(row):
+            ingredient_id, recipe, _, name, amount, unit, has_steps = row
+            return Ingredient(name, amount, unit,
+                              list(map(build_ingredient, children[recipe, ingredient_id])),
+                              steps[recipe, ingredient_id] if has_steps else None)
+
+        related = {}  # recipe position -> (ref, text) of its first related element
+        for recipe, ref, text in self.query(
+                f"SELECT recipe, ref, text FROM related WHERE recipe IN ({marks}) ORDER BY rowid", positions):
+            related.setdefault(recipe, (ref, text))
+
+        return {
+            pos: Recipe(
+                title,
+                datetime.fromisoformat(date),
+                list(map(build_ingredient, children[pos, None])),
+                steps[pos, None],
+                comment,
+                NutritionInfo(calories, fat, carbohydrates, protein),
+                related.get(pos)
+            )
+            for pos, title, date, comment, calories, fat, carbohydrates, protein in self.query(
+                f"SELECT r.pos, r.title, r.date, r.comment, n.calories, n.fat, n.carbohydrates, n.protein "
+                f"FROM recipes r JOIN nutrition n ON n.recipe = r.pos WHERE r.pos IN ({marks})", positions)
+        }
+
+    def select_recipes(self, sql: str, params=()):
+        """
+        Get the recipes picked by a query.
+        :param sql: query whose first column is the recipe position
+        :param params: its parameters
+        :return: list of Recipe objects, in the order of the query
+        """
+        return self.get_recipes(row[0] for row in self.query(sql, params))
+
+    def __len__(self):
+        return self.query("SELECT count(*) FROM recipes")[0][0]
+
+    def close(self):
+        """Closes the connection."""
+        with self.lock:
+            self.connection.close()
+
+
+def init_store(filename='recipes.xml', database=None, ns_prefix='rcp', ns_uri='http://www.brics.dk/ixwt/recipes'):
+    """
+    Opens the database of an XML file, (re)loading it from the file if it's missing or stale.
+    :param filename: path to the XML file
+    :param database: path to the database (default: next to the XML file, '.sqlite' added)
+    :param ns_prefix: XML namespace prefix
+    :param ns_uri: XML namespace URI
+    :return: RecipeStore, or None if the XML file doesn't exist
+    """
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        print(f"Error importing recipes: {filename} file not found")
+        return None
+    store = RecipeStore(database or filename + '.sqlite')
+    # Size and mtime first, the file only gets hashed when they match
+    if (store.get_meta('format') != STORE_FORMAT
+            or (store.get_meta('size'), store.get_meta('mtime_ns')) != (stat.st_size, stat.st_mtime_ns)
+            or store.get_meta('sha256') != get_source_key(filename, stat)[2]):
+        store.load(rps.iter_recipes(filename, ns_prefix, ns_uri), get_source_key(filename, stat))
+    return store
+
+
+def get_recipe(store: RecipeStore, title: str):
+    """
+    Get a recipe by its title (the first one, if several have it).
+    :param store: recipes store
+    :param title: EXACT title of recipe
+    :return: Recipe object or None
+    """
+    recipes = store.select_recipes("SELECT pos FROM recipes WHERE title = ? ORDER BY pos LIMIT 1", (title,))
+    return recipes[0] if recipes else None
+
+
+def get_recipe_titles(store: RecipeStore):
+    """QUESTION 4, see repositories.py."""
+    return [row[0] for row in store.query("SELECT title FROM recipes ORDER BY pos")]
+
+
+def get_total_ingredient_count(store: RecipeStore, ing_name: str):
+    """QUESTION 5, see repositories.py."""
+    return store.query(f"SELECT coalesce(sum(amount), 0) FROM ingredients WHERE name IN ({NAME_IDS})",
+                       (ing_name,))[0][0]
+
+
+def get_recipes_with_ingredient(store: RecipeStore, ing_name: str):
+    """QUESTION 6, see repositories.py."""
+    return store.select_recipes(f"SELECT DISTINCT recipe FROM ingredients "
+                                f"WHERE name IN ({NAME_IDS}) ORDER BY recipe", (ing_name,))
+
+
+def get_all_ingredient_counts(store: RecipeStore, ing_name: str):
+    """QUESTION 7, see repositories.py."""
+    counts = dict(store.query("SELECT id, 0 FROM recipes ORDER BY pos"))  # Recipes without the ingredient count too
+    counts.update(store.query(
+        f"SELECT r.id, sum(i.amount) FROM ingredients i JOIN recipes r ON r.pos = i.recipe "
+        f"WHERE i.name IN ({NAME_IDS}) GROUP BY i.recipe", (ing_name,)))
+    return counts
+
+
+def filter_under_calories(store: RecipeStore, calories: float):
+    """QUESTION 8, see repositories.py."""
+    return store.select_recipes("SELECT recipe FROM nutrition WHERE calories < ? ORDER BY recipe", (calories,))
+
+
+# QUESTIONS 9 and 10 only read the recipe they're given
+get_amount_str = rps.get_amount_str
+get_prep_steps = rps.get_prep_steps
+
+
+def filter_above_steps(store: RecipeStore, steps: int):
+    """QUESTION 11, see repositories.py."""
+    return store.select_recipes("SELECT pos FROM recipes WHERE steps > ? ORDER BY pos", (steps,))
+
+
+def filter_by_no_ingredient(store: RecipeStore, ingredient: str):
+    """QUESTION 12, see repositories.py."""
+    return store.select_recipes(f"SELECT pos FROM recipes WHERE pos NOT IN (SELECT recipe FROM ingredients "
+                                f"WHERE name IN ({NAME_IDS})) ORDER BY pos", (ingredient,))
+
+
+def get_similar_recipes(store: RecipeStore, recipe1: Recipe, k: int = None):
+    """QUESTION 13, see repositories.py: recipes sharing ingredient words with recipe1, by Jaccard similarity."""
+    from similarity import SimilarityIndex, get_ingredient_tokens
+
+    tokens = list(get_ingredient_tokens(recipe1))
+    # Tokens go as a single JSON array parameter, however many the recipe has
+    scores = [(pos, SimilarityIndex.get_score(inter, len(tokens), size, 'jaccard')) for pos, inter, size in store.query(
+        "SELECT t.recipe, count(*), r.token_count FROM tokens t JOIN recipes r ON r.pos = t.recipe "
+        "WHERE t.token IN (SELECT value FROM json_each(?)) GROUP BY t.recipe", (json.dumps(tokens),))]
+    scores.sort(key=lambda x: (-x[1], x[0]))
+    return store.get_recipes(pos for pos, _ in scores[:k])
+
+
+def max_calories(store: RecipeStore):
+    """QUESTION 14, see repositories.py."""
+    return store.select_recipes("SELECT recipe FROM nutrition ORDER BY calories DESC, recipe LIMIT 1")[0]
+
+
+def get_most_common_unit(store: RecipeStore):
+    """QUESTION 15, see repositories.py."""
+    return store.query("SELECT unit FROM ingredients WHERE unit != 'None' "
+                       "GROUP BY unit ORDER BY count(*) DESC, min(id) LIMIT 1")[0][0]
+
+
+def get_diff_ingredient_count(store: RecipeStore):
+    """QUESTION 16, see repositories.py."""
+    return [row[0] for row in store.query("SELECT ingredient_count FROM recipes ORDER BY pos")]
+
+
+def max_fat(store: RecipeStore):
+    """QUESTION 17, see repositories.py."""
+    return store.select_recipes("SELECT recipe FROM nutrition ORDER BY fat DESC, recipe LIMIT 1")[0]
+
+
+def get_most_common_ingredient(store: RecipeStore):
+    """QUESTION 18, see repositories.py."""
+    # Name ids follow first appearance, so ties go to the first name seen, as with Counter
+    return store.query("SELECT n.name FROM ingredients i JOIN names n ON n.id = i.name "
+                       "GROUP BY i.name ORDER BY count(*) DESC, i.name LIMIT 1")[0][0]
+
+
+def sort_by_ingredient_count(store: RecipeStore):
+    """QUESTION 19, see repositories.py."""
+    return store.select_recipes("SELECT pos FROM recipes ORDER BY total_amount DESC, pos")
+
+
+def get_ingredient_usages(store: RecipeStore):
+    """QUESTION 20, see repositories.py."""
+    rows = store.query("SELECT DISTINCT n.name, i.recipe FROM ingredients i JOIN names n ON n.id = i.name "
+                       "ORDER BY i.name, i.recipe")
+    positions = list(dict.fromkeys(pos for _, pos in rows))  # Each recipe rebuilt once
+    recipes = dict(zip(positions, store.get_recipes(positions)))
+    usages = {}
+    for name, pos in rows:
+        usages.setdefault(name, []).append(recipes[pos])
+    return usages
+
+
+def get_recipe_repartition(store: RecipeStore):
+    """QUESTION 21, see repositories.py."""
+    return Counter(dict(store.query("SELECT steps, count(*) FROM recipes GROUP BY steps ORDER BY min(pos)")))
+
+
+def get_easiest_recipe(store: RecipeStore):
+    """QUESTION 22, see repositories.py."""
+    return store.select_recipes("SELECT pos FROM recipes ORDER BY steps, pos LIMIT 1")[0]
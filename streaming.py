@@ -0,0 +1,196 @@
+"""File: streaming.py
+Streaming top-k aggregators, to count units or ingredient names over recipe streams in bounded memory.
+The exact one keeps a count per distinct value; the approximate ones (Space-Saving, Count-Min Sketch)
+keep a fixed number of counters whatever the number of distinct values."""
+
+import hashlib
+import heapq
+from collections import Counter
+
+from helper import *
+
+
+def iter_units(recipes):
+    """
+    Streams the unit of every ingredient, nested ones included, leaving out the ones without a unit.
+    :param recipes: recipes dict, or iterator of (id, Recipe) pairs
+    :return: generator of str units
+    """
+    return (ingredient.unit for ingredient in iter_ingredients(recipes) if ingredient.unit != 'None')
+
+
+def iter_ingredient_names(recipes):
+    """
+    Streams the name of every ingredient, nested ones included.
+    :param recipes: recipes dict, or iterator of (id, Recipe) pairs
+    :return: generator of str names
+    """
+    return (ingredient.name for ingredient in iter_ingredients(recipes))
+
+
+class ExactTopK:
+    """
+    Exact counts, one per distinct value: memory grows with the number of distinct values, not of items.
+    On ties, the first value seen comes first (as with Counter.most_common).
+    """
+
+    def __init__(self, capacity: int = None):
+        """
+        :param capacity: unused, for the same signature as the approximate aggregators
+        """
+        self.counts = Counter()
+        self.total = 0
+
+    def add(self, item, count: int = 1):
+        """Counts an item."""
+        self.counts[item] += count
+        self.total += count
+
+    def update(self, items):
+        """Counts every item of an iterable."""
+        for item in items:
+            self.add(item)
+
+    def top_k(self, k: int = None):
+        """
+        Get the most frequent items.
+        :param k: number of items, or None for all of them
+        :return: list of (item, count) pairs, most frequent first
+        """
+        return self.counts.most_common(k)
+
+
+class SpaceSaving(ExactTopK):
+    """
+    Space-Saving heavy hitters: at most capacity counters. When they're all taken, a new item replaces
+    the one with the smallest count, and inherits it (as its possible error).
+    Any item seen more than total / capacity times is guaranteed to be counted, overestimated by at most its error.
+    The smallest counter is found with a heap, whose outdated entries are skipped lazily.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        """
+        :param capacity: maximum number of counters
+        """
+        super().__init__()
+        self.capacity = capacity
+        self.counts = {}  # item -> counted occurrences (overestimated by up to its error)
+        self.errors = {}  # item -> count it inherited when it replaced another item
+        self.heap = []  # (count, order, item) entries, some of them outdated
+        self.order = 0  # Insertion counter, so ties are broken by arrival in the heap
+
+    def add(self, item, count: int = 1):
+        self.total += count
+        if item in self.counts:
+            self.counts[item] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+        else:
+            smallest, evicted = self.pop_smallest()
+            del self.counts[evicted], self.errors[evicted]
+            self.counts[item] = smallest + count
+            self.errors[item] = smallest
+        self.order += 1
+        heapq.heappush(self.heap, (self.counts[item], self.order, item))
+        if len(self.heap) > 4 * self.capacity:  # Too many outdated entries: rebuild it from the counters
+            self.heap = [(c, i, x) for i, (x, c) in enumerate(self.counts.items())]
+            heapq.heapify(self.heap)
+
+    def pop_smallest(self):
+        """
+        Removes the smallest counter from the heap.
+        :return: (count, item) of the smallest counter
+        """
+        while True:
+            count, _, item = heapq.heappop(self.heap)
+            if self.counts.get(item) == count:  # Otherwise the entry is outdated
+                return count, item
+
+    def top_k(self, k: int = None):
+        return sorted(self.counts.items(), key=lambda x: -x[1])[:k]
+
+    def get_bounds(self, item):
+        """
+        Get the range the true count of an item is in.
+        :param item: counted item
+        :return: (lower bound, upper bound), (0, smallest count) for an item without a counter
+        """
+        if item in self.counts:
+            return self.counts[item] - self.errors[item], self.counts[item]
+        return 0, min(self.counts.values(), default=0)
+
+
+class CountMinTopK(ExactTopK):
+    """
+    Count-Min Sketch, with the most frequent candidates kept aside to answer top-k.
+    The sketch is depth rows of width counters; an item increments one counter per row, and its estimate is
+    the smallest of them: never below the true count, and above it by at most 2 * total / width,
+    with probability 1 - 0.5 ** depth.
+    """
+
+    def __init__(self, capacity: int = 1000, width: int = 2048, depth: int = 5):
+        """
+        :param capacity: number of candidates for top-k
+        :param width: counters per row
+        :param depth: number of rows (independent hash functions)
+        """
+        super().__init__()
+        self.capacity = capacity
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for _ in range(depth)]
+        self.candidates = {}  # item -> estimated count, pruned back to capacity when twice as big
+
+    def get_columns(self, item):
+        """
+        Get the counter of an item in each row, by double hashing a single 128 bits digest.
+        :param item: str item
+        :return: list of column indexes, one per row
+        """
+        digest = hashlib.blake2b(str(item).encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, item, count: int = 1):
+        self.total += count
+        estimate = float('inf')
+        for row, column in zip(self.rows, self.get_columns(item)):
+            row[column] += count
+            estimate = min(estimate, row[column])
+        self.candidates[item] = estimate
+        if len(self.candidates) > 2 * self.capacity:
+            self.candidates = dict(self.top_k(self.capacity))
+
+    def estimate(self, item):
+        """
+        Get the estimated count of an item.
+        :param item: str item
+        :return: estimate, never below the true count
+        """
+        return min(row[column] for row, column in zip(self.rows, self.get_columns(item)))
+
+    def top_k(self, k: int = None):
+        return sorted(self.candidates.items(), key=lambda x: -x[1])[:k]
+
+
+# Aggregator class by mode name
+AGGREGATORS = {
+    'exact': ExactTopK,
+    'space_saving': SpaceSaving,
+    'count_min': CountMinTopK,
+}
+
+
+def stream_top_k(items, k: int = None, mode: str = 'exact', capacity: int = 1000):
+    """
+    Get the most frequent items of a stream, reading it once.
+    :param items: iterable of items, e.g. iter_units(iter_recipes())
+    :param k: number of items, or None for all of them
+    :param mode: 'exact', 'space_saving' or 'count_min' (see AGGREGATORS)
+    :param capacity: number of counters (approximate modes only)
+    :return: list of (item, count) pairs, most frequent first; approximate counts can be overestimated
+    """
+    aggregator = AGGREGATORS[mode](capacity)
+    aggregator.update(items)
+    return aggregator.top_k(k)
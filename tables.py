@@ -0,0 +1,187 @@
+"""File: tables.py
+Holds columnar (NumPy) views of a recipes collection, for vectorized filters and extremes."""
+
+from abc import ABC, abstractmethod
+from collections import Counter
+
+import numpy as np
+
+from helper import *
+
+
+class RecipeTable(ABC):
+    """
+    Base class for a columnar table: one float array per column, aligned with the recipe ids and objects.
+    Subclasses only have to name their COLUMNS and say how to get a row out of a recipe.
+    Used as an index: get_index(recipes, SomeTable) builds it once per collection.
+    """
+    COLUMNS = ()
+
+    def __init__(self, recipes):
+        """
+        Builds every column in a single pass over the recipes.
+        :param recipes: recipes dict, or iterator of (id, Recipe) pairs
+        """
+        ids = []
+        self.recipes = []  # Recipe objects, aligned with the columns
+        rows = []
+        for rid, recipe in recipe_items(recipes):
+            ids.append(rid)
+            self.recipes.append(recipe)
+            rows.append(self.get_row(recipe))
+
+        self.ids = np.array(ids, dtype=object)
+        values = np.array(rows, dtype=float).reshape(len(rows), len(self.COLUMNS))
+        self.columns = dict(zip(self.COLUMNS, values.T.copy()))  # Copy so each column is contiguous
+
+    @abstractmethod
+    def get_row(self, recipe: Recipe):
+        """
+        Get the values of a recipe, one per column.
+        :param recipe: Recipe object
+        :return: tuple of floats, in COLUMNS order
+        """
+
+    def apply(self, recipes, changes: RecipeChanges):
+        """
+        Updates the table after RecipeCollection.apply(): only the rows of the changed and added recipes are computed.
+        :param recipes: collection the changes were applied to
+        :param changes: RecipeChanges
+        """
+        ids = self.ids.tolist()
+        positions = dict(zip(ids, range(len(ids))))
+        values = np.column_stack([self.columns[column] for column in self.COLUMNS]).reshape(len(ids), len(self.COLUMNS))
+        for rid, (_, recipe) in changes.changed.items():
+            self.recipes[positions[rid]] = recipe
+            values[positions[rid]] = self.get_row(recipe)
+        if changes.removed:
+            keep = np.array([rid not in changes.removed for rid in ids], dtype=bool)
+            self.recipes = [recipe for recipe, kept in zip(self.recipes, keep) if kept]
+            ids = [rid for rid, kept in zip(ids, keep) if kept]
+            values = values[keep]
+        self.recipes += changes.added.values()
+        ids += changes.added.keys()
+        rows = np.array(list(map(self.get_row, changes.added.values())), dtype=float).reshape(-1, len(self.COLUMNS))
+        values = np.concatenate((values, rows))
+        self.ids = np.array(ids, dtype=object)
+        self.columns = dict(zip(self.COLUMNS, values.T.copy()))
+
+    def __len__(self):
+        return len(self.recipes)
+
+    def select(self, mask):
+        """
+        Get the recipes picked by a boolean mask or an array of positions, in table order.
+        :param mask: boolean array aligned with the table, or array of positions
+        :return: list of Recipe objects
+        """
+        positions = np.flatnonzero(mask) if np.asarray(mask).dtype == bool else mask
+        return [self.recipes[i] for i in positions]
+
+    def below(self, column: str, threshold: float):
+        """
+        Get the recipes whose value is strictly under a threshold.
+        :param column: column name
+        :param threshold: exclusive upper bound
+        :return: list of Recipe objects
+        """
+        return self.select(self.columns[column] < threshold)
+
+    def above(self, column: str, threshold: float):
+        """
+        Get the recipes whose value is strictly over a threshold.
+        :param column: column name
+        :param threshold: exclusive lower bound
+        :return: list of Recipe objects
+        """
+        return self.select(self.columns[column] > threshold)
+
+    def between(self, column: str, low: float, high: float):
+        """
+        Get the recipes whose value is within a range.
+        :param column: column name
+        :param low: inclusive lower bound
+        :param high: inclusive upper bound
+        :return: list of Recipe objects
+        """
+        values = self.columns[column]
+        return self.select((values >= low) & (values <= high))
+
+    def argmax(self, column: str):
+        """
+        Get the recipe with the highest value (the first one, on ties).
+        :param column: column name
+        :return: Recipe object
+        """
+        return self.recipes[int(np.argmax(self.columns[column]))]
+
+    def argmin(self, column: str):
+        """
+        Get the recipe with the lowest value (the first one, on ties).
+        :param column: column name
+        :return: Recipe object
+        """
+        return self.recipes[int(np.argmin(self.columns[column]))]
+
+    def top_k(self, column: str, k: int, largest: bool = True):
+        """
+        Get the k recipes with the highest (or lowest) values, best first.
+        Only the k best are sorted, the rest is just partitioned away.
+        :param column: column name
+        :param k: number of recipes
+        :param largest: True for the highest values, False for the lowest
+        :return: list of Recipe objects
+        """
+        values = -self.columns[column] if largest else self.columns[column]
+        k = min(k, len(values))
+        if k <= 0:
+            return []
+        kth = np.partition(values, k - 1)[k - 1]
+        # Everything strictly better than the k-th value, then the first of its ties, so ties stay in table order
+        better = np.flatnonzero(values < kth)
+        positions = np.concatenate((better, np.flatnonzero(values == kth)[:k - len(better)]))
+        positions.sort()
+        return self.select(positions[np.argsort(values[positions], kind='stable')])
+
+    def sort(self, column: str, reverse: bool = False):
+        """
+        Get all recipes sorted by a column, like sorted() would (ties stay in table order, even reversed).
+        :param column: column name
+        :param reverse: True for decreasing order
+        :return: list of Recipe objects
+        """
+        values = -self.columns[column] if reverse else self.columns[column]
+        return self.select(np.argsort(values, kind='stable'))
+
+    def histogram(self, column: str):
+        """
+        Count how many recipes have each value of a column.
+        :param column: column name
+        :return: Counter of value -> number of recipes, values in order of first appearance
+        """
+        values, first, counts = np.unique(self.columns[column], return_index=True, return_counts=True)
+        order = np.argsort(first)
+        return Counter(dict(zip(values[order].tolist(), counts[order].tolist())))
+
+
+class NutritionTable(RecipeTable):
+    """Columnar nutrition information of a recipes collection."""
+    COLUMNS = ('calories', 'fat', 'carbohydrates', 'protein')
+
+    def get_row(self, recipe: Recipe):
+        nutrition = recipe.nutrition
+        return nutrition.calories, nutrition.fat, nutrition.carbohydrates, nutrition.protein
+
+
+class MetricsTable(RecipeTable):
+    """
+    Per-recipe aggregates that would otherwise be recomputed on every query:
+    total step count (nested ingredients' steps included), total ingredient amount,
+    and number of distinct ingredients (by name, nested ones included: an ingredient used twice counts once).
+    """
+    COLUMNS = ('steps', 'total_amount', 'ingredient_count')
+
+    def get_row(self, recipe: Recipe):
+        return (get_step_count(recipe),
+                sum(map(lambda x: x.amount, recipe.flat_ingredients)),
+                len({i.name for i in recipe.flat_ingredients}))
@@ -0,0 +1,217 @@
+"""File: tree.py
+Holds the ingredient trees of a whole collection as flat NumPy arrays, in preorder:
+the ingredients of any recipe or composite ingredient are then a contiguous range, and aggregates are slices.
+Can be built from a collection, or straight from the XML file without building any Recipe or Ingredient object."""
+
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from helper import *
+
+
+class IngredientTree:
+    """
+    Every ingredient of a collection, nested ones included, numbered in preorder (flat_ingredients order),
+    recipe after recipe. A node's subtree is the range [node, end[node]): itself, then its nested ingredients.
+    Columns, one value per node:
+        names: id of the name in self.name_list
+        amounts: amount ('*' is 0)
+        units: id of the unit in self.unit_list ('None' for no unit, as in the Ingredient objects)
+        parents: node of the composite ingredient it's in, -1 at the top of a recipe
+        ends: node after its subtree
+        steps: number of preparation steps of its own
+    Recipes, in collection order: ids, titles, starts (its nodes are [starts[i], starts[i + 1])) and recipe_steps.
+    Used as an index: get_index(recipes, IngredientTree) builds it once per collection.
+    """
+
+    def __init__(self, recipes=()):
+        """
+        Builds the arrays in a single pass over the recipes.
+        :param recipes: recipes dict, or iterator of (id, Recipe) pairs
+        """
+        builder = TreeBuilder()
+        for rid, recipe in recipe_items(recipes):
+            for ingredient in recipe.ingredients:
+                self.add_ingredient(builder, ingredient)
+            builder.end_recipe(rid, recipe.title, len(recipe.preparation))
+        builder.build(self)
+
+    @classmethod
+    def add_ingredient(cls, builder: 'TreeBuilder', ingredient: Ingredient):
+        """Adds an ingredient and its nested ones, recursively like they were parsed."""
+        builder.start_ingredient(ingredient.name, ingredient.amount, ingredient.unit)
+        for nested in ingredient.ingredients:
+            cls.add_ingredient(builder, nested)
+        builder.add_steps(len(ingredient.preparation) if ingredient.preparation is not None else 0)
+        builder.end_ingredient()
+
+    @classmethod
+    def from_xml(cls, filename='recipes.xml', ns_prefix='rcp', ns_uri='http://www.brics.dk/ixwt/recipes'):
+        """
+        Reads the trees straight from an XML file, streamed like repositories.iter_recipes():
+        values go from the XML events into the arrays, no Recipe or Ingredient object is built.
+        :param filename: path to the XML file
+        :param ns_prefix: XML namespace prefix (unused, for the same signature as init_recipes)
+        :param ns_uri: XML namespace URI
+        :return: IngredientTree
+        """
+        tag = {name: f"{{{ns_uri}}}{name}" for name in ('recipe', 'ingredient', 'step', 'title')}
+        builder = TreeBuilder()
+        root = None
+        steps = 0  # Steps of the recipe itself
+        for event, elem in ET.iterparse(filename, events=('start', 'end')):
+            if root is None:
+                root = elem
+            elif event == 'start':
+                if elem.tag == tag['ingredient']:
+                    amount = elem.attrib.get('amount', '*')
+                    builder.start_ingredient(str(elem.attrib.get('name', None)),
+                                             0 if amount == '*' else float(amount),
+                                             str(elem.attrib.get('unit', None)))
+            elif elem.tag == tag['ingredient']:
+                builder.end_ingredient()
+            elif elem.tag == tag['step']:
+                if builder.stack:  # In the preparation of the innermost ingredient
+                    builder.add_steps(1)
+                else:
+                    steps += 1
+            elif elem.tag == tag['recipe']:
+                builder.end_recipe(elem.attrib['id'], elem.find(tag['title']).text, steps)
+                steps = 0
+                elem.clear()
+                root.remove(elem)
+        tree = cls.__new__(cls)
+        builder.build(tree)
+        return tree
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_nodes(self, rid: str):
+        """
+        Get the nodes of a recipe.
+        :param rid: recipe id
+        :return: range of nodes
+        """
+        i = self.positions[rid]
+        return range(int(self.starts[i]), int(self.starts[i + 1]))
+
+    def get_children(self, node: int = None, rid: str = None):
+        """
+        Get the ingredients directly in a composite ingredient, or at the top of a recipe.
+        :param node: composite ingredient node
+        :param rid: recipe id, if node is None
+        :return: list of nodes
+        """
+        if node is not None:
+            child, end = node + 1, int(self.ends[node])
+        else:
+            child, end = self.get_nodes(rid).start, self.get_nodes(rid).stop
+        ret = []
+        while child < end:
+            ret.append(child)
+            child = int(self.ends[child])
+        return ret
+
+    def find(self, rid: str, name: str):
+        """
+        Get the nodes of a recipe whose name contains a text.
+        :param rid: recipe id
+        :param name: ingredient name substring
+        :return: array of nodes, in preorder
+        """
+        names = [i for i, x in enumerate(self.name_list) if name in x]
+        nodes = self.get_nodes(rid)
+        return nodes.start + np.flatnonzero(np.isin(self.names[nodes.start:nodes.stop], names))
+
+    def get_name(self, node: int):
+        """Get the name of an ingredient."""
+        return self.name_list[self.names[node]]
+
+    def get_unit(self, node: int):
+        """Get the unit of an ingredient ('None' for no unit)."""
+        return self.unit_list[self.units[node]]
+
+    def get_subtree_amount(self, node: int):
+        """Get the total amount of an ingredient and its nested ones."""
+        return float(self.amounts[node:self.ends[node]].sum())
+
+    def get_subtree_size(self, node: int):
+        """Get the number of ingredients in a subtree, the ingredient itself included."""
+        return int(self.ends[node]) - node
+
+    def get_subtree_steps(self, node: int):
+        """Get the number of preparation steps of an ingredient and its nested ones."""
+        return int(self.steps[node:self.ends[node]].sum())
+
+    def get_recipe_totals(self, column: str):
+        """
+        Sums a column over the ingredients of each recipe, all recipes at once.
+        :param column: 'amounts', 'steps', or 'count' for the number of ingredients
+        :return: array aligned with self.ids
+        """
+        if column == 'count':
+            return np.diff(self.starts)
+        values = getattr(self, column)
+        # reduceat() gives the value at a start for an empty range instead of 0, hence the padding and the mask
+        totals = np.add.reduceat(np.append(values, 0), self.starts[:-1]) if len(self.ids) else values[:0]
+        return np.where(np.diff(self.starts) > 0, totals, 0)
+
+    def get_step_counts(self):
+        """
+        Get the total number of steps of each recipe, nested ingredients' included (as helper.get_step_count).
+        :return: int array aligned with self.ids
+        """
+        return self.recipe_steps + self.get_recipe_totals('steps')
+
+
+class TreeBuilder:
+    """Collects the columns of an IngredientTree in lists, ingredient by ingredient, then turns them into arrays."""
+
+    def __init__(self):
+        self.name_ids = {}  # name -> id, by first appearance
+        self.unit_ids = {}  # unit -> id, by first appearance
+        self.columns = {'names': [], 'amounts': [], 'units': [], 'parents': [], 'ends': [], 'steps': []}
+        self.stack = []  # Nodes of the ingredients being read, innermost last
+        self.ids, self.titles, self.starts, self.recipe_steps = [], [], [0], []
+
+    def start_ingredient(self, name: str, amount: float, unit: str):
+        """Adds a node, for an ingredient whose nested ones come next."""
+        columns = self.columns
+        self.stack.append(len(columns['names']))
+        columns['names'].append(self.name_ids.setdefault(name, len(self.name_ids)))
+        columns['amounts'].append(amount)
+        columns['units'].append(self.unit_ids.setdefault(unit, len(self.unit_ids)))
+        columns['parents'].append(self.stack[-2] if len(self.stack) > 1 else -1)
+        columns['ends'].append(0)
+        columns['steps'].append(0)
+
+    def add_steps(self, count: int):
+        """Counts preparation steps of the innermost ingredient being read."""
+        self.columns['steps'][self.stack[-1]] += count
+
+    def end_ingredient(self):
+        """Closes the innermost ingredient being read: its subtree ends here."""
+        self.columns['ends'][self.stack.pop()] = len(self.columns['names'])
+
+    def end_recipe(self, rid: str, title: str, steps: int):
+        """Closes a recipe, whose ingredients are the nodes added since the previous one."""
+        self.ids.append(rid)
+        self.titles.append(title)
+        self.starts.append(len(self.columns['names']))
+        self.recipe_steps.append(steps)
+
+    def build(self, tree: IngredientTree):
+        """Sets the arrays of a tree."""
+        types = {'names': np.int32, 'amounts': np.float64, 'units': np.int32,
+                 'parents': np.int64, 'ends': np.int64, 'steps': np.int32}
+        for column, values in self.columns.items():
+            setattr(tree, column, np.array(values, dtype=types[column]))
+        tree.name_list = list(self.name_ids)
+        tree.unit_list = list(self.unit_ids)
+        tree.ids = self.ids
+        tree.titles = self.titles
+        tree.positions = {rid: i for i, rid in enumerate(self.ids)}
+        tree.starts = np.array(self.starts, dtype=np.int64)
+        tree.recipe_steps = np.array(self.recipe_steps, dtype=np.int64)
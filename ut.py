@@ -1,6 +1,7 @@
 """File: ut.py
 Houses any functions used as helpers for unit testing."""
 
+import time
 from pprint import *
 
 
@@ -10,8 +11,11 @@ def ut_print(callable, *args):
     print("---------------")
     print(f"N°{ut_print.call_count} - Testing {callable.__name__}")
     print("---------------")
+    start = time.perf_counter()
     ret = callable(*args)
+    elapsed = time.perf_counter() - start
     pprint(ret)
+    print(f"({elapsed * 1000:.3f} ms)")
 
     ## new lines
     print()
@@ -21,10 +25,12 @@ ut_print.call_count = 0
 
 
 def ut_repr(callable, *args):
-    """Helper method to test functions"""
-    print("---------------")
-    print(f"Testing {callable.__name__}")
-    print("---------------")
+    """
+    Helper method to test functions, without printing anything (the GUI runs it for every test).
+    :return: (formatted result, elapsed seconds of the call)
+    """
+    start = time.perf_counter()
     ret = callable(*args)
-    return pformat(ret)
+    elapsed = time.perf_counter() - start
+    return pformat(ret), elapsed
 
@@ -0,0 +1,78 @@
+"""File: watch.py
+Live reload: watches the recipes XML file, and applies its edits to the loaded collection as they are saved.
+Usage: watcher = RecipeWatcher(recipes, 'recipes.xml'); then watcher.check() now and then, or watcher.watch()"""
+
+import os
+import time
+from xml.etree.ElementTree import ParseError
+
+import repositories as rps
+from helper import *
+
+
+class RecipeWatcher:
+    """
+    Polls the size and modification time of an XML file, and reloads it into its collection when they change
+    (see repositories.reload_recipes()). Only os.stat() is called while the file doesn't change.
+    A file that can't be parsed (saved halfway) is read again on the next check, the collection is left as is.
+    Clients tell that their results went stale from the version of the collection.
+    """
+
+    def __init__(self, recipes: RecipeCollection, filename: str = 'recipes.xml', **kwargs):
+        """
+        :param recipes: collection returned by init_recipes() for the file
+        :param filename: path to the XML file
+        :param kwargs: other arguments given to init_recipes() (ns_uri, compact...)
+        """
+        self.recipes = recipes
+        self.filename = filename
+        self.kwargs = kwargs
+        self.key = self.get_key()
+
+    def get_key(self):
+        """
+        Get what tells that the file changed.
+        :return: (size, mtime in ns), or None if the file doesn't exist (yet)
+        """
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def check(self):
+        """
+        Reloads the file if it changed since the last check.
+        :return: RecipeChanges applied to the collection, or None if the file didn't change or can't be read yet
+        """
+        key = self.get_key()
+        if key is None or key == self.key:
+            return None
+        try:
+            changes = rps.reload_recipes(self.recipes, self.filename, **self.kwargs)
+        except (ParseError, FileNotFoundError):
+            return None
+        self.key = key
+        return changes
+
+    def watch(self, interval: float = 1.0):
+        """
+        Checks the file forever.
+        :param interval: seconds between two checks
+        :return: generator of the non-empty RecipeChanges, as they are applied
+        """
+        while True:
+            changes = self.check()
+            if changes:
+                yield changes
+            time.sleep(interval)
+
+
+if __name__ == '__main__':
+    recipes = rps.init_recipes()
+    print(f"{len(recipes)} recipes, version {recipes.version}; watching recipes.xml (Ctrl+C to stop)")
+    try:
+        for changes in RecipeWatcher(recipes).watch():
+            print(f"Reloaded: {changes}, version {recipes.version}")
+    except KeyboardInterrupt:
+        pass